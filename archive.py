@@ -0,0 +1,369 @@
+"""Compact binary archives of ledger snapshots.
+
+The page's snapshot (``saveCardData``, :meth:`ledger.Ledger.snapshot`) is
+JSON with every loan and history row spelled out. An archive holds the
+same data as unsigned LEB128 varints, table by table and column by
+column, with each timestamp stored as the difference from the previous
+one; the page reads and writes the same format (``encodeArchive``)::
+
+    magic "MTXL", format version, seq
+    cards        count; id and label per card; balances, transactions, versions
+    loans        count; card, amount, timestamp, repaid timestamp, rate,
+                 installments and paid installments columns
+    history      count; type, card, counterparty, amount, timestamp columns
+    checkpoints  count; per checkpoint row, time and its three card columns
+
+Signed values are zigzag encoded. Nullable values are stored plus one,
+with zero for null; a settled loan's repayment time is relative to when
+it was taken. Format 1 archives, from before loan terms, have no rate
+or installment columns and read as loans on default terms. Archives can
+simply be concatenated, so a whole event's games fit in one file and
+load one at a time::
+
+    python archive.py pack games/*.json -o event.mtx
+    python archive.py unpack event.mtx          # one JSON snapshot per line
+"""
+
+import argparse
+import io
+import json
+import sys
+
+from ledger import LOAN_RATE, SNAPSHOT_VERSION
+
+MAGIC = b"MTXL"
+FORMAT_VERSION = 2
+HISTORY_TYPES = ("transfer", "bid", "loan", "repay", "payout", "charge", "installment", "interest")
+READ_SIZE = 1 << 16
+
+
+class ArchiveError(ValueError):
+    """The data is not a readable archive."""
+
+
+class _Writer:
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def varint(self, value):
+        if not isinstance(value, int) or value < 0:
+            raise ArchiveError("cannot encode %r" % (value,))
+        buffer = self.buffer
+        while value >= 0x80:
+            buffer.append((value & 0x7F) | 0x80)
+            value >>= 7
+        buffer.append(value)
+
+    def signed(self, value):
+        self.varint(value * 2 if value >= 0 else -value * 2 - 1)
+
+    def stamp(self, value, previous):
+        if value is None:
+            self.varint(0)
+        else:
+            delta = value - (previous or 0)
+            self.varint((delta * 2 if delta >= 0 else -delta * 2 - 1) + 1)
+
+    def string(self, text):
+        data = text.encode("utf-8")
+        self.varint(len(data))
+        self.buffer += data
+
+    def take(self):
+        chunk, self.buffer = bytes(self.buffer), bytearray()
+        return chunk
+
+
+class _Reader:
+    """Decodes from a binary stream, reading it in blocks of at least
+    ``block_size`` bytes."""
+
+    def __init__(self, stream, block_size=READ_SIZE):
+        self.stream = stream
+        self.block_size = block_size
+        self.buffer = b""
+        self.pos = 0
+
+    def _fill(self, size=1):
+        block = self.stream.read(max(self.block_size, size))
+        if not block:
+            return False
+        self.buffer = self.buffer[self.pos:] + block
+        self.pos = 0
+        return True
+
+    def unread(self):
+        """Bytes read from the stream but not decoded yet."""
+        return len(self.buffer) - self.pos
+
+    def at_end(self):
+        return self.pos >= len(self.buffer) and not self._fill()
+
+    def byte(self):
+        if self.pos >= len(self.buffer) and not self._fill():
+            raise ArchiveError("archive is truncated")
+        value = self.buffer[self.pos]
+        self.pos += 1
+        return value
+
+    def read(self, size):
+        while self.unread() < size:
+            if not self._fill(size - self.unread()):
+                raise ArchiveError("archive is truncated")
+        data = self.buffer[self.pos:self.pos + size]
+        self.pos += size
+        return data
+
+    def varint(self):
+        value = shift = 0
+        while True:
+            byte = self.byte()
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def signed(self):
+        value = self.varint()
+        return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+    def stamp(self, previous):
+        value = self.varint()
+        if value == 0:
+            return None
+        delta = value - 1
+        return (previous or 0) + (delta >> 1 if not delta & 1 else -((delta + 1) >> 1))
+
+    def string(self):
+        return self.read(self.varint()).decode("utf-8")
+
+    def history_type(self):
+        value = self.varint()
+        if value >= len(HISTORY_TYPES):
+            raise ArchiveError("unknown history type: %d" % value)
+        return HISTORY_TYPES[value]
+
+    def column(self, count, read):
+        return [read() for _ in range(count)]
+
+
+def iter_chunks(snapshot):
+    """Yield the archive of one snapshot a table at a time."""
+    out = _Writer()
+    out.buffer += MAGIC
+    out.varint(FORMAT_VERSION)
+    out.varint(snapshot.get("seq", 0))
+
+    ids = snapshot["ids"]
+    out.varint(len(ids))
+    for card, card_id in enumerate(ids):
+        out.string(card_id)
+        out.string(snapshot["labels"][card])
+    for balance in snapshot["balances"]:
+        out.signed(balance)
+    for count in snapshot["transactions"]:
+        out.varint(count)
+    versions = snapshot.get("versions") or [0] * len(ids)
+    for version in versions:
+        out.varint(version)
+    yield out.take()
+
+    loans = snapshot["loans"]
+    out.varint(len(loans["card"]))
+    for card in loans["card"]:
+        out.varint(card)
+    for amount in loans["amount"]:
+        out.varint(amount)
+    previous = None
+    for timestamp in loans["timestamp"]:
+        out.stamp(timestamp, previous)
+        previous = timestamp
+    for row, paid in enumerate(loans["paid"]):
+        out.stamp(loans["repaidTimestamp"][row] if paid else None, loans["timestamp"][row])
+    count = len(loans["card"])
+    for rate in loans.get("rate") or [LOAN_RATE] * count:
+        out.varint(rate)
+    for installments in loans.get("installments") or [1] * count:
+        out.varint(installments)
+    for paid in loans.get("paidInstallments") or [0] * count:
+        out.varint(paid)
+    yield out.take()
+
+    history = snapshot.get("history") or {"type": [], "card": [], "counterparty": [],
+                                          "amount": [], "timestamp": []}
+    out.varint(len(history["type"]))
+    for kind in history["type"]:
+        if kind not in HISTORY_TYPES:
+            raise ArchiveError("cannot encode history type %r" % (kind,))
+        out.varint(HISTORY_TYPES.index(kind))
+    for card in history["card"]:
+        out.varint(card)
+    for card in history["counterparty"]:
+        out.varint(0 if card is None else card + 1)
+    for amount in history["amount"]:
+        out.varint(amount)
+    previous = None
+    for timestamp in history["timestamp"]:
+        out.stamp(timestamp, previous)
+        if timestamp is not None:
+            previous = timestamp
+    yield out.take()
+
+    checkpoints = snapshot.get("checkpoints") or []
+    out.varint(len(checkpoints))
+    previous = None
+    for checkpoint in checkpoints:
+        out.varint(checkpoint["row"])
+        out.stamp(checkpoint["time"], previous)
+        if checkpoint["time"] is not None:
+            previous = checkpoint["time"]
+        out.varint(len(checkpoint["balances"]))
+        for balance in checkpoint["balances"]:
+            out.signed(balance)
+        for count in checkpoint["transactions"]:
+            out.varint(count)
+        for principal in checkpoint["principal"]:
+            out.varint(principal)
+    yield out.take()
+
+
+def dump(snapshot, stream):
+    """Append the archive of ``snapshot`` to a binary stream."""
+    for chunk in iter_chunks(snapshot):
+        stream.write(chunk)
+
+
+def dumps(snapshot):
+    return b"".join(iter_chunks(snapshot))
+
+
+def _read_snapshot(reader):
+    if reader.read(len(MAGIC)) != MAGIC:
+        raise ArchiveError("not a ledger archive")
+    version = reader.varint()
+    if version not in (1, FORMAT_VERSION):
+        raise ArchiveError("unsupported archive version: %d" % version)
+    snapshot = {"version": SNAPSHOT_VERSION, "seq": reader.varint()}
+
+    cards = reader.varint()
+    ids = []
+    labels = []
+    for _ in range(cards):
+        ids.append(reader.string())
+        labels.append(reader.string())
+    snapshot["ids"] = ids
+    snapshot["labels"] = labels
+    snapshot["balances"] = reader.column(cards, reader.signed)
+    snapshot["transactions"] = reader.column(cards, reader.varint)
+    snapshot["versions"] = reader.column(cards, reader.varint)
+
+    count = reader.varint()
+    loan_card = reader.column(count, reader.varint)
+    loan_amount = reader.column(count, reader.varint)
+    timestamps = []
+    previous = None
+    for _ in range(count):
+        previous = reader.stamp(previous)
+        timestamps.append(previous)
+    repaid = [reader.stamp(timestamps[row]) for row in range(count)]
+    snapshot["loans"] = {
+        "card": loan_card,
+        "amount": loan_amount,
+        "paid": [value is not None for value in repaid],
+        "timestamp": timestamps,
+        "repaidTimestamp": repaid,
+        "rate": reader.column(count, reader.varint) if version >= 2 else [LOAN_RATE] * count,
+        "installments": reader.column(count, reader.varint) if version >= 2 else [1] * count,
+        "paidInstallments": reader.column(count, reader.varint) if version >= 2 else [0] * count,
+    }
+
+    count = reader.varint()
+    kinds = [reader.history_type() for _ in range(count)]
+    history_card = reader.column(count, reader.varint)
+    counterparty = [None if value == 0 else value - 1 for value in reader.column(count, reader.varint)]
+    amounts = reader.column(count, reader.varint)
+    timestamps = []
+    previous = None
+    for _ in range(count):
+        timestamp = reader.stamp(previous)
+        timestamps.append(timestamp)
+        if timestamp is not None:
+            previous = timestamp
+    snapshot["history"] = {
+        "type": kinds,
+        "card": history_card,
+        "counterparty": counterparty,
+        "amount": amounts,
+        "timestamp": timestamps,
+    }
+
+    checkpoints = []
+    previous = None
+    for _ in range(reader.varint()):
+        row = reader.varint()
+        time = reader.stamp(previous)
+        if time is not None:
+            previous = time
+        width = reader.varint()
+        checkpoints.append({
+            "row": row,
+            "time": time,
+            "balances": reader.column(width, reader.signed),
+            "transactions": reader.column(width, reader.varint),
+            "principal": reader.column(width, reader.varint),
+        })
+    snapshot["checkpoints"] = checkpoints
+    return snapshot
+
+
+def iter_load(stream):
+    """Yield every snapshot in a binary stream of concatenated archives."""
+    reader = _Reader(stream)
+    while not reader.at_end():
+        yield _read_snapshot(reader)
+
+
+def load(stream):
+    """Read the next snapshot from a binary stream, leaving the stream
+    just past its archive.
+
+    A seekable stream is read in blocks and sought back over what was
+    read ahead; any other is read only as far as the archive goes, so
+    prefer :func:`iter_load` for reading many archives from a pipe.
+    """
+    seekable = stream.seekable()
+    reader = _Reader(stream, READ_SIZE if seekable else 1)
+    snapshot = _read_snapshot(reader)
+    if seekable and reader.unread():
+        stream.seek(-reader.unread(), io.SEEK_CUR)
+    return snapshot
+
+
+def loads(data):
+    return load(io.BytesIO(data))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack = commands.add_parser("pack", help="archive JSON snapshots")
+    pack.add_argument("snapshots", nargs="+", help="JSON snapshot files")
+    pack.add_argument("-o", "--output", required=True)
+    unpack = commands.add_parser("unpack", help="print an archive's snapshots as JSON lines")
+    unpack.add_argument("archive")
+    args = parser.parse_args(argv)
+
+    if args.command == "pack":
+        with open(args.output, "wb") as out:
+            for path in args.snapshots:
+                with open(path) as f:
+                    dump(json.load(f), out)
+    else:
+        with open(args.archive, "rb") as f:
+            for snapshot in iter_load(f):
+                print(json.dumps(snapshot, separators=(",", ":")))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+// Page side of bench.py. bench.py serves monopoly.py with `self.BENCH`
+// set before the engine and this script after the page's own, opens it
+// in a headless browser and collects what this posts to /results.
+// BENCH holds the states to run (their cards are in /state/<i> as
+// archives), the (card, other card) pairs each operation uses, and
+// whether the engine is on the page or in its worker. Each case runs
+// BENCH.repeat times on the state freshly imported, timing whole
+// operations: an engine intent from request to result, a terminal flow
+// from the mode button until its last result has been handled.
+(function () {
+    const config = self.BENCH;
+    const results = [];
+    const errors = [];
+
+    // Flows end with a resetToIdle three seconds later; the next flow
+    // resets anyway, and a late one would land in the middle of it
+    const setTimer = self.setTimeout;
+    self.setTimeout = (fn, ms, ...args) => fn === resetToIdle ? 0 : setTimer(fn, ms, ...args);
+
+    // The page does not return its requests, so keep the latest
+    const request = requestEngine;
+    let lastRequest = Promise.resolve();
+    requestEngine = intent => (lastRequest = request(intent));
+
+    // Wait for the requests and queued auction intents a flow started
+    async function settled() {
+        let queue;
+        do {
+            queue = auctionQueue;
+            await queue;
+            await lastRequest;
+        } while (queue !== auctionQueue);
+    }
+
+    function enterAmount(value) {
+        clearAmount();
+        String(value).split('').forEach(handleNumpadInput);
+        confirmAmount();
+    }
+
+    function intents(state) {
+        const pairs = state.pairs;
+        const cards = Array.from(cardViews.keys());
+        const cases = {
+            transfer: [pairs.length, async () => {
+                for (const [card, other] of pairs) {
+                    await requestEngine({ op: 'transfer', from: card, to: other, amount: 1 });
+                }
+            }],
+            bid: [pairs.length, async () => {
+                for (const [card] of pairs) {
+                    await requestEngine({ op: 'bid', card: card, amount: 1 });
+                }
+            }],
+            loan: [pairs.length, async () => {
+                for (const [card] of pairs) {
+                    await requestEngine({ op: 'loan', card: card, amount: 1 });
+                }
+            }],
+            repay: [cards.length, async () => {
+                for (const card of cards) {
+                    await requestEngine({ op: 'repay', card: card });
+                }
+            }],
+            batch: [pairs.length, async () => {
+                const transfers = pairs.map(([card, other]) => ({ from: card, to: other, amount: 1 }));
+                await requestEngine({ op: 'batch', transfers: transfers });
+            }],
+            tap: [pairs.length, async () => {
+                resetToIdle();
+                for (const [card] of pairs) {
+                    simulateCardTap(cardViews[card].id);
+                }
+            }],
+            transfer_flow: [pairs.length, async () => {
+                for (const [card, other] of pairs) {
+                    startTransferMode();
+                    simulateCardTap(cardViews[card].id);
+                    enterAmount(1);
+                    simulateCardTap(cardViews[other].id);
+                    await settled();
+                }
+            }],
+            bid_flow: [pairs.length, async () => {
+                for (const [card, other] of pairs) {
+                    startBiddingMode();
+                    simulateCardTap(cardViews[card].id);
+                    enterAmount(1);
+                    simulateCardTap(cardViews[other].id);
+                    addToBid(1);
+                    confirmBid();
+                    simulateCardTap(cardViews[other].id);
+                    await settled();
+                }
+            }],
+            loan_flow: [pairs.length, async () => {
+                for (const [card] of pairs) {
+                    startLoanMode();
+                    simulateCardTap(cardViews[card].id);
+                    enterAmount(1);
+                    await settled();
+                }
+            }],
+            repay_flow: [cards.length, async () => {
+                for (const card of cards) {
+                    startRepayMode();
+                    simulateCardTap(cardViews[card].id);
+                    await settled();
+                }
+            }]
+        };
+        if (state.loans === 0) {
+            // Nothing to repay without loans
+            delete cases.repay;
+            delete cases.repay_flow;
+        }
+        // Storage belongs to the engine, out of reach in the worker
+        if (config.engine === 'page') {
+            cases.save = [config.storageOps, async () => {
+                for (let n = 0; n < config.storageOps; n++) {
+                    await saveCardData();
+                }
+            }];
+            cases.load = [config.storageOps, async () => {
+                for (let n = 0; n < config.storageOps; n++) {
+                    clearLedger();
+                    await initializeCardData();
+                }
+            }];
+        }
+        return cases;
+    }
+
+    async function importState(bytes) {
+        resetToIdle();
+        await settled();
+        const result = await requestEngine({ op: 'import', bytes: bytes });
+        if (!result.ok) {
+            throw new Error("Import failed: " + result.reason);
+        }
+        // Let the save the import started finish before timing anything
+        if (config.engine === 'page') {
+            await saveCardData();
+        }
+        await engineIdle();
+    }
+
+    function median(samples) {
+        const sorted = samples.slice().sort((a, b) => a - b);
+        const middle = sorted.length >> 1;
+        return sorted.length % 2 ? sorted[middle] : (sorted[middle - 1] + sorted[middle]) / 2;
+    }
+
+    async function runState(state, index) {
+        const response = await fetch(`/state/${index}`);
+        const bytes = new Uint8Array(await response.arrayBuffer());
+        await importState(bytes);
+        for (const [name, [ops, run]] of Object.entries(intents(state))) {
+            const samples = [];
+            for (let n = 0; n < config.repeat; n++) {
+                await importState(bytes);
+                const start = performance.now();
+                await run();
+                samples.push((performance.now() - start) * 1000 / ops);
+            }
+            results.push({
+                runtime: config.engine,
+                case: name,
+                cards: state.cards,
+                loans: state.loans,
+                history: state.history,
+                ops: ops,
+                repeat: config.repeat,
+                median_us: median(samples),
+                min_us: Math.min(...samples)
+            });
+        }
+    }
+
+    async function runAll() {
+        while (!engineReady || cardViews.length === 0) {
+            await new Promise(resolve => setTimer(resolve, 10));
+        }
+        for (const [index, state] of config.states.entries()) {
+            try {
+                await runState(state, index);
+            } catch (error) {
+                errors.push(`state ${index}: ${error}`);
+            }
+        }
+        await fetch('/results', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ results: results, errors: errors })
+        });
+    }
+
+    document.addEventListener('DOMContentLoaded', runAll);
+})();
@@ -0,0 +1,413 @@
+"""Benchmarks for the ledger, in the Python core and in the page.
+
+Times ledger operations, saving and loading, and whole terminal flows
+(mode button, card taps, keypad) over ledgers of different sizes, and
+writes the results as JSON for tracking regressions::
+
+    python bench.py                            # Python core only
+    python bench.py --browser chromium         # the page too, headless
+    python bench.py -o new.json --compare baseline.json
+
+Every combination of ``--cards`` (cards in the ledger), ``--loans`` (open
+loans per card) and ``--history`` (extra transfers already in the
+history) is a state. States and the cards each operation uses are
+generated from ``--seed``, and the page imports exactly the state Python
+measured, as an archive, so the two sets of numbers are comparable.
+Each case runs ``--repeat`` times on a fresh copy of its state.
+
+Cases: ``transfer``, ``bid``, ``loan`` and ``repay`` are single ledger
+operations (engine intents in the page) and ``batch`` commits the
+``transfer`` case's transfers as one batch; ``save`` and ``load`` write and
+read the whole ledger (the snapshot as JSON in Python,
+``saveCardData``/``initializeCardData`` in the page); ``tap`` and the
+``*_flow`` cases drive the terminal state machine through a complete
+operation, like the tap scripts of :mod:`ledger`. States without loans
+have nothing to repay and skip the repay cases.
+
+In the browser every case runs twice: ``page`` with the engine on the
+page's thread and ``worker`` with it in its worker, where storage cannot
+be reached from outside, so ``save`` and ``load`` are page only. The
+browser gets a throwaway profile and is given ``--browser-timeout``
+seconds.
+
+Output is one JSON document: ``meta`` (time, commit, versions, options)
+and ``results``, a record per case and state with ``median_us`` and
+``min_us`` per operation. ``--compare`` prints each case's ratio to a
+baseline and exits with status 1 if any is slower than ``--threshold``.
+"""
+
+import argparse
+import http.server
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+import archive
+from ledger import Ledger, Terminal
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PAGE_PATH = os.path.join(ROOT, "monopoly.py")
+BENCH_SCRIPT = os.path.join(ROOT, "bench.js")
+ENGINE_TAG = '<script id="ledger-engine">'
+BROWSERS = ("chromium", "chromium-browser", "google-chrome", "google-chrome-stable", "microsoft-edge")
+LOAN_AMOUNT = 1000
+STORAGE_OPS = 5  # saves or loads per repeat; each touches the whole ledger
+
+
+def build_state(cards, loans, history):
+    """A ledger with ``loans`` open loans on each card, each card able to
+    repay them, and ``history`` transfers between the first two cards."""
+    ticks = iter(range(1, 1 << 62))
+    ledger = Ledger.with_cards(max(cards, 2), clock=lambda: next(ticks))
+    for card in range(len(ledger)):
+        for _ in range(loans):
+            ledger.loan(card, LOAN_AMOUNT)
+        ledger.bid(card, 1)
+    for row in range(history):
+        ledger.transfer(row % 2, 1 - row % 2, 1)
+    return ledger
+
+
+def pick_pairs(rng, cards, ops):
+    """``ops`` (card, other card) pairs."""
+    pairs = []
+    for _ in range(ops):
+        card = rng.randrange(cards)
+        other = rng.randrange(cards - 1)
+        pairs.append((card, other + (other >= card)))
+    return pairs
+
+
+def python_cases(ledger, pairs):
+    """Case name -> (ops, function(fresh ledger, terminal) running them)."""
+    ids = ledger.ids
+    cards = len(ledger)
+
+    def transfer(fresh, terminal):
+        for card, other in pairs:
+            fresh.transfer(card, other, 1)
+
+    def bid(fresh, terminal):
+        for card, _ in pairs:
+            fresh.bid(card, 1)
+
+    def loan(fresh, terminal):
+        for card, _ in pairs:
+            fresh.loan(card, 1)
+
+    def repay(fresh, terminal):
+        for card in range(cards):
+            fresh.repay(card)
+
+    def batch(fresh, terminal):
+        fresh.batch([(card, other, 1) for card, other in pairs])
+
+    def save(fresh, terminal):
+        for _ in range(STORAGE_OPS):
+            json.dumps(fresh.snapshot(), separators=(",", ":"))
+
+    saved = json.dumps(ledger.snapshot(), separators=(",", ":"))
+
+    def load(fresh, terminal):
+        for _ in range(STORAGE_OPS):
+            Ledger.from_snapshot(json.loads(saved))
+
+    def tap(fresh, terminal):
+        for card, _ in pairs:
+            terminal.tap(ids[card])
+
+    def transfer_flow(fresh, terminal):
+        for card, other in pairs:
+            terminal.start_transfer()
+            terminal.tap(ids[card])
+            terminal.enter_amount(1)
+            terminal.tap(ids[other])
+
+    def bid_flow(fresh, terminal):
+        for card, other in pairs:
+            terminal.start_bidding()
+            terminal.tap(ids[card])
+            terminal.enter_amount(1)
+            terminal.tap(ids[other])
+            terminal.add_to_bid(1)
+            terminal.confirm_bid()
+            terminal.tap(ids[other])
+
+    def loan_flow(fresh, terminal):
+        for card, _ in pairs:
+            terminal.start_loan()
+            terminal.tap(ids[card])
+            terminal.enter_amount(1)
+
+    def repay_flow(fresh, terminal):
+        for card in range(cards):
+            terminal.start_repay()
+            terminal.tap(ids[card])
+
+    ops = len(pairs)
+    cases = {
+        "transfer": (ops, transfer),
+        "bid": (ops, bid),
+        "loan": (ops, loan),
+        "repay": (cards, repay),
+        "batch": (ops, batch),
+        "save": (STORAGE_OPS, save),
+        "load": (STORAGE_OPS, load),
+        "tap": (ops, tap),
+        "transfer_flow": (ops, transfer_flow),
+        "bid_flow": (ops, bid_flow),
+        "loan_flow": (ops, loan_flow),
+        "repay_flow": (cards, repay_flow),
+    }
+    if not ledger.loan_card:
+        # Nothing to repay without loans
+        del cases["repay"], cases["repay_flow"]
+    return cases
+
+
+def result(runtime, case, state, ops, repeat, samples):
+    """One result record; ``samples`` are microseconds per operation."""
+    return {
+        "runtime": runtime,
+        "case": case,
+        "cards": state["cards"],
+        "loans": state["loans"],
+        "history": state["history"],
+        "ops": ops,
+        "repeat": repeat,
+        "median_us": statistics.median(samples),
+        "min_us": min(samples),
+    }
+
+
+def bench_python(states, repeat):
+    results = []
+    for state in states:
+        snapshot = state["ledger"].snapshot()
+        for case, (ops, run) in python_cases(state["ledger"], state["pairs"]).items():
+            samples = []
+            for _ in range(repeat):
+                fresh = Ledger.from_snapshot(snapshot)
+                terminal = Terminal(fresh)
+                start = time.perf_counter()
+                run(fresh, terminal)
+                samples.append((time.perf_counter() - start) * 1e6 / ops)
+            results.append(result("python", case, state, ops, repeat, samples))
+    return results
+
+
+class _BenchHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the instrumented page, the states and collects results."""
+
+    def do_GET(self):
+        bench = self.server.bench
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        if parts == ["bench"]:
+            engine = "worker" if url.query == "engine=worker" else "page"
+            self._send(200, "text/html; charset=utf-8", bench.page(engine))
+        elif len(parts) == 2 and parts[0] == "state" and parts[1].isdigit() and int(parts[1]) < len(bench.archives):
+            self._send(200, "application/octet-stream", bench.archives[int(parts[1])])
+        else:
+            self._send(404, "text/plain", b"Not found")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self.path != "/results":
+            self._send(404, "text/plain", b"Not found")
+            return
+        self.server.bench.received(json.loads(body))
+        self._send(200, "text/plain", b"OK")
+
+    def _send(self, status, content_type, payload):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class BrowserBench:
+    """Runs ``bench.js`` in a headless browser against the given states."""
+
+    def __init__(self, states, ops, repeat):
+        self.archives = [archive.dumps(state["ledger"].snapshot()) for state in states]
+        self.config = {
+            "ops": ops,
+            "repeat": repeat,
+            "storageOps": STORAGE_OPS,
+            "states": [{"cards": s["cards"], "loans": s["loans"], "history": s["history"],
+                        "pairs": s["pairs"]} for s in states],
+        }
+        with open(PAGE_PATH, encoding="utf-8") as f:
+            self.html = f.read()
+        with open(BENCH_SCRIPT, encoding="utf-8") as f:
+            self.script = f.read()
+        self.results = []
+        self.errors = []
+        self.done = threading.Event()
+
+    def page(self, engine):
+        """The page with the configuration before the engine and the
+        benchmarks after everything else."""
+        config = dict(self.config, engine=engine)
+        prologue = "<script>self.BENCH = %s;%s</script>\n    " % (
+            json.dumps(config), " self.Worker = undefined;" if engine == "page" else "")
+        html = self.html.replace(ENGINE_TAG, prologue + ENGINE_TAG, 1)
+        html = html.replace("</body>", "<script>\n%s\n</script>\n</body>" % self.script, 1)
+        return html.encode("utf-8")
+
+    def received(self, report):
+        self.results.extend(report.get("results", []))
+        self.errors.extend(report.get("errors", []))
+        self.done.set()
+
+    def run(self, browser, timeout):
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _BenchHandler)
+        server.bench = self
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = "http://127.0.0.1:%d" % server.server_address[1]
+        try:
+            for engine in ("page", "worker"):
+                self.done.clear()
+                with tempfile.TemporaryDirectory() as profile:
+                    process = subprocess.Popen(
+                        [browser, "--headless=new", "--disable-gpu", "--no-first-run",
+                         "--no-default-browser-check", "--user-data-dir=" + profile,
+                         "%s/bench?engine=%s" % (base, engine)],
+                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                    try:
+                        finished = self.done.wait(timeout)
+                    finally:
+                        process.terminate()
+                        process.wait()
+                if not finished:
+                    raise RuntimeError("%s did not report %s results within %ds" % (browser, engine, timeout))
+        finally:
+            server.shutdown()
+            server.server_close()
+        for error in self.errors:
+            print("%s: %s" % (browser, error), file=sys.stderr)
+        return self.results
+
+
+def find_browser(name):
+    if name:
+        path = shutil.which(name)
+        if not path:
+            raise RuntimeError("browser not found: %s" % name)
+        return path
+    for candidate in BROWSERS:
+        path = shutil.which(candidate)
+        if path:
+            return path
+    raise RuntimeError("no headless browser found; pass --browser PATH")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print each case's ratio to the baseline; returns the regressions."""
+    def key(record):
+        return (record["runtime"], record["case"], record["cards"], record["loans"], record["history"])
+
+    before = {key(r): r for r in baseline["results"]}
+    slower = []
+    for record in results:
+        old = before.get(key(record))
+        if old is None or not old["median_us"]:
+            continue
+        ratio = record["median_us"] / old["median_us"]
+        flag = " SLOWER" if ratio > threshold else ""
+        print("%-7s %-14s cards=%-4d loans=%-5d history=%-7d %10.2f us  x%.2f%s" % (
+            key(record) + (record["median_us"], ratio, flag)), file=sys.stderr)
+        if flag:
+            slower.append(record)
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--cards", type=int, nargs="+", default=[2, 16, 128])
+    parser.add_argument("--loans", type=int, nargs="+", default=[0, 100],
+                        help="open loans per card")
+    parser.add_argument("--history", type=int, nargs="+", default=[0, 10000],
+                        help="extra transfers in the history")
+    parser.add_argument("--ops", type=int, default=500, help="operations per case")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--browser", nargs="?", const="", default=None,
+                        help="also benchmark the page in this headless browser "
+                             "(default: the first Chromium-based one found)")
+    parser.add_argument("--browser-timeout", type=int, default=600)
+    parser.add_argument("-o", "--output", help="write the results here instead of stdout")
+    parser.add_argument("--compare", help="baseline results to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="slowdown ratio counted as a regression")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    states = []
+    for cards in args.cards:
+        for loans in args.loans:
+            for history in args.history:
+                ledger = build_state(cards, loans, history)
+                states.append({"cards": len(ledger), "loans": loans, "history": history, "ledger": ledger,
+                               "pairs": pick_pairs(rng, len(ledger), args.ops)})
+
+    results = bench_python(states, args.repeat)
+    browser = None
+    if args.browser is not None:
+        try:
+            browser = find_browser(args.browser)
+            results += BrowserBench(states, args.ops, args.repeat).run(browser, args.browser_timeout)
+        except RuntimeError as e:
+            parser.error(str(e))
+
+    document = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "browser": browser,
+            "options": {"cards": args.cards, "loans": args.loans, "history": args.history,
+                        "ops": args.ops, "repeat": args.repeat, "seed": args.seed},
+        },
+        "results": results,
+    }
+    text = json.dumps(document, indent=1)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(results, json.load(f), args.threshold):
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
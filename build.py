@@ -0,0 +1,266 @@
+"""Build a self-contained copy of the page without the Tailwind CDN.
+
+The page loads ``https://cdn.tailwindcss.com``, which downloads and
+JIT-compiles CSS in the browser on every cold start and fails offline.
+This script finds the utility classes that ``monopoly.py`` actually uses
+(in ``class`` attributes and in ``classList`` calls in the script),
+generates their CSS with Tailwind v3's default theme, and writes the page
+with that stylesheet inlined at the end of ``<head>``, where the CDN
+would have injected it::
+
+    python build.py                 # writes dist/
+
+The output directory also gets the service worker, stamped with a hash
+of the built page so each build gets its own cache, plus the manifest
+and icon, and can be served by any static file server.
+
+Only the utilities this page needs are known to the generator; any class
+it cannot resolve is reported, and left unstyled just as the CDN would
+leave it.
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import shutil
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.join(ROOT, "monopoly.py")
+OUTPUT = os.path.join(ROOT, "dist")
+CDN_TAG = '<script src="https://cdn.tailwindcss.com"></script>'
+ASSETS = ("manifest.webmanifest", "icon.svg")
+SERVICE_WORKER = "sw.js"
+
+# Trimmed Tailwind v3 preflight: the resets the page's markup relies on
+PREFLIGHT = """\
+*,::before,::after{box-sizing:border-box;border:0 solid #e5e7eb}
+html{line-height:1.5;-webkit-text-size-adjust:100%;tab-size:4;font-family:ui-sans-serif,system-ui,sans-serif,"Apple Color Emoji","Segoe UI Emoji"}
+body{margin:0;line-height:inherit}
+h1,h2,h3,h4,h5,h6{font-size:inherit;font-weight:inherit}
+h1,h2,h3,h4,h5,h6,p{margin:0}
+button{font-family:inherit;font-size:100%;font-weight:inherit;line-height:inherit;color:inherit;margin:0;padding:0;text-transform:none;-webkit-appearance:button;background-color:transparent;background-image:none;cursor:pointer}
+[hidden]{display:none}"""
+
+SCREENS = {"sm": "640px", "md": "768px", "lg": "1024px", "xl": "1280px", "2xl": "1536px"}
+
+COLORS = {
+    "gray": {"50": "#f9fafb", "100": "#f3f4f6", "200": "#e5e7eb", "300": "#d1d5db", "400": "#9ca3af",
+             "500": "#6b7280", "600": "#4b5563", "700": "#374151", "800": "#1f2937", "900": "#111827"},
+    "red": {"50": "#fef2f2", "100": "#fee2e2", "200": "#fecaca", "300": "#fca5a5", "400": "#f87171",
+            "500": "#ef4444", "600": "#dc2626", "700": "#b91c1c", "800": "#991b1b", "900": "#7f1d1d"},
+    "green": {"50": "#f0fdf4", "100": "#dcfce7", "200": "#bbf7d0", "300": "#86efac", "400": "#4ade80",
+              "500": "#22c55e", "600": "#16a34a", "700": "#15803d", "800": "#166534", "900": "#14532d"},
+    "blue": {"50": "#eff6ff", "100": "#dbeafe", "200": "#bfdbfe", "300": "#93c5fd", "400": "#60a5fa",
+             "500": "#3b82f6", "600": "#2563eb", "700": "#1d4ed8", "800": "#1e40af", "900": "#1e3a8a"},
+}
+
+FONT_SIZES = {
+    "sm": ("0.875rem", "1.25rem"),
+    "base": ("1rem", "1.5rem"),
+    "lg": ("1.125rem", "1.75rem"),
+    "xl": ("1.25rem", "1.75rem"),
+    "2xl": ("1.5rem", "2rem"),
+    "3xl": ("1.875rem", "2.25rem"),
+    "4xl": ("2.25rem", "2.5rem"),
+}
+
+STATIC = {
+    "hidden": "display:none",
+    "flex": "display:flex",
+    "grid": "display:grid",
+    "fixed": "position:fixed",
+    "flex-1": "flex:1 1 0%",
+    "mx-auto": "margin-left:auto;margin-right:auto",
+    "max-w-2xl": "max-width:42rem",
+    "min-h-screen": "min-height:100vh",
+    "text-center": "text-align:center",
+    "text-right": "text-align:right",
+    "text-white": "color:#fff",
+    "font-bold": "font-weight:700",
+    "font-semibold": "font-weight:600",
+    "font-mono": 'font-family:ui-monospace,SFMono-Regular,Menlo,Monaco,Consolas,"Liberation Mono","Courier New",monospace',
+    "rounded": "border-radius:0.25rem",
+    "rounded-lg": "border-radius:0.5rem",
+    "shadow-lg": "box-shadow:0 10px 15px -3px rgb(0 0 0 / 0.1),0 4px 6px -4px rgb(0 0 0 / 0.1)",
+}
+
+SPACING_PROPERTIES = {
+    "p": ("padding",),
+    "px": ("padding-left", "padding-right"),
+    "py": ("padding-top", "padding-bottom"),
+    "m": ("margin",),
+    "mx": ("margin-left", "margin-right"),
+    "my": ("margin-top", "margin-bottom"),
+    "mt": ("margin-top",),
+    "mb": ("margin-bottom",),
+    "gap": ("gap",),
+    "top": ("top",),
+    "right": ("right",),
+    "bottom": ("bottom",),
+    "left": ("left",),
+}
+
+# In Tailwind's output order
+PSEUDO_VARIANTS = {"hover": ":hover", "focus": ":focus", "active": ":active"}
+VARIANT_ORDER = list(SCREENS) + ["dark"] + list(PSEUDO_VARIANTS)
+
+_SPACING = re.compile(r"^(%s)-(\d+(?:\.5)?)$" % "|".join(SPACING_PROPERTIES))
+_COLOR = re.compile(r"^(bg|text)-(%s)-(\d+)$" % "|".join(COLORS))
+
+
+def declarations(utility):
+    """CSS declarations for a bare utility (no variants), or ``None``."""
+    if utility in STATIC:
+        return STATIC[utility]
+    if utility == "container":
+        return "width:100%"
+
+    match = _SPACING.match(utility)
+    if match:
+        size = "0px" if match.group(2) == "0" else "%grem" % (float(match.group(2)) / 4)
+        return ";".join("%s:%s" % (prop, size) for prop in SPACING_PROPERTIES[match.group(1)])
+
+    match = _COLOR.match(utility)
+    if match and match.group(3) in COLORS[match.group(2)]:
+        prop = "background-color" if match.group(1) == "bg" else "color"
+        return "%s:%s" % (prop, COLORS[match.group(2)][match.group(3)])
+
+    if utility.startswith("text-") and utility[5:] in FONT_SIZES:
+        size, line_height = FONT_SIZES[utility[5:]]
+        return "font-size:%s;line-height:%s" % (size, line_height)
+    if utility.startswith("grid-cols-") and utility[10:].isdigit():
+        return "grid-template-columns:repeat(%s,minmax(0,1fr))" % utility[10:]
+    if utility.startswith("opacity-") and utility[8:].isdigit():
+        return "opacity:%g" % (int(utility[8:]) / 100)
+    return None
+
+
+def escape(class_name):
+    return re.sub(r"([:./])", r"\\\1", class_name)
+
+
+def rule(class_name):
+    """Return ``(media_queries, css_rule)`` for a class, or ``None``."""
+    *variants, utility = class_name.split(":")
+    body = declarations(utility)
+    if body is None:
+        return None
+
+    media = []
+    pseudo = ""
+    for variant in variants:
+        if variant in SCREENS:
+            media.append("(min-width:%s)" % SCREENS[variant])
+        elif variant == "dark":
+            media.append("(prefers-color-scheme:dark)")
+        elif variant in PSEUDO_VARIANTS:
+            pseudo += PSEUDO_VARIANTS[variant]
+        else:
+            return None
+    return tuple(media), ".%s%s{%s}" % (escape(class_name), pseudo, body)
+
+
+def used_classes(html):
+    """Class names in ``class`` attributes and ``classList`` calls."""
+    names = set()
+    for attr in re.findall(r'class="([^"]*)"', html):
+        names.update(attr.split())
+    names.update(re.findall(r"classList\.\w+\(\s*'([\w:-]+)'", html))
+    return names
+
+
+def local_classes(html):
+    """Classes the page's own stylesheet defines, which need no utility."""
+    styles = "".join(re.findall(r"<style>(.*?)</style>", html, re.S))
+    return set(re.findall(r"\.([A-Za-z][\w-]*)", styles))
+
+
+def variant_sort_key(class_name):
+    *variants, utility = class_name.split(":")
+    ranks = [VARIANT_ORDER.index(v) if v in VARIANT_ORDER else len(VARIANT_ORDER) for v in variants]
+    return len(variants), sorted(ranks, reverse=True), utility
+
+
+def generate_css(classes):
+    """Return ``(css, unknown_classes)`` for a set of class names."""
+    plain = []
+    by_media = {}
+    unknown = []
+    # Tailwind emits pseudo variants after plain utilities, media queries last
+    for name in sorted(classes, key=variant_sort_key):
+        result = rule(name)
+        if result is None:
+            unknown.append(name)
+            continue
+        media, css = result
+        if media:
+            by_media.setdefault(media, []).append(css)
+        else:
+            plain.append(css)
+
+    if "container" in classes:
+        for size in SCREENS.values():
+            by_media.setdefault(("(min-width:%s)" % size,), []).append(".container{max-width:%s}" % size)
+
+    parts = [PREFLIGHT] + plain
+    screen_order = list(SCREENS.values())
+
+    def media_key(media):
+        # Breakpoints in ascending order, then dark mode
+        widths = [screen_order.index(m[11:-1]) for m in media if m.startswith("(min-width:")]
+        return (any("dark" in m for m in media), widths)
+
+    for media in sorted(by_media, key=media_key):
+        parts.append("@media %s{%s}" % (" and ".join(media), "".join(by_media[media])))
+    return "\n".join(parts), sorted(unknown)
+
+
+def stamp_service_worker(script, page):
+    """Set the service worker's cache version to a hash of ``page`` (bytes)."""
+    version = hashlib.sha256(page).hexdigest()[:12]
+    return script.replace("const CACHE_VERSION = 'dev';", "const CACHE_VERSION = '%s';" % version, 1)
+
+
+def build(source=SOURCE, output=OUTPUT):
+    """Write the self-contained page and its assets to the ``output``
+    directory; returns the classes left unstyled."""
+    with open(source, encoding="utf-8") as f:
+        html = f.read()
+    if CDN_TAG not in html:
+        raise ValueError("%s does not load the Tailwind CDN" % source)
+
+    classes = used_classes(html) - local_classes(html)
+    css, unknown = generate_css(classes)
+    html = html.replace("    " + CDN_TAG + "\n", "").replace(CDN_TAG, "")
+    html = html.replace("</head>", "    <style>\n%s\n    </style>\n</head>" % css, 1)
+
+    os.makedirs(output, exist_ok=True)
+    page = html.encode("utf-8")
+    with open(os.path.join(output, "index.html"), "wb") as f:
+        f.write(page)
+
+    for name in ASSETS:
+        shutil.copyfile(os.path.join(ROOT, name), os.path.join(output, name))
+    with open(os.path.join(ROOT, SERVICE_WORKER), encoding="utf-8") as f:
+        script = stamp_service_worker(f.read(), page)
+    with open(os.path.join(output, SERVICE_WORKER), "w", encoding="utf-8") as f:
+        f.write(script)
+    return unknown
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-o", "--output", default=OUTPUT)
+    args = parser.parse_args(argv)
+
+    unknown = build(output=args.output)
+    print("Wrote %s" % args.output)
+    if unknown:
+        print("No utility for (left unstyled): %s" % " ".join(unknown), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1183 @@
+"""Headless Monopoly Transactor ledger.
+
+A pure-Python mirror of the ledger rules and the card-tap state machine
+that live in the inline script of ``monopoly.py``, so rule changes can be
+exercised and load-tested without a browser.
+
+Run a tap script through it with::
+
+    python ledger.py taps.txt --cards 2 --repeat 100000
+
+Each script line is one terminal action; ``#`` starts a comment::
+
+    transfer            # start a mode: transfer, bidding, loan, repay
+    tap card1           # tap a card
+    amount 500          # type an amount on the keypad and confirm it
+    inc 1000            # raise the bid for the card tapped last
+    resetbid            # clear the bids back to the opening bid
+    confirmbid          # close bidding, then tap the winning card
+    reset               # back to idle
+"""
+
+import argparse
+import bisect
+import math
+import sys
+import time
+from collections import defaultdict
+
+DEFAULT_BALANCE = 1500000  # 1.5M
+DEFAULT_CARDS = ("card1", "card2")
+MAX_AMOUNT_DIGITS = 9
+SNAPSHOT_VERSION = 2
+CHECKPOINT_INTERVAL = 256  # history rows between checkpoints
+AUCTION_TIMEOUT = 30000  # ms of bidding after the latest bid
+MAX_MONEY = 2 ** 53 - 1  # the page keeps whole dollars in doubles, exact up to here
+LOAN_RATE = 5  # base interest percent of a loan taken on default terms
+MAX_LOAN_RATE = 100
+MAX_INSTALLMENTS = 52
+
+
+class LedgerError(Exception):
+    """An operation was rejected; the message is what the page displays."""
+
+
+class ConflictError(LedgerError):
+    """An entry was based on a card version that has since moved on."""
+
+
+class AuctionError(LedgerError):
+    """An auction action was rejected; ``reason`` is the page's result reason."""
+
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+
+def interest_percent(transactions, rate=LOAN_RATE):
+    """A loan's rate (5% on default terms) plus 1% per transaction after the first."""
+    return rate + max(0, transactions - 1)
+
+
+def percent_of(amount, percent):
+    """``percent``% of a whole-dollar amount, rounded half up."""
+    return (amount * percent + 50) // 100
+
+
+def format_amount(amount):
+    """Format an amount like the page's ``formatAmount``."""
+    if amount >= 1000000:
+        return "$%sM" % _scaled(amount, 1000000)
+    if amount >= 1000:
+        return "$%sK" % _scaled(amount, 1000)
+    return "$%s" % amount
+
+
+def _scaled(amount, unit):
+    # amount / unit to two decimals, rounded half up, without ".00"
+    step = unit // 100
+    hundredths = (amount * 2 + step) // (step * 2)
+    whole, cents = divmod(hundredths, 100)
+    return "%d" % whole if cents == 0 else "%d.%02d" % (whole, cents)
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def _check_loan_terms(amount, rate, installments):
+    if not isinstance(rate, int) or isinstance(rate, bool) or not 0 <= rate <= MAX_LOAN_RATE:
+        raise LedgerError("Invalid loan rate")
+    if (not isinstance(installments, int) or isinstance(installments, bool)
+            or not 1 <= installments <= min(MAX_INSTALLMENTS, amount)):
+        raise LedgerError("Invalid number of installments")
+
+
+def _entry_amount(entry):
+    amount = entry.get("amount")
+    if not isinstance(amount, int) or isinstance(amount, bool) or not 0 < amount <= MAX_MONEY:
+        raise LedgerError("Invalid amount")
+    return amount
+
+
+def _check_entry_fields(entry):
+    # Checked before anything is written: a field of the wrong type would
+    # otherwise fail only once some of the entry had been applied
+    timestamp = entry.get("timestamp")
+    if timestamp is not None and (not isinstance(timestamp, int) or isinstance(timestamp, bool)):
+        raise LedgerError("Invalid timestamp")
+    label = entry.get("label")
+    if label is not None and not isinstance(label, str):
+        raise LedgerError("Invalid card label")
+
+
+class History:
+    """Every money operation applied to a ledger, in ledger order.
+
+    Rows are column lists like the loan table and are indexed by card
+    (both sides of a transfer), by type and by time, as in the page.
+    """
+
+    def __init__(self):
+        self.type = []
+        self.card = []
+        self.counterparty = []
+        self.amount = []
+        self.timestamp = []
+        self.by_card = defaultdict(list)
+        self.by_type = defaultdict(list)
+        self._times = []  # sorted timestamps, parallel to _time_rows
+        self._time_rows = []
+
+    def __len__(self):
+        return len(self.type)
+
+    def add(self, kind, card, counterparty, amount, timestamp):
+        row = len(self.type)
+        self.type.append(kind)
+        self.card.append(card)
+        self.counterparty.append(counterparty)
+        self.amount.append(amount)
+        self.timestamp.append(timestamp)
+        self.by_card[card].append(row)
+        if counterparty is not None:
+            self.by_card[counterparty].append(row)
+        self.by_type[kind].append(row)
+        if timestamp is not None:
+            position = bisect.bisect_right(self._times, timestamp)
+            self._times.insert(position, timestamp)
+            self._time_rows.insert(position, row)
+        return row
+
+    def record(self, row):
+        return {
+            "row": row,
+            "type": self.type[row],
+            "card": self.card[row],
+            "counterparty": self.counterparty[row],
+            "amount": self.amount[row],
+            "timestamp": self.timestamp[row],
+        }
+
+    def query(self, card=None, kind=None, since=None, until=None, before=None, limit=20):
+        """Return ``(records, next)``, newest first, like the page's ``queryHistory``.
+
+        ``since`` is inclusive and ``until`` exclusive; pass ``next`` as
+        ``before`` for the following page (it is ``None`` after the last).
+        """
+        # Walk the smallest index that covers one of the filters
+        candidates = None
+        if card is not None:
+            candidates = self.by_card.get(card, [])
+        if kind is not None:
+            by_type = self.by_type.get(kind, [])
+            if candidates is None or len(by_type) < len(candidates):
+                candidates = by_type
+        if since is not None or until is not None:
+            start = 0 if since is None else bisect.bisect_left(self._times, since)
+            end = len(self._times) if until is None else bisect.bisect_left(self._times, until)
+            if candidates is None or end - start < len(candidates):
+                candidates = sorted(self._time_rows[start:max(start, end)])
+
+        end = len(self.type) if before is None else before
+        position = end if candidates is None else bisect.bisect_left(candidates, end)
+        # One match past the page tells whether another page follows
+        records = []
+        while position > 0 and len(records) <= limit:
+            position -= 1
+            row = position if candidates is None else candidates[position]
+            if card is not None and card not in (self.card[row], self.counterparty[row]):
+                continue
+            if kind is not None and self.type[row] != kind:
+                continue
+            timestamp = self.timestamp[row]
+            if since is not None and (timestamp is None or timestamp < since):
+                continue
+            if until is not None and (timestamp is None or timestamp >= until):
+                continue
+            records.append(self.record(row))
+        more = len(records) > limit
+        del records[limit:]
+        return records, records[-1]["row"] if more and records else None
+
+    def latest_time(self):
+        """The latest timestamp recorded, or ``None``."""
+        return self._times[-1] if self._times else None
+
+    def columns(self):
+        return {
+            "type": list(self.type),
+            "card": list(self.card),
+            "counterparty": list(self.counterparty),
+            "amount": list(self.amount),
+            "timestamp": list(self.timestamp),
+        }
+
+
+class Ledger:
+    """Array-backed card store with a separate loan table.
+
+    Cards are addressed by integer index in the order they were
+    registered. Loans are rows in column lists; each card keeps its open
+    loan rows, its settled loan rows and a running unpaid principal. Each
+    loan has its own rate and number of installments, and interest on it
+    is worked out from the card's transaction counter whenever it is
+    asked for, never stored. A card's version counts the operations
+    that have changed it. Every money operation is also recorded in
+    :attr:`history`, and every ``CHECKPOINT_INTERVAL`` rows the per-card
+    state is copied to :attr:`checkpoints` so :meth:`state_at` replays
+    only a few rows.
+
+    Operations read :attr:`clock` only when no timestamp is given, and
+    :meth:`apply_entry` passes the entry's own, so replaying stamped
+    entries is deterministic.
+    """
+
+    def __init__(self, clock=_now_ms):
+        self.clock = clock
+        self.ids = []
+        self.labels = []
+        self.index = {}
+        self.balances = []
+        self.transactions = []
+        self.unpaid_principal = []
+        self.versions = []
+        self.open_loans = []
+        self.settled_loans = []
+        self.loan_card = []
+        self.loan_amount = []
+        self.loan_paid = []
+        self.loan_timestamp = []
+        self.loan_repaid_timestamp = []
+        self.loan_rate = []
+        self.loan_installments = []
+        self.loan_paid_installments = []
+        self.history = History()
+        self.checkpoints = []
+
+    @classmethod
+    def with_cards(cls, count=len(DEFAULT_CARDS), **kwargs):
+        """Create a ledger with ``card1`` .. ``card<count>`` registered."""
+        ledger = cls(**kwargs)
+        for n in range(1, count + 1):
+            ledger.register_card("card%d" % n)
+        return ledger
+
+    def __len__(self):
+        return len(self.ids)
+
+    def register_card(self, card_id, label=None):
+        """Register a card and return its index; known ids are returned as is."""
+        if card_id in self.index:
+            return self.index[card_id]
+        card = len(self.ids)
+        self.ids.append(card_id)
+        self.labels.append(label or "Card %d" % (card + 1))
+        self.index[card_id] = card
+        self.balances.append(DEFAULT_BALANCE)
+        self.transactions.append(0)
+        self.unpaid_principal.append(0)
+        self.versions.append(0)
+        self.open_loans.append([])
+        self.settled_loans.append([])
+        return card
+
+    def card_index(self, card_id):
+        if not isinstance(card_id, str) or card_id not in self.index:
+            raise LedgerError("Unknown card")
+        return self.index[card_id]
+
+    def resolve_card(self, ref):
+        """Accept a card index or id, as journal entries may hold either."""
+        if isinstance(ref, int) and not isinstance(ref, bool):
+            if 0 <= ref < len(self.ids):
+                return ref
+            raise LedgerError("Unknown card")
+        return self.card_index(ref)
+
+    def add_loan(self, card, amount, timestamp, repaid_timestamp=None,
+                 rate=LOAN_RATE, installments=1, paid_installments=0):
+        row = len(self.loan_card)
+        paid = repaid_timestamp is not None
+        self.loan_card.append(card)
+        self.loan_amount.append(amount)
+        self.loan_paid.append(paid)
+        self.loan_timestamp.append(timestamp)
+        self.loan_repaid_timestamp.append(repaid_timestamp)
+        self.loan_rate.append(rate)
+        self.loan_installments.append(installments)
+        self.loan_paid_installments.append(paid_installments)
+        if paid:
+            self.settled_loans[card].append(row)
+        else:
+            self.open_loans[card].append(row)
+            self.unpaid_principal[card] += self.outstanding_principal(row)
+        return row
+
+    def settle_loans(self, card, timestamp):
+        for row in self.open_loans[card]:
+            self.loan_paid[row] = True
+            self.loan_repaid_timestamp[row] = timestamp
+        self.settled_loans[card].extend(self.open_loans[card])
+        self.open_loans[card] = []
+        self.unpaid_principal[card] = 0
+
+    def transfer(self, sender, receiver, amount, timestamp=None):
+        if sender == receiver:
+            raise LedgerError("Cannot transfer to the same card")
+        if amount > self.balances[sender]:
+            raise LedgerError("Insufficient funds for transfer")
+        self._check_credit(receiver, amount)
+        self.balances[sender] -= amount
+        self.balances[receiver] += amount
+        self.versions[sender] += 1
+        self.versions[receiver] += 1
+        self._record("transfer", sender, receiver, amount, timestamp)
+
+    def bid(self, card, amount, timestamp=None):
+        if amount > self.balances[card]:
+            raise LedgerError("Insufficient funds for bid")
+        self.balances[card] -= amount
+        self.transactions[card] += 1
+        self.versions[card] += 1
+        self._record("bid", card, None, amount, timestamp)
+
+    def loan(self, card, amount, timestamp=None, rate=LOAN_RATE, installments=1):
+        """Lend to a card on the given terms; returns the loan's row."""
+        self._check_credit(card, amount)
+        if self.unpaid_principal[card] + amount > MAX_MONEY:
+            raise LedgerError("Balance too large")
+        _check_loan_terms(amount, rate, installments)
+        timestamp = self._timestamp(timestamp)
+        self.balances[card] += amount
+        self.versions[card] += 1
+        row = self.add_loan(card, amount, timestamp, rate=rate, installments=installments)
+        self._record("loan", card, None, amount, timestamp)
+        return row
+
+    def repayment_due(self, card):
+        """Return ``(total, interest)`` owed by a card, or raise if nothing is due.
+
+        Interest is charged on the outstanding principal of each rate
+        together, so loans on default terms are rounded once.
+        """
+        transactions = self.transactions[card]
+        if transactions == 0:
+            raise LedgerError("No loans to repay")
+        if not self.open_loans[card]:
+            raise LedgerError("No unpaid loans found")
+        by_rate = defaultdict(int)
+        for row in self.open_loans[card]:
+            by_rate[self.loan_rate[row]] += self.outstanding_principal(row)
+        interest = sum(percent_of(principal, interest_percent(transactions, rate))
+                       for rate, principal in by_rate.items())
+        return self.unpaid_principal[card] + interest, interest
+
+    def repay(self, card, timestamp=None):
+        """Repay every open loan of a card; returns ``(total, interest)``."""
+        total, interest = self.repayment_due(card)
+        if total > self.balances[card]:
+            raise LedgerError("Insufficient funds to repay loans")
+        timestamp = self._timestamp(timestamp)
+        self.balances[card] -= total
+        self.settle_loans(card, timestamp)
+        self.transactions[card] = 0
+        self.versions[card] += 1
+        self._record("repay", card, None, total, timestamp)
+        return total, interest
+
+    def batch(self, transfers, timestamp=None):
+        """Apply ``(sender, receiver, amount)`` transfers all or none.
+
+        ``None`` on either side is the bank: it pays a card as a ``payout``
+        and is paid as a ``charge``. Each transfer is checked against the
+        balances the ones before it leave, and nothing changes unless all
+        of them can be applied.
+        """
+        if not transfers:
+            raise LedgerError("Empty batch")
+        projected = {}
+        for sender, receiver, amount in transfers:
+            if sender == receiver:
+                raise LedgerError("Cannot transfer to the same card")
+            if sender is not None:
+                balance = projected.get(sender, self.balances[sender])
+                if amount > balance:
+                    raise LedgerError("Insufficient funds")
+                projected[sender] = balance - amount
+            if receiver is not None:
+                balance = projected.get(receiver, self.balances[receiver])
+                if balance + amount > MAX_MONEY:
+                    raise LedgerError("Balance too large")
+                projected[receiver] = balance + amount
+
+        timestamp = self._timestamp(timestamp)
+        for sender, receiver, amount in transfers:
+            if sender is None:
+                self.balances[receiver] += amount
+                self.versions[receiver] += 1
+                self._record("payout", receiver, None, amount, timestamp)
+            elif receiver is None:
+                self.balances[sender] -= amount
+                self.versions[sender] += 1
+                self._record("charge", sender, None, amount, timestamp)
+            else:
+                self.balances[sender] -= amount
+                self.balances[receiver] += amount
+                self.versions[sender] += 1
+                self.versions[receiver] += 1
+                self._record("transfer", sender, receiver, amount, timestamp)
+
+    def outstanding_principal(self, row):
+        """Principal of an open loan not yet repaid by installments."""
+        part = self.loan_amount[row] // self.loan_installments[row]
+        return self.loan_amount[row] - part * self.loan_paid_installments[row]
+
+    def installment_principal(self, row, number):
+        """Principal repaid by installment ``number`` (from 0) of a loan:
+        an equal part, or whatever division leaves for the last one."""
+        part = self.loan_amount[row] // self.loan_installments[row]
+        if number == self.loan_installments[row] - 1:
+            return self.loan_amount[row] - part * number
+        return part
+
+    def loan_percent(self, row):
+        return interest_percent(self.transactions[self.loan_card[row]], self.loan_rate[row])
+
+    def next_installment(self, row):
+        """Return ``(principal, interest)`` of the next installment due, with
+        interest on the principal still outstanding."""
+        if self.loan_paid[row]:
+            raise LedgerError("No unpaid loans found")
+        principal = self.installment_principal(row, self.loan_paid_installments[row])
+        return principal, percent_of(self.outstanding_principal(row), self.loan_percent(row))
+
+    def pay_installment(self, row, timestamp=None):
+        """Pay the next installment of an open loan, settling it with the
+        last one; returns ``(principal, interest)``."""
+        principal, interest = self.next_installment(row)
+        card = self.loan_card[row]
+        if principal + interest > self.balances[card]:
+            raise LedgerError("Insufficient funds to repay loans")
+        timestamp = self._timestamp(timestamp)
+        self.unpaid_principal[card] -= principal
+        self.loan_paid_installments[row] += 1
+        if self.loan_paid_installments[row] == self.loan_installments[row]:
+            self.loan_paid[row] = True
+            self.loan_repaid_timestamp[row] = timestamp
+            self.open_loans[card].remove(row)
+            self.settled_loans[card].append(row)
+        self.versions[card] += 1
+        # Each amount comes off before its row, so a checkpoint between them is exact
+        self.balances[card] -= principal
+        self._record("installment", card, None, principal, timestamp)
+        if interest:
+            self.balances[card] -= interest
+            self._record("interest", card, None, interest, timestamp)
+        return principal, interest
+
+    def loan_summary(self, row):
+        """A loan and what is owed on it now, like the page's ``loanSummary``."""
+        is_open = not self.loan_paid[row]
+        outstanding = self.outstanding_principal(row) if is_open else 0
+        if is_open:
+            principal, interest = self.next_installment(row)
+            due = {"principal": principal, "interest": interest, "amount": principal + interest}
+        return {
+            "loan": row,
+            "card": self.loan_card[row],
+            "amount": self.loan_amount[row],
+            "rate": self.loan_rate[row],
+            "installments": self.loan_installments[row],
+            "paidInstallments": self.loan_paid_installments[row],
+            "timestamp": self.loan_timestamp[row],
+            "repaidTimestamp": self.loan_repaid_timestamp[row],
+            "outstanding": outstanding,
+            "interest": percent_of(outstanding, self.loan_percent(row)) if is_open else 0,
+            "next": due if is_open else None,
+        }
+
+    def loan_schedule(self, row):
+        """The installments still due on a loan, at today's percent."""
+        if self.loan_paid[row]:
+            return []
+        percent = self.loan_percent(row)
+        outstanding = self.outstanding_principal(row)
+        schedule = []
+        for number in range(self.loan_paid_installments[row], self.loan_installments[row]):
+            principal = self.installment_principal(row, number)
+            interest = percent_of(outstanding, percent)
+            schedule.append({"number": number + 1, "principal": principal,
+                             "interest": interest, "amount": principal + interest})
+            outstanding -= principal
+        return schedule
+
+    def loan_book(self, card=None, settled=False):
+        """Summaries of the open loans of a card, or of every card, plus the
+        settled ones if ``settled``, oldest first."""
+        rows = []
+        for index in range(len(self.ids)) if card is None else (card,):
+            rows.extend(self.open_loans[index])
+            if settled:
+                rows.extend(self.settled_loans[index])
+        return [self.loan_summary(row) for row in sorted(rows)]
+
+    def _check_credit(self, card, amount):
+        if self.balances[card] + amount > MAX_MONEY:
+            raise LedgerError("Balance too large")
+
+    def _timestamp(self, timestamp):
+        return self.clock() if timestamp is None else timestamp
+
+    def _record(self, kind, card, counterparty, amount, timestamp):
+        self.history.add(kind, card, counterparty, amount, self._timestamp(timestamp))
+        if len(self.history) % CHECKPOINT_INTERVAL == 0:
+            self.add_checkpoint()
+
+    def add_checkpoint(self):
+        """Copy the per-card state as of the end of the history."""
+        self.checkpoints.append({
+            "row": len(self.history),
+            "time": self.history.latest_time(),
+            "balances": list(self.balances),
+            "transactions": list(self.transactions),
+            "principal": list(self.unpaid_principal),
+        })
+
+    def state_at(self, timestamp):
+        """Per-card state as of ``timestamp``, like the page's ``stateAt``.
+
+        Covers every history row before the first one stamped later than
+        ``timestamp``; cards registered since show their opening state.
+        """
+        times = [-math.inf if c["time"] is None else c["time"] for c in self.checkpoints]
+        found = bisect.bisect_right(times, timestamp) - 1
+        checkpoint = self.checkpoints[found] if found >= 0 else None
+        state = []
+        for card, card_id in enumerate(self.ids):
+            saved = checkpoint is not None and card < len(checkpoint["balances"])
+            state.append({
+                "index": card,
+                "id": card_id,
+                "label": self.labels[card],
+                "balance": checkpoint["balances"][card] if saved else DEFAULT_BALANCE,
+                "transactions": checkpoint["transactions"][card] if saved else 0,
+                "principal": checkpoint["principal"][card] if saved else 0,
+            })
+
+        history = self.history
+        for row in range(0 if checkpoint is None else checkpoint["row"], len(history)):
+            if history.timestamp[row] is not None and history.timestamp[row] > timestamp:
+                break
+            card = state[history.card[row]]
+            amount = history.amount[row]
+            kind = history.type[row]
+            if kind == "transfer":
+                card["balance"] -= amount
+                state[history.counterparty[row]]["balance"] += amount
+            elif kind == "bid":
+                card["balance"] -= amount
+                card["transactions"] += 1
+            elif kind == "loan":
+                card["balance"] += amount
+                card["principal"] += amount
+            elif kind == "repay":
+                card["balance"] -= amount
+                card["transactions"] = 0
+                card["principal"] = 0
+            elif kind == "payout":
+                card["balance"] += amount
+            elif kind in ("charge", "interest"):
+                card["balance"] -= amount
+            elif kind == "installment":
+                card["balance"] -= amount
+                card["principal"] -= amount
+        return state
+
+    def apply_entry(self, entry):
+        """Validate and apply one journal entry as written by the page.
+
+        Raises :class:`LedgerError` without changing anything if the entry
+        is not valid against the current state, or :class:`ConflictError`
+        if it carries a ``version`` for the card it debits and that card
+        has changed since. Credits are never version-checked: they commute,
+        so a card many terminals pay into does not cause conflicts.
+        """
+        _check_entry_fields(entry)
+        kind = entry.get("type")
+        if kind == "register":
+            card_id = entry.get("id")
+            if not isinstance(card_id, str) or not card_id:
+                raise LedgerError("Invalid card id")
+            self.register_card(card_id, entry.get("label"))
+            return
+        if kind == "batch":
+            # Not version-checked: a batch stands or falls on the state it meets
+            transfers = entry.get("transfers")
+            if not isinstance(transfers, list):
+                raise LedgerError("Empty batch")
+            self.batch([self._batch_transfer(t) for t in transfers], entry.get("timestamp"))
+            return
+
+        amount = _entry_amount(entry)
+
+        if kind == "transfer":
+            sender = self.resolve_card(entry.get("from"))
+            receiver = self.resolve_card(entry.get("to"))
+            self._check_version(sender, entry)
+            self.transfer(sender, receiver, amount, entry.get("timestamp"))
+        elif kind == "bid":
+            card = self.resolve_card(entry.get("card"))
+            self._check_version(card, entry)
+            self.bid(card, amount, entry.get("timestamp"))
+        elif kind == "loan":
+            self.loan(self.resolve_card(entry.get("card")), amount, entry.get("timestamp"),
+                      entry.get("rate", LOAN_RATE), entry.get("installments", 1))
+        elif kind == "repay":
+            card = self.resolve_card(entry.get("card"))
+            self._check_version(card, entry)
+            total, _ = self.repayment_due(card)
+            if total != amount:
+                raise LedgerError("Repayment amount does not match the ledger")
+            self.repay(card, entry.get("timestamp"))
+        elif kind == "installment":
+            card = self.resolve_card(entry.get("card"))
+            self._check_version(card, entry)
+            row = entry.get("loan")
+            if (not isinstance(row, int) or isinstance(row, bool) or not 0 <= row < len(self.loan_card)
+                    or self.loan_card[row] != card or self.loan_paid[row]):
+                raise LedgerError("No unpaid loans found")
+            principal, interest = self.next_installment(row)
+            if (entry.get("principal"), entry.get("interest"), amount) != (principal, interest, principal + interest):
+                raise LedgerError("Installment does not match the ledger")
+            self.pay_installment(row, entry.get("timestamp"))
+        else:
+            raise LedgerError("Unknown journal entry type: %s" % kind)
+
+    def _batch_transfer(self, transfer):
+        if not isinstance(transfer, dict):
+            raise LedgerError("Invalid entry")
+        sender, receiver = transfer.get("from"), transfer.get("to")
+        return (None if sender is None else self.resolve_card(sender),
+                None if receiver is None else self.resolve_card(receiver),
+                _entry_amount(transfer))
+
+    def _check_version(self, card, entry):
+        version = entry.get("version")
+        if version is not None and version != self.versions[card]:
+            raise ConflictError("Card was changed on another terminal")
+
+    def snapshot(self, seq=0):
+        """Return the page's columnar snapshot (``saveCardData``) as a dict."""
+        return {
+            "version": SNAPSHOT_VERSION,
+            "seq": seq,
+            "ids": list(self.ids),
+            "labels": list(self.labels),
+            "balances": list(self.balances),
+            "transactions": list(self.transactions),
+            "versions": list(self.versions),
+            "loans": {
+                "card": list(self.loan_card),
+                "amount": list(self.loan_amount),
+                "paid": list(self.loan_paid),
+                "timestamp": list(self.loan_timestamp),
+                "repaidTimestamp": list(self.loan_repaid_timestamp),
+                "rate": list(self.loan_rate),
+                "installments": list(self.loan_installments),
+                "paidInstallments": list(self.loan_paid_installments),
+            },
+            "history": self.history.columns(),
+            "checkpoints": [dict(c) for c in self.checkpoints],
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot, **kwargs):
+        """Rebuild a ledger from :meth:`snapshot` output or a page snapshot."""
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            raise ValueError("unsupported snapshot version: %r" % snapshot.get("version"))
+        ledger = cls(**kwargs)
+        versions = snapshot.get("versions")
+        for card, card_id in enumerate(snapshot["ids"]):
+            ledger.register_card(card_id, snapshot["labels"][card])
+            ledger.balances[card] = snapshot["balances"][card]
+            ledger.transactions[card] = snapshot["transactions"][card]
+            ledger.versions[card] = versions[card] if versions else 0
+        loans = snapshot["loans"]
+        # Snapshots from before loan terms hold default-term loans
+        count = len(loans["card"])
+        rates = loans.get("rate") or [LOAN_RATE] * count
+        installments = loans.get("installments") or [1] * count
+        paid_installments = loans.get("paidInstallments") or [0] * count
+        for row, card in enumerate(loans["card"]):
+            repaid = loans["repaidTimestamp"][row] if loans["paid"][row] else None
+            ledger.add_loan(card, loans["amount"][row], loans["timestamp"][row], repaid,
+                            rates[row], installments[row], paid_installments[row])
+        history = snapshot.get("history")
+        if history:
+            for row, kind in enumerate(history["type"]):
+                ledger.history.add(kind, history["card"][row], history["counterparty"][row],
+                                   history["amount"][row], history["timestamp"][row])
+        if "checkpoints" in snapshot:
+            ledger.checkpoints = [dict(c) for c in snapshot["checkpoints"]]
+        elif not len(ledger.history):
+            ledger.add_checkpoint()
+        return ledger
+
+
+class Auction:
+    """One lot sold by open bidding, like the page's auction intents.
+
+    The bid book is three column lists in the order bids were placed;
+    each bid beats the one before, so the last bid leads. Bidding closes
+    ``timeout`` ms after the latest bid. :meth:`settle` charges the
+    leader alone with one ledger bid; a leader who can no longer pay has
+    their bids withdrawn and the lot falls to the highest remaining bid.
+    """
+
+    def __init__(self, ledger, base, timeout=AUCTION_TIMEOUT, timestamp=None):
+        self.ledger = ledger
+        self.base = base
+        self.timeout = timeout
+        self.status = "open"  # open, closed (bidding over), sold or unsold
+        self.closes_at = ledger._timestamp(timestamp) + timeout
+        self._clear()
+
+    def _clear(self):
+        self.bid_card = []
+        self.bid_amount = []
+        self.bid_timestamp = []
+
+    @property
+    def price(self):
+        return self.bid_amount[-1] if self.bid_amount else self.base
+
+    @property
+    def leader(self):
+        return self.bid_card[-1] if self.bid_card else None
+
+    def expire(self, now):
+        if self.status == "open" and now >= self.closes_at:
+            self.status = "closed" if self.bid_card else "unsold"
+
+    def summary(self, lot):
+        """The lot as the page's ``lotSummary`` gives it."""
+        return {"lot": lot, "base": self.base, "price": self.price, "leader": self.leader,
+                "bids": len(self.bid_card), "closesAt": self.closes_at, "status": self.status}
+
+    def place(self, card, amount, timestamp=None):
+        now = self.ledger._timestamp(timestamp)
+        self.expire(now)
+        if self.status != "open":
+            raise AuctionError("Bidding has closed", "closed")
+        if amount <= self.price if self.bid_card else amount < self.base:
+            raise AuctionError("Bid is too low", "too_low")
+        if not isinstance(card, int) or isinstance(card, bool) or not 0 <= card < len(self.ledger.ids):
+            raise AuctionError("Unknown card", "unknown_card")
+        if amount > self.ledger.balances[card]:
+            raise AuctionError("Insufficient funds for bid", "insufficient_funds")
+        self.bid_card.append(card)
+        self.bid_amount.append(amount)
+        self.bid_timestamp.append(now)
+        self.closes_at = now + self.timeout
+
+    def raise_bid(self, card, increment, timestamp=None):
+        self.place(card, self.price + increment, timestamp)
+
+    def reset(self, card=None, timestamp=None):
+        """Clear the book and reopen; ``card`` bids the base again."""
+        now = self.ledger._timestamp(timestamp)
+        self._clear()
+        self.status = "open"
+        self.closes_at = now + self.timeout
+        if card is not None:
+            self.place(card, self.base, now)
+
+    def settle(self, card, timestamp=None):
+        """Charge the leader, whose card was tapped; returns the price."""
+        now = self.ledger._timestamp(timestamp)
+        amount = self.claim(card)
+        self.ledger.bid(card, amount, now)
+        self.status = "sold"
+        return amount
+
+    def claim(self, card):
+        """Check that ``card`` leads and can pay, and return the price; a
+        leader who cannot pay has their bids withdrawn."""
+        if not self.bid_card:
+            raise AuctionError("No bids", "no_bids")
+        winner = self.leader
+        if card != winner:
+            raise AuctionError("Not the winning bid", "not_winner")
+        amount = self.price
+        if amount > self.ledger.balances[winner]:
+            kept = [row for row, bidder in enumerate(self.bid_card) if bidder != winner]
+            self.bid_card = [self.bid_card[row] for row in kept]
+            self.bid_amount = [self.bid_amount[row] for row in kept]
+            self.bid_timestamp = [self.bid_timestamp[row] for row in kept]
+            if not kept:
+                self.status = "unsold"
+            raise AuctionError("Insufficient funds for bid", "insufficient_funds")
+        return amount
+
+
+class Terminal:
+    """The page's tap/keypad state machine driving a :class:`Ledger`.
+
+    ``message`` mirrors the message display and ``notification`` the last
+    ``(text, type)`` toast. After a successful operation the page returns
+    to idle on a 3 second timer; here that reset is applied just before
+    the next action.
+    """
+
+    def __init__(self, ledger):
+        self.ledger = ledger
+        self.mode = "idle"
+        self.message = "Tap a card to begin"
+        self.notification = None
+        self.keypad = "0"
+        self._reset_pending = False
+        self._clear_selection()
+
+    def _clear_selection(self):
+        self.current_card = None
+        self.sender = None
+        self.receiver = None
+        self.amount = 0
+        self.base_bid = 0
+        self.current_bid = 0
+        self.opener = None
+        self.auction = None
+
+    def _notify(self, text, kind="success"):
+        self.notification = (text, kind)
+
+    def _fail(self, message, notification):
+        self.message = message
+        self._notify(notification, "error")
+
+    def _succeeded(self):
+        self._reset_pending = True
+
+    def _before_action(self):
+        if self._reset_pending:
+            self.reset()
+
+    def _display_card(self, card):
+        count = self.ledger.transactions[card]
+        if count > 0:
+            self.message = "Please repay %d" % count
+        else:
+            self.message = "%s - Ready" % self.ledger.labels[card]
+
+    # Modes
+
+    def reset(self):
+        self._reset_pending = False
+        self.mode = "idle"
+        self.message = "Tap a card to begin"
+        self._clear_selection()
+
+    def start_transfer(self):
+        self.reset()
+        self.mode = "transfer_sender"
+        self.message = "Tap sender's card"
+
+    def start_bidding(self):
+        self.reset()
+        self.mode = "bidding_card"
+        self.message = "Tap card of bidder"
+
+    def start_loan(self):
+        self.reset()
+        self.mode = "loan_card"
+        self.message = "Tap card to receive loan"
+
+    def start_repay(self):
+        self.reset()
+        self.mode = "repay_card"
+        self.message = "Tap card to repay loan"
+
+    # Card taps
+
+    def tap(self, card_id):
+        self._before_action()
+        card = self.ledger.index.get(card_id)
+        if card is None:
+            self._fail("Unknown card", "Unknown card")
+            return
+        self.current_card = card
+        mode = self.mode
+
+        if mode == "idle":
+            self._display_card(card)
+        elif mode == "transfer_sender":
+            self.sender = card
+            self.message = "Enter amount to transfer"
+            self.mode = "transfer_amount"
+            self.keypad = "0"
+        elif mode == "transfer_receiver":
+            self.receiver = card
+            self._process_transfer()
+        elif mode == "bidding_card":
+            self.message = "Enter base bid amount"
+            self.mode = "bidding_base"
+            self.keypad = "0"
+        elif mode == "bidding_increment":
+            self.message = "%s bidding" % self.ledger.labels[card]
+        elif mode == "bidding_final":
+            self._process_bid(card)
+        elif mode == "loan_card":
+            self.message = "Enter loan amount"
+            self.mode = "loan_amount"
+            self.keypad = "0"
+        elif mode == "repay_card":
+            self._process_repayment(card)
+
+    def _process_transfer(self):
+        ledger = self.ledger
+        try:
+            ledger.transfer(self.sender, self.receiver, self.amount)
+        except LedgerError as e:
+            notice = "Insufficient funds" if "Insufficient" in str(e) else str(e)
+            self._fail(str(e), notice)
+            return
+        amount_str = format_amount(self.amount)
+        self._notify("Transferred %s successfully" % amount_str)
+        self.message = "Transferred %s from %s to %s" % (
+            amount_str, ledger.labels[self.sender], ledger.labels[self.receiver])
+        self._succeeded()
+
+    def _process_bid(self, card):
+        auction = self.auction
+        if auction is None:
+            return
+        try:
+            price = auction.settle(card)
+        except LedgerError as e:
+            if str(e) == "Not the winning bid":
+                self._fail("Winning bid is %s's" % self.ledger.labels[auction.leader], str(e))
+            elif "Insufficient" in str(e):
+                self._fail(str(e), "Insufficient funds")
+                self._show_lot()
+            else:
+                self._fail("Error processing bid", "Error processing bid")
+            return
+        self.auction = None
+        self._display_card(card)
+        self._notify("Bid of %s paid successfully" % format_amount(price))
+        self._succeeded()
+
+    def _show_lot(self):
+        self.current_bid = self.auction.price
+        if self.auction.status == "unsold":
+            self.message = "No bids left"
+            self.auction = None
+            self._succeeded()
+        elif self.auction.status == "closed" and self.mode == "bidding_increment":
+            self.confirm_bid()
+
+    def _process_loan(self):
+        ledger = self.ledger
+        card = self.current_card
+        try:
+            ledger.loan(card, self.amount)
+        except LedgerError:
+            self._fail("Error processing loan", "Error processing loan")
+            return
+        amount_str = format_amount(self.amount)
+        self._notify("Loan of %s added successfully" % amount_str)
+        self.message = "Loan of %s added to %s" % (amount_str, ledger.labels[card])
+        self._succeeded()
+
+    def _process_repayment(self, card):
+        try:
+            total, interest = self.ledger.repay(card)
+        except LedgerError as e:
+            notice = "Insufficient funds" if "Insufficient" in str(e) else str(e)
+            self._fail(str(e), notice)
+            return
+        self._notify("Repayment successful")
+        self.message = "Repaid %s (incl. %s interest)" % (
+            format_amount(total), format_amount(interest))
+        self._succeeded()
+
+    # Keypad
+
+    def press(self, value):
+        self._before_action()
+        if len(self.keypad) >= MAX_AMOUNT_DIGITS and self.keypad != "0":
+            return
+        self.keypad = value if self.keypad == "0" else self.keypad + value
+        self.keypad = str(int(self.keypad))
+
+    def clear(self):
+        self._before_action()
+        self.keypad = "0"
+
+    def backspace(self):
+        self._before_action()
+        self.keypad = self.keypad[:-1] if len(self.keypad) > 1 else "0"
+
+    def confirm_amount(self):
+        self._before_action()
+        entered = int(self.keypad)
+        if entered <= 0:
+            self.message = "Please enter a valid amount"
+            return
+        self.amount = entered
+        mode = self.mode
+
+        if mode == "transfer_amount":
+            if entered > self.ledger.balances[self.sender]:
+                self._fail("Insufficient funds", "Insufficient funds")
+                return
+            self.message = "Tap receiver's card"
+            self.mode = "transfer_receiver"
+        elif mode == "bidding_base":
+            self.base_bid = entered
+            self.current_bid = entered
+            self.message = "Adjust bid with increments"
+            self.mode = "bidding_increment"
+            self.opener = self.current_card
+            now = self.ledger.clock()
+            self.auction = Auction(self.ledger, entered, timestamp=now)
+            try:
+                self.auction.place(self.opener, entered, now)
+            except LedgerError as e:
+                self.auction = None
+                self._fail(str(e), "Insufficient funds")
+                self._succeeded()
+        elif mode == "loan_amount":
+            self._process_loan()
+
+    def enter_amount(self, amount):
+        """Type ``amount`` on a cleared keypad and confirm it."""
+        self.clear()
+        self.press(str(amount))
+        self.confirm_amount()
+
+    # Bidding
+
+    def add_to_bid(self, increment):
+        """Raise the lot by ``increment`` for the card tapped last."""
+        self._before_action()
+        if self.auction is None:
+            return
+        card = self.current_card
+        try:
+            self.auction.raise_bid(card, increment)
+        except LedgerError as e:
+            if "Insufficient" in str(e):
+                self._fail("%s cannot afford that bid" % self.ledger.labels[card], "Insufficient funds")
+            elif str(e) == "Bidding has closed":
+                self._notify(str(e), "error")
+            else:
+                self._notify("Error processing bid", "error")
+        else:
+            if self.mode == "bidding_increment":
+                self.message = "%s leads" % self.ledger.labels[card]
+        self._show_lot()
+
+    def reset_bid(self):
+        """Clear the lot's bids back to the opening bid."""
+        self._before_action()
+        if self.auction is None:
+            return
+        self.auction.reset(self.opener)
+        self._show_lot()
+
+    def confirm_bid(self):
+        self._before_action()
+        if self.auction is None:
+            return
+        self.message = "Tap winning card to pay bid"
+        self.mode = "bidding_final"
+
+
+# Script actions: name -> (Terminal method, argument parser or None)
+ACTIONS = {
+    "transfer": ("start_transfer", None),
+    "bidding": ("start_bidding", None),
+    "loan": ("start_loan", None),
+    "repay": ("start_repay", None),
+    "reset": ("reset", None),
+    "tap": ("tap", str),
+    "amount": ("enter_amount", int),
+    "press": ("press", str),
+    "clear": ("clear", None),
+    "backspace": ("backspace", None),
+    "confirm": ("confirm_amount", None),
+    "inc": ("add_to_bid", int),
+    "resetbid": ("reset_bid", None),
+    "confirmbid": ("confirm_bid", None),
+}
+
+
+def parse_script(lines):
+    """Parse tap-script lines into ``(action, argument)`` pairs."""
+    steps = []
+    for lineno, line in enumerate(lines, 1):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        name, _, arg = line.partition(" ")
+        if name not in ACTIONS:
+            raise ValueError("line %d: unknown action %r" % (lineno, name))
+        _, parse = ACTIONS[name]
+        if parse is None:
+            steps.append((name, None))
+        elif not arg.strip():
+            raise ValueError("line %d: %s needs an argument" % (lineno, name))
+        else:
+            steps.append((name, parse(arg.strip())))
+    return steps
+
+
+def replay(terminal, steps, repeat=1):
+    """Run ``steps`` ``repeat`` times; returns ``{action: [count, seconds]}``."""
+    bound = [(name, getattr(terminal, ACTIONS[name][0]), arg) for name, arg in steps]
+    stats = {name: [0, 0.0] for name, _ in steps}
+    clock = time.perf_counter
+    for _ in range(repeat):
+        for name, method, arg in bound:
+            start = clock()
+            if arg is None:
+                method()
+            else:
+                method(arg)
+            entry = stats[name]
+            entry[0] += 1
+            entry[1] += clock() - start
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("script", help="tap script file, or - for stdin")
+    parser.add_argument("--cards", type=int, default=len(DEFAULT_CARDS),
+                        help="number of cards to register (card1..cardN)")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="times to replay the script")
+    args = parser.parse_args(argv)
+
+    if args.script == "-":
+        steps = parse_script(sys.stdin)
+    else:
+        with open(args.script) as f:
+            steps = parse_script(f)
+
+    terminal = Terminal(Ledger.with_cards(args.cards))
+    start = time.perf_counter()
+    stats = replay(terminal, steps, args.repeat)
+    elapsed = time.perf_counter() - start
+
+    total = sum(count for count, _ in stats.values())
+    print("%d actions in %.3fs (%.0f actions/s)" % (total, elapsed, total / elapsed if elapsed else 0))
+    for name, (count, seconds) in sorted(stats.items()):
+        print("  %-11s %10d  %8.3f us/op" % (name, count, seconds / count * 1e6))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,9 @@
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Monopoly Transactor</title>
+    <meta name="theme-color" content="#5D5CDE">
+    <link rel="manifest" href="manifest.webmanifest">
+    <link rel="icon" href="icon.svg" type="image/svg+xml">
     <script src="https://cdn.tailwindcss.com"></script>
     <style>
         :root {
@@ -137,10 +140,10 @@
 
         <!-- Card Simulation Buttons -->
         <div class="grid grid-cols-2 gap-4 mb-6">
-            <button id="card1-btn" class="card p-4 py-5 text-center btn bg-primary-100 hover:bg-primary-200 active:bg-primary-300" style="background-color: var(--primary-color); color: white;">
+            <button id="card1-btn" data-card="card1" class="card p-4 py-5 text-center btn bg-primary-100 hover:bg-primary-200 active:bg-primary-300" style="background-color: var(--primary-color); color: white;">
                 Simulate Card 1
             </button>
-            <button id="card2-btn" class="card p-4 py-5 text-center btn bg-secondary-100 hover:bg-secondary-200 active:bg-secondary-300" style="background-color: var(--secondary-color); color: white;">
+            <button id="card2-btn" data-card="card2" class="card p-4 py-5 text-center btn bg-secondary-100 hover:bg-secondary-200 active:bg-secondary-300" style="background-color: var(--secondary-color); color: white;">
                 Simulate Card 2
             </button>
         </div>
@@ -217,6 +220,18 @@
             <button id="reset-btn" class="px-4 py-2 rounded text-white" style="background-color: var(--primary-color);">
                 Reset
             </button>
+            <button id="reader-btn" class="px-4 py-2 rounded text-white hidden" style="background-color: var(--secondary-color);">
+                Connect Reader
+            </button>
+            <button id="register-btn" class="px-4 py-2 rounded text-white hidden" style="background-color: var(--secondary-color);">
+                Add Card
+            </button>
+        </div>
+
+        <!-- Diagnostics (tap the version line five times to show) -->
+        <div id="diagnostics" class="card p-4 md:p-6 mb-6 hidden">
+            <h2 class="text-xl font-semibold mb-2">Diagnostics</h2>
+            <pre class="text-sm font-mono" id="diagnostics-output"></pre>
         </div>
 
         <!-- Notification -->
@@ -225,48 +240,2427 @@
         </div>
     </div>
 
-    <script>
+    <script id="ledger-engine">
         // Card Data Management
         const DEFAULT_BALANCE = 1500000; // 1.5M
-        let cards = {};
+        const DEFAULT_CARDS = ['card1', 'card2'];
+        const STORAGE_KEY = 'monopolyCards';
+        const SNAPSHOT_VERSION = 2;
+        const JOURNAL_PREFIX = 'monopolyJournal:';
+        const COMPACT_INTERVAL = 100; // journal entries between snapshots
+        const MAX_MONEY = Number.MAX_SAFE_INTEGER; // largest exact whole-dollar amount
+        const LOAN_RATE = 5; // base interest percent of a loan taken on default terms
+        const MAX_LOAN_RATE = 100;
+        const MAX_INSTALLMENTS = 52;
+        let journalStart = 0; // first journal entry not covered by the snapshot
+        let journalSeq = 0; // next journal entry to write
+        
+        // Ledger Store
+        // Cards are addressed by integer index. Per-card fields live in typed
+        // arrays that grow by doubling; loans live in a separate column table.
+        // Each card keeps its unpaid principal as a running total, the rows of
+        // its open loans, and an archive of rows it has already settled. Each
+        // loan has its own terms (see Loan Book) and counts the installments
+        // paid on it; nothing else about a loan changes until it is settled. A
+        // card's version counts the entries that have changed it. Money is
+        // whole dollars: balances and principal are doubles that only ever
+        // hold integers, which are exact up to MAX_MONEY, and checkEntry
+        // rejects entries that would leave that range.
+        let cardCount = 0;
+        let cardIds = [];
+        let cardLabels = [];
+        let cardIndex = new Map();
+        let balances = new Float64Array(16);
+        let transactionCounts = new Uint32Array(16);
+        let unpaidPrincipal = new Float64Array(16);
+        let cardVersions = new Uint32Array(16);
+        let openLoans = [];
+        let settledLoans = [];
+        let loans = createLoanTable();
+        
+        function createLoanTable() {
+            return {
+                card: [], amount: [], paid: [], timestamp: [], repaidTimestamp: [],
+                rate: [], installments: [], paidInstallments: []
+            };
+        }
+        
+        function clearLedger() {
+            cardCount = 0;
+            cardIds = [];
+            cardLabels = [];
+            cardIndex = new Map();
+            balances = new Float64Array(16);
+            transactionCounts = new Uint32Array(16);
+            unpaidPrincipal = new Float64Array(16);
+            cardVersions = new Uint32Array(16);
+            openLoans = [];
+            settledLoans = [];
+            loans = createLoanTable();
+            clearHistory();
+        }
+        
+        function growCardStore() {
+            const newBalances = new Float64Array(balances.length * 2);
+            newBalances.set(balances);
+            balances = newBalances;
+            const newTransactions = new Uint32Array(transactionCounts.length * 2);
+            newTransactions.set(transactionCounts);
+            transactionCounts = newTransactions;
+            const newPrincipal = new Float64Array(unpaidPrincipal.length * 2);
+            newPrincipal.set(unpaidPrincipal);
+            unpaidPrincipal = newPrincipal;
+            const newVersions = new Uint32Array(cardVersions.length * 2);
+            newVersions.set(cardVersions);
+            cardVersions = newVersions;
+        }
+        
+        function registerCard(id, label) {
+            if (cardIndex.has(id)) return cardIndex.get(id);
+            if (cardCount === balances.length) growCardStore();
+            
+            const index = cardCount++;
+            cardIds.push(id);
+            cardLabels.push(label || `Card ${index + 1}`);
+            cardIndex.set(id, index);
+            balances[index] = DEFAULT_BALANCE;
+            transactionCounts[index] = 0;
+            unpaidPrincipal[index] = 0;
+            cardVersions[index] = 0;
+            openLoans.push([]);
+            settledLoans.push([]);
+            historyByCard.push([]);
+            return index;
+        }
+        
+        function addLoan(card, amount, timestamp, repaidTimestamp = null,
+                         rate = LOAN_RATE, installments = 1, paidInstallments = 0) {
+            const row = loans.card.length;
+            const paid = repaidTimestamp !== null;
+            loans.card.push(card);
+            loans.amount.push(amount);
+            loans.paid.push(paid);
+            loans.timestamp.push(timestamp);
+            loans.repaidTimestamp.push(repaidTimestamp);
+            loans.rate.push(rate);
+            loans.installments.push(installments);
+            loans.paidInstallments.push(paidInstallments);
+            
+            if (paid) {
+                settledLoans[card].push(row);
+            } else {
+                openLoans[card].push(row);
+                unpaidPrincipal[card] += outstandingPrincipal(row);
+            }
+            return row;
+        }
+        
+        // Mark every open loan of a card as paid and move it to the archive
+        function settleLoans(card, timestamp) {
+            const open = openLoans[card];
+            for (let i = 0; i < open.length; i++) {
+                loans.paid[open[i]] = true;
+                loans.repaidTimestamp[open[i]] = timestamp;
+                settledLoans[card].push(open[i]);
+            }
+            openLoans[card] = [];
+            unpaidPrincipal[card] = 0;
+        }
+        
+        function isCard(card) {
+            return Number.isInteger(card) && card >= 0 && card < cardCount;
+        }
+        
+        // Journal entries written before cards were indexed refer to them by
+        // id. Anything that is not a card of this ledger resolves to undefined.
+        function resolveCard(ref) {
+            const card = typeof ref === 'number' ? ref : cardIndex.get(ref);
+            return isCard(card) ? card : undefined;
+        }
+        
+        // Transaction History
+        // Every applied money entry becomes a history row, in ledger order.
+        // Rows are indexed by card (both sides of a transfer), by entry type
+        // and by time, so a query only walks rows that can match it.
+        let history = createHistoryTable();
+        let historyByCard = [];
+        let historyByType = new Map();
+        let historyByTime = []; // rows with a timestamp, in time order
+        
+        function createHistoryTable() {
+            return { type: [], card: [], counterparty: [], amount: [], timestamp: [] };
+        }
+        
+        function clearHistory() {
+            history = createHistoryTable();
+            historyByCard = cardIds.map(() => []);
+            historyByType = new Map();
+            historyByTime = [];
+            checkpoints = [];
+        }
+        
+        function addHistory(type, card, counterparty, amount, timestamp) {
+            const row = history.type.length;
+            history.type.push(type);
+            history.card.push(card);
+            history.counterparty.push(counterparty);
+            history.amount.push(amount);
+            history.timestamp.push(timestamp);
+            
+            historyByCard[card].push(row);
+            if (counterparty !== null) historyByCard[counterparty].push(row);
+            if (!historyByType.has(type)) historyByType.set(type, []);
+            historyByType.get(type).push(row);
+            if (timestamp !== null) {
+                // Almost always the newest, so this inserts at the end
+                historyByTime.splice(bisect(historyByTime, timestamp, historyTime, true), 0, row);
+            }
+            return row;
+        }
+        
+        function historyTime(row) {
+            return history.timestamp[row];
+        }
+        
+        // First position in a sorted list whose key is >= value, or > value
+        // when `after` is set
+        function bisect(list, value, key, after = false) {
+            let low = 0;
+            let high = list.length;
+            while (low < high) {
+                const mid = (low + high) >> 1;
+                const current = key(list[mid]);
+                if (current < value || (after && current === value)) {
+                    low = mid + 1;
+                } else {
+                    high = mid;
+                }
+            }
+            return low;
+        }
+        
+        function historyRecord(row) {
+            return {
+                row: row,
+                type: history.type[row],
+                card: history.card[row],
+                counterparty: history.counterparty[row],
+                amount: history.amount[row],
+                timestamp: history.timestamp[row]
+            };
+        }
+        
+        // Newest first: up to `limit` rows matching every filter given, and
+        // `next`, the `before` that continues with the following page (null
+        // when there is none). `since` is inclusive and `until` exclusive;
+        // rows without a timestamp never match a time filter.
+        function queryHistory({ card = null, type = null, since = null, until = null, before = null, limit = 20 } = {}) {
+            // Walk the smallest index that covers one of the filters
+            let candidates = null;
+            if (card !== null) candidates = historyByCard[card] || [];
+            if (type !== null) {
+                const byType = historyByType.get(type) || [];
+                if (candidates === null || byType.length < candidates.length) candidates = byType;
+            }
+            if (since !== null || until !== null) {
+                const start = since === null ? 0 : bisect(historyByTime, since, historyTime);
+                const end = until === null ? historyByTime.length : bisect(historyByTime, until, historyTime);
+                if (candidates === null || end - start < candidates.length) {
+                    candidates = historyByTime.slice(start, Math.max(start, end)).sort((a, b) => a - b);
+                }
+            }
+            
+            const end = before === null ? history.type.length : before;
+            let position = candidates === null ? end : bisect(candidates, end, row => row);
+            // One match past the page tells whether another page follows
+            const records = [];
+            while (position > 0 && records.length <= limit) {
+                position--;
+                const row = candidates === null ? position : candidates[position];
+                if (card !== null && history.card[row] !== card && history.counterparty[row] !== card) continue;
+                if (type !== null && history.type[row] !== type) continue;
+                const timestamp = history.timestamp[row];
+                if (since !== null && (timestamp === null || timestamp < since)) continue;
+                if (until !== null && (timestamp === null || timestamp >= until)) continue;
+                records.push(historyRecord(row));
+            }
+            const more = records.length > limit;
+            if (more) records.pop();
+            return { records: records, next: more && records.length > 0 ? records[records.length - 1].row : null };
+        }
+        
+        function loadHistory(saved) {
+            for (let row = 0; row < saved.type.length; row++) {
+                addHistory(saved.type[row], saved.card[row], saved.counterparty[row], saved.amount[row], saved.timestamp[row]);
+            }
+        }
+        
+        // Checkpoints
+        // Every CHECKPOINT_INTERVAL history rows the per-card state is copied,
+        // so the state as of any moment is the nearest earlier checkpoint with
+        // at most that many rows replayed forward. A ledger loaded without any
+        // history gets a checkpoint of its loaded state to replay from.
+        const CHECKPOINT_INTERVAL = 256;
+        let checkpoints = [];
+        
+        function addCheckpoint() {
+            const latest = historyByTime[historyByTime.length - 1];
+            checkpoints.push({
+                row: history.type.length,
+                time: latest === undefined ? null : history.timestamp[latest],
+                balances: Array.from(balances.subarray(0, cardCount)),
+                transactions: Array.from(transactionCounts.subarray(0, cardCount)),
+                principal: Array.from(unpaidPrincipal.subarray(0, cardCount))
+            });
+        }
+        
+        // Per-card state as of `time`: every history row before the first one
+        // stamped later than that. Cards registered since show their opening
+        // state.
+        function stateAt(time) {
+            const found = bisect(checkpoints, time, checkpoint => checkpoint.time === null ? -Infinity : checkpoint.time, true) - 1;
+            const checkpoint = found >= 0 ? checkpoints[found] : null;
+            const state = allCards().map(card => {
+                const saved = checkpoint !== null && card < checkpoint.balances.length;
+                return {
+                    index: card,
+                    id: cardIds[card],
+                    label: cardLabels[card],
+                    balance: saved ? checkpoint.balances[card] : DEFAULT_BALANCE,
+                    transactions: saved ? checkpoint.transactions[card] : 0,
+                    principal: saved ? checkpoint.principal[card] : 0
+                };
+            });
+            
+            for (let row = checkpoint === null ? 0 : checkpoint.row; row < history.type.length; row++) {
+                const timestamp = history.timestamp[row];
+                if (timestamp !== null && timestamp > time) break;
+                const card = state[history.card[row]];
+                const amount = history.amount[row];
+                switch (history.type[row]) {
+                    case 'transfer':
+                        card.balance -= amount;
+                        state[history.counterparty[row]].balance += amount;
+                        break;
+                    case 'bid':
+                        card.balance -= amount;
+                        card.transactions += 1;
+                        break;
+                    case 'loan':
+                        card.balance += amount;
+                        card.principal += amount;
+                        break;
+                    case 'repay':
+                        card.balance -= amount;
+                        card.transactions = 0;
+                        card.principal = 0;
+                        break;
+                    case 'payout':
+                        card.balance += amount;
+                        break;
+                    case 'charge':
+                    case 'interest':
+                        card.balance -= amount;
+                        break;
+                    case 'installment':
+                        card.balance -= amount;
+                        card.principal -= amount;
+                        break;
+                }
+            }
+            return state;
+        }
+        
+        // Storage Backends
+        // The ledger is persisted through `storage`, chosen once on load: the
+        // ledger server when the page is opened for a table, otherwise
+        // IndexedDB, or localStorage where IndexedDB cannot be opened, through
+        // the leading tab when several are open (see Tab Sync). Each backend
+        // has load(), which resolves false when nothing is saved yet,
+        // append(entry), called before an entry is applied, and save(), which
+        // writes the whole ledger.
+        let storage = null;
         
         // Initialize or load saved data
-        function initializeCardData() {
-            const savedData = localStorage.getItem('monopolyCards');
-            if (savedData) {
+        async function initializeCardData() {
+            storage = await chooseStorage();
+            if (!storage) {
+                throw new Error("No storage available");
+            }
+            try {
+                const start = performance.now();
+                const loaded = await storage.load();
+                measureSince('storage.load', start);
+                if (!loaded) {
+                    resetCardData();
+                }
+            } catch (e) {
+                console.error("Error loading card data:", e);
+                resetCardData();
+            }
+        }
+        
+        // Workers have no localStorage, so one that cannot open IndexedDB
+        // gets no backend at all
+        async function chooseStorage() {
+            if (serverTable) return serverStorage;
+            if (syncChannel) return leading ? leaderStorage : followerStorage;
+            const backend = await openIndexedDbStorage() ||
+                (typeof localStorage === 'undefined' ? null : localStorageStorage);
+            return backend && joinTabs(backend);
+        }
+        
+        function resetCardData() {
+            clearLedger();
+            DEFAULT_CARDS.forEach(id => registerCard(id));
+            saveCardData();
+        }
+        
+        async function saveCardData() {
+            try {
+                const start = performance.now();
+                await storage.save();
+                measureSince('storage.save', start);
+            } catch (e) {
+                console.error("Error saving card data:", e);
+                notify("Error saving data", "error");
+            }
+        }
+        
+        function loadSnapshot(snapshot) {
+            snapshot.ids.forEach((id, index) => {
+                registerCard(id, snapshot.labels[index]);
+                balances[index] = snapshot.balances[index];
+                transactionCounts[index] = snapshot.transactions[index];
+                cardVersions[index] = snapshot.versions ? snapshot.versions[index] : 0;
+            });
+            const saved = snapshot.loans;
+            for (let row = 0; row < saved.card.length; row++) {
+                const repaidTimestamp = saved.paid[row] ? saved.repaidTimestamp[row] : null;
+                // Snapshots from before loan terms hold default-term loans
+                addLoan(saved.card[row], saved.amount[row], saved.timestamp[row], repaidTimestamp,
+                        saved.rate ? saved.rate[row] : LOAN_RATE,
+                        saved.installments ? saved.installments[row] : 1,
+                        saved.paidInstallments ? saved.paidInstallments[row] : 0);
+            }
+            if (snapshot.history) loadHistory(snapshot.history);
+            if (snapshot.checkpoints) {
+                checkpoints = snapshot.checkpoints;
+            } else if (history.type.length === 0) {
+                addCheckpoint();
+            }
+        }
+        
+        function loadCardObjects(savedCards) {
+            Object.keys(savedCards).forEach(id => {
+                const saved = savedCards[id];
+                const index = registerCard(id);
+                balances[index] = saved.balance;
+                transactionCounts[index] = saved.transactions;
+                saved.loans.forEach(loan => {
+                    const repaidTimestamp = loan.paid ? (loan.repaidTimestamp || loan.timestamp) : null;
+                    addLoan(index, loan.amount, loan.timestamp, repaidTimestamp);
+                });
+            });
+            addCheckpoint();
+        }
+        
+        // localStorage: a snapshot under STORAGE_KEY plus a journal of the
+        // entries committed since, one key each
+        const localStorageStorage = {
+            load: loadLocalStorage,
+            append: appendJournal,
+            save: writeSnapshot
+        };
+        
+        function loadLocalStorage() {
+            const savedData = localStorage.getItem(STORAGE_KEY);
+            if (!savedData) return false;
+            
+            const snapshot = JSON.parse(savedData);
+            clearLedger();
+            if (snapshot.version === SNAPSHOT_VERSION) {
+                loadSnapshot(snapshot);
+                journalStart = snapshot.seq;
+            } else if (snapshot.cards) {
+                loadCardObjects(snapshot.cards);
+                journalStart = snapshot.seq;
+            } else {
+                // Saves from before the journal hold the bare cards object
+                loadCardObjects(snapshot);
+                journalStart = 0;
+            }
+            replayJournal();
+            return true;
+        }
+        
+        function replayJournal() {
+            journalSeq = journalStart;
+            let savedEntry;
+            while ((savedEntry = localStorage.getItem(JOURNAL_PREFIX + journalSeq)) !== null) {
                 try {
-                    cards = JSON.parse(savedData);
+                    applyEntry(JSON.parse(savedEntry));
                 } catch (e) {
-                    console.error("Error loading card data:", e);
-                    resetCardData();
+                    // Drop the unreadable tail; the next append overwrites it
+                    console.error("Error replaying journal entry " + journalSeq + ":", e);
+                    break;
+                }
+                journalSeq++;
+            }
+        }
+        
+        // Write a full snapshot and drop the journal entries it now covers
+        function writeSnapshot() {
+            const data = JSON.stringify(currentSnapshot());
+            localStorage.setItem(STORAGE_KEY, data);
+            recordMetric('storage.write.localStorage', data.length, 'chars');
+            clearJournal();
+        }
+        
+        function clearJournal() {
+            for (let seq = journalStart; seq < journalSeq; seq++) {
+                localStorage.removeItem(JOURNAL_PREFIX + seq);
+            }
+            journalStart = journalSeq;
+        }
+        
+        // Append a single delta record; the snapshot is only rewritten on
+        // compaction. Throws if the entry could not be stored.
+        function appendJournal(entry) {
+            const record = JSON.stringify(entry);
+            try {
+                localStorage.setItem(JOURNAL_PREFIX + journalSeq, record);
+            } catch (e) {
+                // Most likely the quota; compacting frees the journal keys
+                console.error("Error appending to journal:", e);
+                writeSnapshot();
+                localStorage.setItem(JOURNAL_PREFIX + journalSeq, record);
+            }
+            journalSeq++;
+            recordMetric('storage.write.localStorage', record.length, 'chars');
+            
+            if (journalSeq - journalStart >= COMPACT_INTERVAL) {
+                scheduleCompaction();
+            }
+        }
+        
+        let compactionPending = false;
+        function scheduleCompaction() {
+            if (compactionPending) return;
+            compactionPending = true;
+            const idle = self.requestIdleCallback || (fn => setTimeout(fn, 0));
+            idle(() => {
+                compactionPending = false;
+                saveCardData();
+            });
+        }
+        
+        // IndexedDB: one record per card, per loan, per history row and per
+        // checkpoint, so nothing needs compacting. append() only notes the
+        // records an entry will touch; they are written after the current
+        // task, together in one transaction, and the commit does not wait
+        // for them. A failed write is reported and its records are written
+        // again with the next batch.
+        const IDB_NAME = 'monopolyTransactor';
+        const IDB_VERSION = 3;
+        const IDB_STORES = ['cards', 'loans', 'history', 'checkpoints'];
+        let database = null;
+        let dirtyCards = new Set();
+        let dirtyLoans = new Set();
+        let dirtyHistory = new Set();
+        let dirtyCheckpoints = new Set();
+        let idbFlushScheduled = false;
+        
+        const indexedDbStorage = {
+            load: loadIndexedDb,
+            append: markIndexedDb,
+            save: writeIndexedDb
+        };
+        
+        // Resolves to the IndexedDB backend, or null if it cannot be opened
+        function openIndexedDbStorage() {
+            if (!self.indexedDB) return Promise.resolve(null);
+            return new Promise(resolve => {
+                const request = indexedDB.open(IDB_NAME, IDB_VERSION);
+                request.onupgradeneeded = event => {
+                    if (event.oldVersion < 1) {
+                        request.result.createObjectStore('cards', { keyPath: 'index' });
+                        request.result.createObjectStore('loans', { keyPath: 'row' });
+                    }
+                    if (event.oldVersion < 2) {
+                        request.result.createObjectStore('history', { keyPath: 'row' });
+                    }
+                    if (event.oldVersion < 3) {
+                        request.result.createObjectStore('checkpoints', { keyPath: 'row' });
+                    }
+                };
+                request.onsuccess = () => {
+                    database = request.result;
+                    resolve(indexedDbStorage);
+                };
+                request.onerror = () => {
+                    console.error("Error opening IndexedDB:", request.error);
+                    resolve(null);
+                };
+            });
+        }
+        
+        function transactionDone(tx) {
+            return new Promise((resolve, reject) => {
+                tx.oncomplete = () => resolve();
+                tx.onerror = tx.onabort = () => reject(tx.error);
+            });
+        }
+        
+        async function loadIndexedDb() {
+            const tx = database.transaction(IDB_STORES, 'readonly');
+            const savedCards = tx.objectStore('cards').getAll();
+            const savedLoans = tx.objectStore('loans').getAll();
+            const savedHistory = tx.objectStore('history').getAll();
+            const savedCheckpoints = tx.objectStore('checkpoints').getAll();
+            await transactionDone(tx);
+            if (savedCards.result.length === 0) {
+                return migrateLocalStorage();
+            }
+            
+            // Both stores return records in key order, which is index order
+            clearLedger();
+            savedCards.result.forEach(record => {
+                const index = registerCard(record.id, record.label);
+                balances[index] = record.balance;
+                transactionCounts[index] = record.transactions;
+                cardVersions[index] = record.version;
+            });
+            savedLoans.result.forEach(record => {
+                addLoan(record.card, record.amount, record.timestamp, record.paid ? record.repaidTimestamp : null,
+                        record.rate === undefined ? LOAN_RATE : record.rate,
+                        record.installments === undefined ? 1 : record.installments,
+                        record.paidInstallments === undefined ? 0 : record.paidInstallments);
+            });
+            savedHistory.result.forEach(record => {
+                addHistory(record.type, record.card, record.counterparty, record.amount, record.timestamp);
+            });
+            checkpoints = savedCheckpoints.result;
+            if (checkpoints.length === 0 && history.type.length === 0) addCheckpoint();
+            return true;
+        }
+        
+        // One-time move of an existing localStorage save into IndexedDB;
+        // the localStorage keys are removed once the copy is stored
+        async function migrateLocalStorage() {
+            // The page migrates before it hands the engine to a worker
+            if (typeof localStorage === 'undefined' || !loadLocalStorage()) return false;
+            await writeIndexedDb();
+            clearJournal();
+            localStorage.removeItem(STORAGE_KEY);
+            return true;
+        }
+        
+        function cardRecord(index) {
+            return {
+                index: index,
+                id: cardIds[index],
+                label: cardLabels[index],
+                balance: balances[index],
+                transactions: transactionCounts[index],
+                version: cardVersions[index]
+            };
+        }
+        
+        function loanRecord(row) {
+            return {
+                row: row,
+                card: loans.card[row],
+                amount: loans.amount[row],
+                paid: loans.paid[row],
+                timestamp: loans.timestamp[row],
+                repaidTimestamp: loans.repaidTimestamp[row],
+                rate: loans.rate[row],
+                installments: loans.installments[row],
+                paidInstallments: loans.paidInstallments[row]
+            };
+        }
+        
+        function writeIndexedDb() {
+            const tx = database.transaction(IDB_STORES, 'readwrite');
+            const cardStore = tx.objectStore('cards');
+            const loanStore = tx.objectStore('loans');
+            const historyStore = tx.objectStore('history');
+            const checkpointStore = tx.objectStore('checkpoints');
+            cardStore.clear();
+            loanStore.clear();
+            historyStore.clear();
+            checkpointStore.clear();
+            for (let index = 0; index < cardCount; index++) {
+                cardStore.put(cardRecord(index));
+            }
+            for (let row = 0; row < loans.card.length; row++) {
+                loanStore.put(loanRecord(row));
+            }
+            for (let row = 0; row < history.type.length; row++) {
+                historyStore.put(historyRecord(row));
+            }
+            checkpoints.forEach(checkpoint => checkpointStore.put(checkpoint));
+            recordMetric('storage.write.indexedDb', cardCount + loans.card.length + history.type.length + checkpoints.length, 'records');
+            dirtyCards.clear();
+            dirtyLoans.clear();
+            dirtyHistory.clear();
+            dirtyCheckpoints.clear();
+            return transactionDone(tx);
+        }
+        
+        // Called before the entry is applied, so new rows are still to come
+        function markIndexedDb(entry) {
+            const { debit, credit } = entryCards(entry);
+            if (entry.type === 'register' && !cardIndex.has(entry.id)) dirtyCards.add(cardCount);
+            if (debit !== null) dirtyCards.add(debit);
+            if (credit !== null) dirtyCards.add(credit);
+            if (entry.type === 'loan') dirtyLoans.add(loans.card.length);
+            if (entry.type === 'repay') openLoans[debit].forEach(row => dirtyLoans.add(row));
+            if (entry.type === 'installment') dirtyLoans.add(entry.loan);
+            if (entry.type === 'batch') {
+                batchTransfers(entry).forEach(transfer => {
+                    if (transfer.debit !== null) dirtyCards.add(transfer.debit);
+                    if (transfer.credit !== null) dirtyCards.add(transfer.credit);
+                });
+            }
+            const rows = historyRows(entry);
+            let checkpoint = checkpoints.length;
+            for (let row = history.type.length; row < history.type.length + rows; row++) {
+                dirtyHistory.add(row);
+                if ((row + 1) % CHECKPOINT_INTERVAL === 0) dirtyCheckpoints.add(checkpoint++);
+            }
+            
+            if (!idbFlushScheduled) {
+                idbFlushScheduled = true;
+                queueMicrotask(flushIndexedDb);
+            }
+        }
+        
+        function flushIndexedDb() {
+            idbFlushScheduled = false;
+            const cardBatch = dirtyCards;
+            const loanBatch = dirtyLoans;
+            const historyBatch = dirtyHistory;
+            const checkpointBatch = dirtyCheckpoints;
+            dirtyCards = new Set();
+            dirtyLoans = new Set();
+            dirtyHistory = new Set();
+            dirtyCheckpoints = new Set();
+            
+            const tx = database.transaction(IDB_STORES, 'readwrite');
+            const cardStore = tx.objectStore('cards');
+            const loanStore = tx.objectStore('loans');
+            const historyStore = tx.objectStore('history');
+            const checkpointStore = tx.objectStore('checkpoints');
+            cardBatch.forEach(index => cardStore.put(cardRecord(index)));
+            loanBatch.forEach(row => loanStore.put(loanRecord(row)));
+            historyBatch.forEach(row => historyStore.put(historyRecord(row)));
+            checkpointBatch.forEach(index => checkpointStore.put(checkpoints[index]));
+            recordMetric('storage.write.indexedDb', cardBatch.size + loanBatch.size + historyBatch.size + checkpointBatch.size, 'records');
+            const start = performance.now();
+            transactionDone(tx).then(() => measureSince('storage.flush', start), e => {
+                console.error("Error writing to IndexedDB:", e);
+                notify("Error saving data", "error");
+                cardBatch.forEach(index => dirtyCards.add(index));
+                loanBatch.forEach(row => dirtyLoans.add(row));
+                historyBatch.forEach(row => dirtyHistory.add(row));
+                checkpointBatch.forEach(index => dirtyCheckpoints.add(index));
+            });
+        }
+        
+        // Binary Archive
+        // A compact form of the snapshot for export and for archiving many
+        // games in one file (archive.py reads and writes the same format).
+        // After a 4-byte magic come unsigned LEB128 varints: card fields,
+        // then the loan, history and checkpoint tables column by column, with
+        // timestamps stored as differences from the previous one. Signed
+        // values are zigzag encoded; nullable ones are stored plus one, with
+        // zero for null. Archives can be concatenated. Version 2 added the
+        // loan terms columns; version 1 archives hold default-term loans.
+        const ARCHIVE_MAGIC = [0x4d, 0x54, 0x58, 0x4c]; // "MTXL"
+        const ARCHIVE_VERSION = 2;
+        const HISTORY_TYPES = ['transfer', 'bid', 'loan', 'repay', 'payout', 'charge', 'installment', 'interest'];
+        
+        function byteWriter() {
+            let buffer = new Uint8Array(4096);
+            let length = 0;
+            const writer = {
+                byte(value) {
+                    if (length === buffer.length) {
+                        const grown = new Uint8Array(buffer.length * 2);
+                        grown.set(buffer);
+                        buffer = grown;
+                    }
+                    buffer[length++] = value;
+                },
+                // Arithmetic rather than bit operations: timestamps exceed 32 bits
+                varint(value) {
+                    if (!Number.isSafeInteger(value) || value < 0) {
+                        throw new RangeError("Cannot encode " + value);
+                    }
+                    while (value >= 0x80) {
+                        writer.byte(value % 0x80 + 0x80);
+                        value = Math.floor(value / 0x80);
+                    }
+                    writer.byte(value);
+                },
+                signed(value) {
+                    writer.varint(value >= 0 ? value * 2 : -value * 2 - 1);
+                },
+                // Zero for null, otherwise the difference from `previous` plus one
+                stamp(value, previous) {
+                    if (value === null) {
+                        writer.varint(0);
+                    } else {
+                        const delta = value - (previous === null ? 0 : previous);
+                        writer.varint((delta >= 0 ? delta * 2 : -delta * 2 - 1) + 1);
+                    }
+                },
+                string(text) {
+                    const bytes = new TextEncoder().encode(text);
+                    writer.varint(bytes.length);
+                    bytes.forEach(writer.byte);
+                },
+                // Hand over what has been written so far
+                take() {
+                    const chunk = buffer.slice(0, length);
+                    length = 0;
+                    return chunk;
+                }
+            };
+            return writer;
+        }
+        
+        function byteReader(bytes) {
+            let position = 0;
+            const reader = {
+                done: () => position >= bytes.length,
+                byte() {
+                    if (position >= bytes.length) throw new RangeError("Archive is truncated");
+                    return bytes[position++];
+                },
+                varint() {
+                    let value = 0;
+                    let scale = 1;
+                    let current;
+                    do {
+                        current = reader.byte();
+                        value += (current & 0x7f) * scale;
+                        scale *= 0x80;
+                    } while (current & 0x80);
+                    return value;
+                },
+                signed() {
+                    const value = reader.varint();
+                    return value % 2 === 0 ? value / 2 : -(value + 1) / 2;
+                },
+                stamp(previous) {
+                    const value = reader.varint();
+                    if (value === 0) return null;
+                    const delta = value - 1;
+                    return (previous === null ? 0 : previous) + (delta % 2 === 0 ? delta / 2 : -(delta + 1) / 2);
+                },
+                string() {
+                    const length = reader.varint();
+                    if (position + length > bytes.length) throw new RangeError("Archive is truncated");
+                    position += length;
+                    return new TextDecoder().decode(bytes.subarray(position - length, position));
+                }
+            };
+            return reader;
+        }
+        
+        function currentSnapshot() {
+            return {
+                version: SNAPSHOT_VERSION,
+                seq: journalSeq,
+                ids: cardIds,
+                labels: cardLabels,
+                balances: Array.from(balances.subarray(0, cardCount)),
+                transactions: Array.from(transactionCounts.subarray(0, cardCount)),
+                versions: Array.from(cardVersions.subarray(0, cardCount)),
+                loans: loans,
+                history: history,
+                checkpoints: checkpoints
+            };
+        }
+        
+        // Yields the archive of a snapshot one section at a time
+        function* encodeArchive(snapshot) {
+            const out = byteWriter();
+            ARCHIVE_MAGIC.forEach(out.byte);
+            out.varint(ARCHIVE_VERSION);
+            out.varint(snapshot.seq);
+            
+            out.varint(snapshot.ids.length);
+            snapshot.ids.forEach((id, card) => {
+                out.string(id);
+                out.string(snapshot.labels[card]);
+            });
+            snapshot.balances.forEach(out.signed);
+            snapshot.transactions.forEach(out.varint);
+            snapshot.ids.forEach((_, card) => out.varint(snapshot.versions ? snapshot.versions[card] : 0));
+            yield out.take();
+            
+            const saved = snapshot.loans;
+            out.varint(saved.card.length);
+            saved.card.forEach(out.varint);
+            saved.amount.forEach(out.varint);
+            saved.timestamp.forEach((timestamp, row) => out.stamp(timestamp, row > 0 ? saved.timestamp[row - 1] : null));
+            // A settled loan's repayment time is relative to when it was taken
+            saved.paid.forEach((paid, row) => out.stamp(paid ? saved.repaidTimestamp[row] : null, saved.timestamp[row]));
+            saved.card.forEach((_, row) => out.varint(saved.rate ? saved.rate[row] : LOAN_RATE));
+            saved.card.forEach((_, row) => out.varint(saved.installments ? saved.installments[row] : 1));
+            saved.card.forEach((_, row) => out.varint(saved.paidInstallments ? saved.paidInstallments[row] : 0));
+            yield out.take();
+            
+            const rows = snapshot.history || createHistoryTable();
+            out.varint(rows.type.length);
+            rows.type.forEach(type => {
+                if (!HISTORY_TYPES.includes(type)) {
+                    throw new RangeError("Cannot encode history type " + type);
                 }
+                out.varint(HISTORY_TYPES.indexOf(type));
+            });
+            rows.card.forEach(out.varint);
+            rows.counterparty.forEach(card => out.varint(card === null ? 0 : card + 1));
+            rows.amount.forEach(out.varint);
+            let previous = null;
+            rows.timestamp.forEach(timestamp => {
+                out.stamp(timestamp, previous);
+                if (timestamp !== null) previous = timestamp;
+            });
+            yield out.take();
+            
+            const saves = snapshot.checkpoints || [];
+            out.varint(saves.length);
+            previous = null;
+            saves.forEach(checkpoint => {
+                out.varint(checkpoint.row);
+                out.stamp(checkpoint.time, previous);
+                if (checkpoint.time !== null) previous = checkpoint.time;
+                out.varint(checkpoint.balances.length);
+                checkpoint.balances.forEach(out.signed);
+                checkpoint.transactions.forEach(out.varint);
+                checkpoint.principal.forEach(out.varint);
+            });
+            yield out.take();
+        }
+        
+        // Yields every snapshot in an archive of one or more games
+        function* decodeArchive(bytes) {
+            const reader = byteReader(bytes);
+            while (!reader.done()) {
+                yield decodeSnapshot(reader);
+            }
+        }
+        
+        function decodeSnapshot(reader) {
+            if (ARCHIVE_MAGIC.some(byte => reader.byte() !== byte)) {
+                throw new Error("Not a ledger archive");
+            }
+            const format = reader.varint();
+            if (format !== 1 && format !== ARCHIVE_VERSION) {
+                throw new Error("Unsupported archive version: " + format);
+            }
+            const repeat = (count, read) => Array.from({ length: count }, read);
+            const snapshot = { version: SNAPSHOT_VERSION, seq: reader.varint() };
+            
+            const cards = reader.varint();
+            snapshot.ids = [];
+            snapshot.labels = [];
+            for (let card = 0; card < cards; card++) {
+                snapshot.ids.push(reader.string());
+                snapshot.labels.push(reader.string());
+            }
+            snapshot.balances = repeat(cards, reader.signed);
+            snapshot.transactions = repeat(cards, reader.varint);
+            snapshot.versions = repeat(cards, reader.varint);
+            
+            const loanCount = reader.varint();
+            const saved = createLoanTable();
+            saved.card = repeat(loanCount, reader.varint);
+            saved.amount = repeat(loanCount, reader.varint);
+            let previous = null;
+            for (let row = 0; row < loanCount; row++) {
+                previous = reader.stamp(previous);
+                saved.timestamp.push(previous);
+            }
+            for (let row = 0; row < loanCount; row++) {
+                const repaid = reader.stamp(saved.timestamp[row]);
+                saved.paid.push(repaid !== null);
+                saved.repaidTimestamp.push(repaid);
+            }
+            if (format >= 2) {
+                saved.rate = repeat(loanCount, reader.varint);
+                saved.installments = repeat(loanCount, reader.varint);
+                saved.paidInstallments = repeat(loanCount, reader.varint);
             } else {
-                resetCardData();
+                saved.rate = repeat(loanCount, () => LOAN_RATE);
+                saved.installments = repeat(loanCount, () => 1);
+                saved.paidInstallments = repeat(loanCount, () => 0);
+            }
+            snapshot.loans = saved;
+            
+            const rowCount = reader.varint();
+            const rows = createHistoryTable();
+            rows.type = repeat(rowCount, () => {
+                const type = HISTORY_TYPES[reader.varint()];
+                if (type === undefined) throw new RangeError("Unknown history type in archive");
+                return type;
+            });
+            rows.card = repeat(rowCount, reader.varint);
+            rows.counterparty = repeat(rowCount, () => reader.varint() - 1).map(card => card < 0 ? null : card);
+            rows.amount = repeat(rowCount, reader.varint);
+            previous = null;
+            for (let row = 0; row < rowCount; row++) {
+                const timestamp = reader.stamp(previous);
+                rows.timestamp.push(timestamp);
+                if (timestamp !== null) previous = timestamp;
+            }
+            snapshot.history = rows;
+            
+            const saveCount = reader.varint();
+            snapshot.checkpoints = [];
+            previous = null;
+            for (let index = 0; index < saveCount; index++) {
+                const row = reader.varint();
+                const time = reader.stamp(previous);
+                if (time !== null) previous = time;
+                const count = reader.varint();
+                snapshot.checkpoints.push({
+                    row: row,
+                    time: time,
+                    balances: repeat(count, reader.signed),
+                    transactions: repeat(count, reader.varint),
+                    principal: repeat(count, reader.varint)
+                });
+            }
+            return snapshot;
+        }
+        
+        // Cards an entry debits and credits, resolved to indices. Throws on an
+        // unknown card so that nothing is applied by halves.
+        function entryCards(entry) {
+            let debit = null;
+            let credit = null;
+            switch (entry.type) {
+                case 'register':
+                case 'batch':
+                    // A batch's cards are in its transfers; see batchTransfers
+                    return { debit, credit };
+                case 'transfer':
+                    debit = resolveCard(entry.from);
+                    credit = resolveCard(entry.to);
+                    break;
+                case 'bid':
+                case 'repay':
+                case 'installment':
+                    debit = resolveCard(entry.card);
+                    break;
+                case 'loan':
+                    credit = resolveCard(entry.card);
+                    break;
+                default:
+                    throw new Error("Unknown journal entry type: " + entry.type);
+            }
+            if (debit === undefined || credit === undefined) {
+                throw new Error("Unknown card in journal entry");
+            }
+            return { debit, credit };
+        }
+        
+        // A batch's transfers with their cards resolved, where null is the
+        // bank. Throws on an unknown card, like entryCards.
+        function batchTransfers(entry) {
+            if (!Array.isArray(entry.transfers) || entry.transfers.length === 0) {
+                throw new Error("Empty batch");
+            }
+            const resolve = ref => {
+                if (ref === null) return null;
+                const card = resolveCard(ref);
+                if (card === undefined) {
+                    throw new Error("Unknown card in journal entry");
+                }
+                return card;
+            };
+            return entry.transfers.map(transfer => ({
+                debit: resolve(transfer.from),
+                credit: resolve(transfer.to),
+                amount: transfer.amount
+            }));
+        }
+        
+        // Everything an entry writes to, resolved: the cards it debits and
+        // credits, and a batch's transfers. Throws on an unknown card.
+        function entryTargets(entry) {
+            const targets = entryCards(entry);
+            if (entry.type === 'batch') targets.transfers = batchTransfers(entry);
+            return targets;
+        }
+        
+        // Validate an entry against the current state without changing it,
+        // returning its targets for applyEntry. Only the debited card is
+        // version-checked: credits commute, so a card that many terminals pay
+        // into never causes a conflict.
+        function checkEntry(entry) {
+            const targets = entryTargets(entry);
+            const { debit, credit } = targets;
+            // Fields of the wrong type are refused up front, like the server does
+            if (entry.timestamp !== undefined && entry.timestamp !== null && !Number.isSafeInteger(entry.timestamp)) {
+                throw new Error("Invalid timestamp");
+            }
+            if (entry.label !== undefined && entry.label !== null && typeof entry.label !== 'string') {
+                throw new Error("Invalid card label");
+            }
+            if (entry.type === 'register') {
+                if (typeof entry.id !== 'string' || entry.id === '') {
+                    throw new Error("Invalid card id");
+                }
+                return targets;
+            }
+            if (entry.type === 'batch') {
+                checkBatch(targets.transfers);
+                return targets;
+            }
+            
+            if (!Number.isSafeInteger(entry.amount) || entry.amount <= 0) {
+                throw new Error("Invalid amount");
+            }
+            if (credit !== null && (balances[credit] + entry.amount > MAX_MONEY ||
+                                    entry.type === 'loan' && unpaidPrincipal[credit] + entry.amount > MAX_MONEY)) {
+                throw new Error("Balance too large");
+            }
+            if (entry.type === 'loan') {
+                checkLoanTerms(entry);
+            }
+            if (debit === null) return targets;
+            
+            if (entry.version !== undefined && entry.version !== cardVersions[debit]) {
+                const error = new Error("Card was changed on another terminal");
+                error.conflict = true;
+                throw error;
+            }
+            if (entry.type === 'transfer' && debit === resolveCard(entry.to)) {
+                throw new Error("Cannot transfer to the same card");
+            }
+            if (entry.type === 'repay') {
+                if (transactionCounts[debit] === 0) {
+                    throw new Error("No loans to repay");
+                }
+                if (openLoans[debit].length === 0) {
+                    throw new Error("No unpaid loans found");
+                }
+                if (entry.amount !== calculateRepayment(debit).totalRepayment) {
+                    throw new Error("Repayment amount does not match the ledger");
+                }
+            }
+            if (entry.type === 'installment') {
+                checkInstallment(entry, debit);
+            }
+            if (entry.amount > balances[debit]) {
+                throw new Error("Insufficient funds");
+            }
+            return targets;
+        }
+        
+        // A batch is checked as a whole, each transfer against the balances
+        // the ones before it leave, so it applies in full or not at all. It
+        // carries no version: it stands or falls on the state it meets.
+        function checkBatch(transfers) {
+            const projected = new Map();
+            const balanceOf = card => projected.has(card) ? projected.get(card) : balances[card];
+            transfers.forEach(({ debit, credit, amount }) => {
+                if (!Number.isSafeInteger(amount) || amount <= 0) {
+                    throw new Error("Invalid amount");
+                }
+                if (debit === credit) {
+                    throw new Error("Cannot transfer to the same card");
+                }
+                if (debit !== null) {
+                    if (amount > balanceOf(debit)) {
+                        throw new Error("Insufficient funds");
+                    }
+                    projected.set(debit, balanceOf(debit) - amount);
+                }
+                if (credit !== null) {
+                    if (balanceOf(credit) + amount > MAX_MONEY) {
+                        throw new Error("Balance too large");
+                    }
+                    projected.set(credit, balanceOf(credit) + amount);
+                }
+            });
+        }
+        
+        // Apply a journal entry to the ledger. Used for live operations, for
+        // entries pushed by the server, and when replaying the journal on load.
+        // Its targets are resolved before anything is written, so an entry
+        // that cannot apply leaves the ledger as it was.
+        function applyEntry(entry, targets = entryTargets(entry)) {
+            const { debit, credit } = targets;
+            switch (entry.type) {
+                case 'register':
+                    registerCard(entry.id, entry.label);
+                    return;
+                case 'batch':
+                    applyBatch(entry, targets.transfers);
+                    return;
+                case 'transfer':
+                    balances[debit] -= entry.amount;
+                    balances[credit] += entry.amount;
+                    break;
+                case 'bid':
+                    balances[debit] -= entry.amount;
+                    transactionCounts[debit] += 1;
+                    break;
+                case 'loan':
+                    balances[credit] += entry.amount;
+                    addLoan(credit, entry.amount, entry.timestamp, null,
+                            entry.rate === undefined ? LOAN_RATE : entry.rate,
+                            entry.installments === undefined ? 1 : entry.installments);
+                    break;
+                case 'installment':
+                    applyInstallment(entry, debit);
+                    return;
+                case 'repay':
+                    balances[debit] -= entry.amount;
+                    settleLoans(debit, entry.timestamp);
+                    transactionCounts[debit] = 0;
+                    break;
+            }
+            recordMovement(entry.type, debit, credit, entry.amount, entry.timestamp === undefined ? null : entry.timestamp);
+        }
+        
+        // Every transfer of a batch in one pass, each its own history row:
+        // 'payout' when the bank pays a card, 'charge' when a card pays it
+        function applyBatch(entry, transfers) {
+            const timestamp = entry.timestamp === undefined ? null : entry.timestamp;
+            transfers.forEach(({ debit, credit, amount }) => {
+                let type = 'transfer';
+                if (debit === null) {
+                    type = 'payout';
+                } else if (credit === null) {
+                    type = 'charge';
+                }
+                if (debit !== null) balances[debit] -= amount;
+                if (credit !== null) balances[credit] += amount;
+                recordMovement(type, debit, credit, amount, timestamp);
+            });
+        }
+        
+        function recordMovement(type, debit, credit, amount, timestamp) {
+            if (debit !== null) cardVersions[debit]++;
+            if (credit !== null) cardVersions[credit]++;
+            // A transfer is filed under its sender, with the receiver as counterparty
+            fileHistory(type, debit !== null ? debit : credit, debit !== null ? credit : null, amount, timestamp);
+        }
+        
+        function fileHistory(type, card, counterparty, amount, timestamp) {
+            addHistory(type, card, counterparty, amount, timestamp);
+            if (history.type.length % CHECKPOINT_INTERVAL === 0) addCheckpoint();
+        }
+        
+        // How many history rows applying an entry adds
+        function historyRows(entry) {
+            switch (entry.type) {
+                case 'register':
+                    return 0;
+                case 'batch':
+                    return entry.transfers.length;
+                case 'installment':
+                    return entry.interest > 0 ? 2 : 1;
+                default:
+                    return 1;
+            }
+        }
+        
+        // Loans of a card with interest: each loan's rate (5% on default
+        // terms) + 1% per transaction after the first, on its outstanding
+        // principal. Loans at the same rate are charged together, so a card
+        // whose loans are all on default terms pays a single rounding.
+        function calculateRepayment(card) {
+            const byRate = new Map();
+            openLoans[card].forEach(row => {
+                const rate = loans.rate[row];
+                byRate.set(rate, (byRate.get(rate) || 0) + outstandingPrincipal(row));
+            });
+            let interestAmount = 0;
+            byRate.forEach((principal, rate) => {
+                interestAmount += percentOf(principal, interestPercent(card, rate));
+            });
+            const loanTotal = unpaidPrincipal[card];
+            return { loanTotal, interestAmount, totalRepayment: loanTotal + interestAmount };
+        }
+        
+        function interestPercent(card, rate) {
+            return rate + Math.max(0, transactionCounts[card] - 1);
+        }
+        
+        // `percent`% of a whole-dollar amount, rounded half up, computed in
+        // integers (BigInt once the product is past MAX_MONEY) so no
+        // fractional rate is ever rounded
+        function percentOf(amount, percent) {
+            const product = amount * percent;
+            if (product > MAX_MONEY) {
+                return Number((BigInt(amount) * BigInt(percent) + 50n) / 100n);
+            }
+            const remainder = product % 100;
+            return (product - remainder) / 100 + (remainder >= 50 ? 1 : 0);
+        }
+        
+        // Loan Book
+        // A loan's terms are its rate, the base interest percent, and the
+        // number of installments it is repaid in. Installments repay equal
+        // parts of the principal, the last one whatever division leaves,
+        // each with interest at the loan's current percent on the principal
+        // still outstanding before it.
+        // Interest is never stored or accrued as time passes: it follows from
+        // the card's transaction counter whenever it is read, so open loans
+        // cost nothing to keep however many there are. A 'repay' entry still
+        // settles every open loan of a card; an 'installment' entry pays the
+        // next installment of one loan and is filed as an 'installment' row
+        // for the principal and an 'interest' row for the rest.
+        function checkLoanTerms(entry) {
+            const rate = entry.rate === undefined ? LOAN_RATE : entry.rate;
+            const installments = entry.installments === undefined ? 1 : entry.installments;
+            if (!Number.isInteger(rate) || rate < 0 || rate > MAX_LOAN_RATE) {
+                throw new Error("Invalid loan rate");
+            }
+            if (!Number.isInteger(installments) || installments < 1 ||
+                installments > Math.min(MAX_INSTALLMENTS, entry.amount)) {
+                throw new Error("Invalid number of installments");
+            }
+        }
+        
+        // Principal of an open loan not yet repaid by installments
+        function outstandingPrincipal(row) {
+            const part = Math.floor(loans.amount[row] / loans.installments[row]);
+            return loans.amount[row] - part * loans.paidInstallments[row];
+        }
+        
+        // Principal repaid by installment `number`, counting from 0
+        function installmentPrincipal(row, number) {
+            const part = Math.floor(loans.amount[row] / loans.installments[row]);
+            return number === loans.installments[row] - 1 ? loans.amount[row] - part * number : part;
+        }
+        
+        function nextInstallment(row) {
+            const principal = installmentPrincipal(row, loans.paidInstallments[row]);
+            const interest = percentOf(outstandingPrincipal(row), interestPercent(loans.card[row], loans.rate[row]));
+            return { principal: principal, interest: interest, amount: principal + interest };
+        }
+        
+        function checkInstallment(entry, debit) {
+            const row = entry.loan;
+            if (!Number.isInteger(row) || row < 0 || row >= loans.card.length ||
+                loans.card[row] !== debit || loans.paid[row]) {
+                throw new Error("No unpaid loans found");
+            }
+            const due = nextInstallment(row);
+            if (entry.principal !== due.principal || entry.interest !== due.interest || entry.amount !== due.amount) {
+                throw new Error("Installment does not match the ledger");
+            }
+        }
+        
+        // The principal comes off before its row is filed and the interest
+        // before its own, so a checkpoint between the two rows is exact
+        function applyInstallment(entry, debit) {
+            const row = entry.loan;
+            const timestamp = entry.timestamp === undefined ? null : entry.timestamp;
+            unpaidPrincipal[debit] -= entry.principal;
+            loans.paidInstallments[row]++;
+            if (loans.paidInstallments[row] === loans.installments[row]) {
+                loans.paid[row] = true;
+                loans.repaidTimestamp[row] = timestamp;
+                openLoans[debit] = openLoans[debit].filter(open => open !== row);
+                settledLoans[debit].push(row);
+            }
+            cardVersions[debit]++;
+            balances[debit] -= entry.principal;
+            fileHistory('installment', debit, null, entry.principal, timestamp);
+            if (entry.interest > 0) {
+                balances[debit] -= entry.interest;
+                fileHistory('interest', debit, null, entry.interest, timestamp);
+            }
+        }
+        
+        // A loan and what is owed on it as of now. `interest` is what
+        // repaying the loan on its own would add to its outstanding principal.
+        function loanSummary(row) {
+            const open = !loans.paid[row];
+            const outstanding = open ? outstandingPrincipal(row) : 0;
+            return {
+                loan: row,
+                card: loans.card[row],
+                amount: loans.amount[row],
+                rate: loans.rate[row],
+                installments: loans.installments[row],
+                paidInstallments: loans.paidInstallments[row],
+                timestamp: loans.timestamp[row],
+                repaidTimestamp: loans.repaidTimestamp[row],
+                outstanding: outstanding,
+                interest: open ? percentOf(outstanding, interestPercent(loans.card[row], loans.rate[row])) : 0,
+                next: open ? nextInstallment(row) : null
+            };
+        }
+        
+        // The installments still due on a loan, at today's percent
+        function loanSchedule(row) {
+            const schedule = [];
+            if (loans.paid[row]) return schedule;
+            const percent = interestPercent(loans.card[row], loans.rate[row]);
+            let outstanding = outstandingPrincipal(row);
+            for (let number = loans.paidInstallments[row]; number < loans.installments[row]; number++) {
+                const principal = installmentPrincipal(row, number);
+                const interest = percentOf(outstanding, percent);
+                schedule.push({ number: number + 1, principal: principal, interest: interest, amount: principal + interest });
+                outstanding -= principal;
+            }
+            return schedule;
+        }
+        
+        // Ledger Server
+        // Opened as /?table=<name> from server.py, the page shares that table's
+        // ledger with the other terminals: entries are applied locally at once,
+        // batched to the server over a WebSocket, and entries from other
+        // terminals are pushed back. A rejected entry triggers a resync; one
+        // rejected only because its card's version moved on is checked again
+        // against the fresh state and resent. The server can also ask for
+        // this terminal's metrics, which go back with the page's.
+        // A worker running the engine is told the page's address in self.pageHref
+        const pageLocation = new URL(self.pageHref || location.href);
+        const serverTable = pageLocation.searchParams.get('table');
+        const RECONNECT_MAX_DELAY = 5000;
+        const MAX_CONFLICT_RETRIES = 3;
+        let serverSocket = null;
+        let syncPending = true;
+        let outbox = [];
+        let outboxScheduled = false;
+        let inflight = new Map();
+        let retryQueue = [];
+        let conflictRetries = new WeakMap();
+        let nextBatchId = 1;
+        let pendingAuctions = new Map();
+        let nextAuctionId = 1;
+        let reconnectDelay = 250;
+        
+        // The server holds the ledger, so there is nothing to save locally
+        const serverStorage = {
+            load() {
+                connectLedgerServer();
+                return true;
+            },
+            append: sendToServer,
+            save() {}
+        };
+        
+        function connectLedgerServer() {
+            const protocol = pageLocation.protocol === 'https:' ? 'wss:' : 'ws:';
+            const socket = new WebSocket(`${protocol}//${pageLocation.host}/ws?table=${encodeURIComponent(serverTable)}`);
+            
+            socket.addEventListener('open', () => {
+                serverSocket = socket;
+                reconnectDelay = 250;
+            });
+            socket.addEventListener('message', event => handleServerMessage(JSON.parse(event.data)));
+            socket.addEventListener('close', () => {
+                if (serverSocket === socket) {
+                    serverSocket = null;
+                    notify('Ledger server disconnected', 'error');
+                }
+                // The next state message settles whatever was in flight
+                syncPending = true;
+                inflight.clear();
+                pendingAuctions.forEach(resolve => resolve({ ok: false, reason: 'offline' }));
+                pendingAuctions.clear();
+                setTimeout(connectLedgerServer, reconnectDelay);
+                reconnectDelay = Math.min(reconnectDelay * 2, RECONNECT_MAX_DELAY);
+            });
+        }
+        
+        function handleServerMessage(message) {
+            switch (message.type) {
+                case 'state':
+                    restoreServerState(message.snapshot);
+                    break;
+                case 'entries':
+                    message.entries.forEach(entry => applyEntry(entry));
+                    publishCards(changedCards(message.entries));
+                    break;
+                case 'ack': {
+                    const ops = inflight.get(message.id) || [];
+                    inflight.delete(message.id);
+                    if (message.rejected.length === 0) break;
+                    
+                    message.rejected.forEach(rejection => {
+                        const entry = ops[rejection.index];
+                        if (rejection.conflict && entry) {
+                            conflictRetries.set(entry, (conflictRetries.get(entry) || 0) + 1);
+                            retryQueue.push(entry);
+                        } else {
+                            console.error("Server rejected entry:", rejection);
+                            notify(rejection.error, 'error');
+                        }
+                    });
+                    syncPending = true;
+                    sendUpstream({ type: 'sync' });
+                    break;
+                }
+                case 'auction': {
+                    const resolve = pendingAuctions.get(message.id);
+                    pendingAuctions.delete(message.id);
+                    if (resolve) resolve(message.result);
+                    break;
+                }
+                case 'lots':
+                    emit({ type: 'auction', lots: message.lots });
+                    break;
+                case 'metrics':
+                    emit({ type: 'metrics' });
+                    break;
+            }
+        }
+        
+        // Server state plus this terminal's conflicted and unsent entries,
+        // each rechecked against the new state before it is applied again
+        function restoreServerState(snapshot) {
+            clearLedger();
+            loadSnapshot(snapshot);
+            
+            const pending = retryQueue.concat(outbox);
+            retryQueue = [];
+            outbox = [];
+            pending.forEach(entry => {
+                const { debit } = entryCards(entry);
+                try {
+                    if ((conflictRetries.get(entry) || 0) > MAX_CONFLICT_RETRIES) {
+                        throw new Error("Card is busy on another terminal");
+                    }
+                    if (debit !== null) entry.version = cardVersions[debit];
+                    applyEntry(entry, checkEntry(entry));
+                    outbox.push(entry);
+                } catch (e) {
+                    console.error("Dropping entry after resync:", e);
+                    notify(e.message, 'error');
+                }
+            });
+            
+            syncPending = false;
+            flushOutbox();
+            publishCards(allCards());
+        }
+        
+        function sendToServer(entry) {
+            outbox.push(entry);
+            if (!outboxScheduled) {
+                outboxScheduled = true;
+                queueMicrotask(flushOutbox);
+            }
+        }
+        
+        // Everything committed in one task goes out as a single message
+        // and nothing is sent while waiting for a resync
+        function flushOutbox() {
+            outboxScheduled = false;
+            if (syncPending || outbox.length === 0) return;
+            const id = nextBatchId;
+            if (!sendUpstream({ type: 'ops', id: id, ops: outbox })) return;
+            nextBatchId++;
+            inflight.set(id, outbox);
+            outbox = [];
+        }
+        
+        // Run an auction intent on the table's lots; resolves with the
+        // server's result. Entries committed before it go out first, so the
+        // server checks bids against them.
+        function serverAuction(intent) {
+            const request = Object.assign({}, intent);
+            delete request.op;
+            delete request.timestamp;
+            flushOutbox();
+            const id = nextAuctionId++;
+            if (!sendUpstream({ type: 'auction', id: id, auction: request })) {
+                return { ok: false, reason: 'offline' };
+            }
+            return new Promise(resolve => pendingAuctions.set(id, resolve));
+        }
+        
+        // Send to the ledger server, or to the leading tab when following
+        // one. Returns false while there is no one to send to.
+        function sendUpstream(message) {
+            if (!serverTable) {
+                if (!syncChannel || leading) return false;
+                postToTabs(message);
+                return true;
+            }
+            if (!serverSocket) return false;
+            const text = JSON.stringify(message);
+            serverSocket.send(text);
+            recordMetric('storage.write.server', text.length, 'chars');
+            return true;
+        }
+        
+        // Tab Sync
+        // Pages opened without a table share this device's IndexedDB or
+        // localStorage, and each used to keep its own copy of the ledger and
+        // overwrite the others' saves. Now the tab holding the SYNC_LOCK Web
+        // Lock leads: only it persists, and the other tabs follow it over a
+        // BroadcastChannel with the ledger server's messages. Followers send
+        // their entries as ops and the leader checks each against the debited
+        // card's version, so of two tabs spending from the same card the one
+        // whose ops reach the leader first wins and the other resyncs and
+        // retries, exactly as between terminals at a table. Accepted entries
+        // are passed on to every other tab as they are. When the leading tab
+        // closes, the lock passes to a follower, which carries on from its
+        // own copy. Without BroadcastChannel or Web Locks each tab keeps its
+        // own ledger as before.
+        const SYNC_CHANNEL = 'monopolyTransactor';
+        const SYNC_LOCK = 'monopolyTransactor.leader';
+        const tabId = Math.random().toString(36).slice(2);
+        let syncChannel = null;
+        let tabBackend = null;
+        let leading = false;
+        let tabOutgoing = [];
+        let tabShareScheduled = false;
+        
+        // The leader persists through the backend it was given and passes
+        // on each entry once it is stored
+        const leaderStorage = {
+            load: () => tabBackend.load(),
+            append: entry => shareEntry(entry, tabId),
+            save: () => tabBackend.save()
+        };
+        
+        // The leading tab holds the ledger, so there is nothing to save locally
+        const followerStorage = {
+            load() {
+                syncPending = true;
+                postToTabs({ type: 'sync' });
+                return true;
+            },
+            append: sendToServer,
+            save() {}
+        };
+        
+        // Resolves to the storage for this tab: the backend itself when tabs
+        // cannot sync, otherwise the leader's or a follower's
+        async function joinTabs(backend) {
+            if (!self.BroadcastChannel || !(self.navigator && navigator.locks)) return backend;
+            tabBackend = backend;
+            syncChannel = new BroadcastChannel(SYNC_CHANNEL);
+            if (await claimLeadership(false)) {
+                leading = true;
+                return leaderStorage;
+            }
+            syncChannel.onmessage = event => receiveTabMessage(event.data);
+            claimLeadership(true).then(takeOver);
+            return followerStorage;
+        }
+        
+        // Resolves true once this tab holds the lock, which it keeps until it
+        // closes, or false if another tab has it and `wait` is not set
+        function claimLeadership(wait) {
+            return new Promise(resolve => {
+                navigator.locks.request(SYNC_LOCK, wait ? {} : { ifAvailable: true }, lock => {
+                    resolve(lock !== null);
+                    return lock && new Promise(() => {});
+                });
+            });
+        }
+        
+        // Called once the leader's ledger is loaded: answer followers from
+        // now on and bring them all up to date
+        function startLeading() {
+            syncChannel.onmessage = event => receiveTabMessage(event.data);
+            shareState();
+        }
+        
+        // The leading tab closed and this one holds the lock now. It starts
+        // from what the old leader saved, commits its own unsent entries
+        // again and brings the other followers up to date; entries that were
+        // in flight to the old leader are kept only if it saved them.
+        async function takeOver() {
+            syncChannel.onmessage = null;
+            leading = true;
+            inflight.clear();
+            const pending = retryQueue.concat(outbox);
+            retryQueue = [];
+            outbox = [];
+            syncPending = false;
+            await initializeCardData();
+            pending.forEach(entry => {
+                try {
+                    commitEntry(entry);
+                } catch (e) {
+                    console.error("Dropping entry after takeover:", e);
+                    notify(e.message, 'error');
+                }
+            });
+            startLeading();
+            publishCards(allCards());
+        }
+        
+        function postToTabs(message, to = null, except = null) {
+            syncChannel.postMessage({ from: tabId, to: to, except: except, message: message });
+        }
+        
+        function receiveTabMessage({ from, to, except, message }) {
+            if ((to !== null && to !== tabId) || except === tabId) return;
+            if (leading) {
+                leadTabs(from, message);
+            } else if (message.type !== 'entries' || !syncPending) {
+                // Entries that arrive before a resync are in the state it brings
+                handleServerMessage(message);
+            }
+        }
+        
+        // The leader's side of the ledger server's protocol
+        function leadTabs(from, message) {
+            switch (message.type) {
+                case 'sync':
+                    flushTabShare();
+                    postToTabs({ type: 'state', snapshot: currentSnapshot() }, from);
+                    break;
+                case 'ops': {
+                    const applied = [];
+                    const rejected = [];
+                    message.ops.forEach((entry, index) => {
+                        try {
+                            const targets = checkEntry(entry);
+                            shareEntry(entry, from);
+                            applyEntry(entry, targets);
+                            applied.push(entry);
+                        } catch (e) {
+                            rejected.push({ index: index, error: e.message, conflict: e.conflict === true });
+                        }
+                    });
+                    postToTabs({ type: 'ack', id: message.id, applied: applied.length, rejected: rejected }, from);
+                    publishCards(changedCards(applied));
+                    break;
+                }
+            }
+        }
+        
+        // Persist an entry and queue it for every tab but the one it came from
+        function shareEntry(entry, origin) {
+            tabBackend.append(entry);
+            tabOutgoing.push([origin, entry]);
+            if (!tabShareScheduled) {
+                tabShareScheduled = true;
+                queueMicrotask(flushTabShare);
+            }
+        }
+        
+        // One message per originating tab for everything shared in a task
+        function flushTabShare() {
+            tabShareScheduled = false;
+            const byOrigin = new Map();
+            tabOutgoing.forEach(([origin, entry]) => {
+                if (!byOrigin.has(origin)) byOrigin.set(origin, []);
+                byOrigin.get(origin).push(entry);
+            });
+            tabOutgoing = [];
+            byOrigin.forEach((entries, origin) => {
+                postToTabs({ type: 'entries', entries: entries }, null, origin);
+            });
+        }
+        
+        // Replace every follower's ledger with the leader's
+        function shareState() {
+            flushTabShare();
+            postToTabs({ type: 'state', snapshot: currentSnapshot() });
+        }
+        
+        // Check, persist, then apply. A failed check or journal write throws
+        // before the ledger changes, so both sides of a transfer land together
+        // or not at all. The check resolves every target the entry writes to,
+        // so an entry that could fail to apply is never journaled. The entry
+        // records the debited card's version.
+        function commitEntry(entry) {
+            const { debit } = entryCards(entry);
+            if (debit !== null) entry.version = cardVersions[debit];
+            const targets = checkEntry(entry);
+            const start = performance.now();
+            storage.append(entry);
+            measureSince('storage.append', start);
+            applyEntry(entry, targets);
+        }
+        
+        // Register a new card with the ledger, returning its index
+        function addCard(id, label) {
+            if (!cardIndex.has(id)) {
+                commitEntry({ type: 'register', id: id, label: label || `Card ${cardCount + 1}` });
+            }
+            return cardIndex.get(id);
+        }
+        
+        // Engine Events
+        // The engine tells whoever hosts it about changes through `emit`:
+        // 'cards' carries the summaries of cards whose display changed,
+        // 'notification' a message for the notification banner, and
+        // 'metrics' passes on the ledger server's request for metrics.
+        let emit = () => {};
+        
+        function notify(message, type = 'success') {
+            emit({ type: 'notification', message: message, kind: type });
+        }
+        
+        function cardSummary(card) {
+            return {
+                index: card,
+                id: cardIds[card],
+                label: cardLabels[card],
+                balance: balances[card],
+                transactions: transactionCounts[card]
+            };
+        }
+        
+        function publishCards(cards) {
+            emit({ type: 'cards', cards: Array.from(cards, cardSummary) });
+        }
+        
+        function allCards() {
+            return Array.from({ length: cardCount }, (_, card) => card);
+        }
+        
+        // Cards changed by entries that have already been applied
+        function changedCards(entries) {
+            const changed = new Set();
+            entries.forEach(entry => {
+                if (entry.type === 'register') {
+                    changed.add(cardIndex.get(entry.id));
+                    return;
+                }
+                if (entry.type === 'batch') {
+                    batchTransfers(entry).forEach(({ debit, credit }) => {
+                        if (debit !== null) changed.add(debit);
+                        if (credit !== null) changed.add(credit);
+                    });
+                    return;
+                }
+                const { debit, credit } = entryCards(entry);
+                if (debit !== null) changed.add(debit);
+                if (credit !== null) changed.add(credit);
+            });
+            return changed;
+        }
+        
+        // Metrics
+        // Hot paths record samples with recordMetric, or time themselves with
+        // measureSince, which also leaves a performance.measure entry for the
+        // browser's profiler (cleared at once, so entries do not pile up).
+        // Each metric keeps its latest METRIC_SAMPLES samples in a ring
+        // buffer, from which metricSummary gives the p50, p99 and maximum.
+        // The engine and the page keep their own; with the engine in a
+        // worker, the page asks for the engine's with a 'metrics' intent.
+        const METRIC_SAMPLES = 1024;
+        const metrics = new Map();
+        
+        function recordMetric(name, value, unit = 'ms') {
+            let metric = metrics.get(name);
+            if (!metric) {
+                metric = { unit: unit, count: 0, samples: new Float64Array(METRIC_SAMPLES) };
+                metrics.set(name, metric);
+            }
+            metric.samples[metric.count % METRIC_SAMPLES] = value;
+            metric.count++;
+        }
+        
+        function measureSince(name, start) {
+            const end = performance.now();
+            recordMetric(name, end - start);
+            try {
+                performance.measure(name, { start: start, end: end });
+                performance.clearMeasures(name);
+            } catch (e) {
+                // Browsers without User Timing L3 only measure between marks
+            }
+        }
+        
+        function metricSummary() {
+            const summary = {};
+            metrics.forEach((metric, name) => {
+                const samples = metric.samples.slice(0, Math.min(metric.count, METRIC_SAMPLES)).sort();
+                const at = fraction => samples[Math.min(samples.length - 1, Math.floor(samples.length * fraction))];
+                summary[name] = {
+                    unit: metric.unit,
+                    count: metric.count,
+                    p50: at(0.5),
+                    p99: at(0.99),
+                    max: samples[samples.length - 1]
+                };
+            });
+            return summary;
+        }
+        
+        // Load the ledger and publish every card
+        async function startEngine() {
+            await initializeCardData();
+            if (leading) startLeading();
+            publishCards(allCards());
+        }
+        
+        // Engine Operations
+        // The intents the page sends. Each returns { ok: true, ... } or
+        // { ok: false, reason } and publishes the cards it changed before
+        // returning. Unexpected errors are logged and reported as 'error'.
+        // Entries are stamped with the intent's `timestamp` if it has one,
+        // otherwise by `clock`, which a replay can replace. The clock is only
+        // read for an entry that is about to be committed.
+        let clock = () => Date.now();
+        
+        function stamp(timestamp) {
+            return timestamp === undefined ? clock() : timestamp;
+        }
+        
+        function runOperation(intent) {
+            const timestamp = intent.timestamp;
+            try {
+                switch (intent.op) {
+                    case 'register':
+                        return registerOperation(intent.id, intent.label);
+                    case 'transfer':
+                        return transferOperation(intent.from, intent.to, intent.amount, timestamp);
+                    case 'bid':
+                        return bidOperation(intent.card, intent.amount, timestamp);
+                    case 'loan':
+                        return loanOperation(intent.card, intent.amount, intent, timestamp);
+                    case 'repay':
+                        return repayOperation(intent.card, timestamp);
+                    case 'installment':
+                        return installmentOperation(intent.card, intent.loan, timestamp);
+                    case 'loans':
+                        return loansOperation(intent.card, intent.settled === true);
+                    case 'schedule':
+                        return scheduleOperation(intent.loan);
+                    case 'batch':
+                        return batchOperation(intent.transfers, timestamp);
+                    case 'payAll':
+                        return batchOperation(everyCard(intent.cards).map(card => ({ from: null, to: card, amount: intent.amount })), timestamp);
+                    case 'collectAll':
+                        return batchOperation(everyCard(intent.cards).map(card => ({ from: card, to: null, amount: intent.amount })), timestamp);
+                    case 'history':
+                        return Object.assign({ ok: true }, queryHistory(intent.query));
+                    case 'stateAt':
+                        return { ok: true, cards: stateAt(intent.time) };
+                    case 'export':
+                        return { ok: true, chunks: Array.from(encodeArchive(currentSnapshot())) };
+                    case 'import':
+                        return importOperation(intent.bytes);
+                    case 'auction':
+                        return auctionOperation(intent, timestamp);
+                    case 'metrics':
+                        return { ok: true, metrics: metricSummary() };
+                    case 'reportMetrics':
+                        return reportMetricsOperation(intent.metrics);
+                    default:
+                        throw new Error("Unknown operation: " + intent.op);
+                }
+            } catch (error) {
+                console.error(`${intent.op} error:`, error);
+                return { ok: false, reason: 'error' };
+            }
+        }
+        
+        function commitAndPublish(entry) {
+            commitEntry(entry);
+            publishCards(changedCards([entry]));
+        }
+        
+        function registerOperation(id, label) {
+            const card = addCard(id, label);
+            publishCards([card]);
+            return { ok: true, card: card };
+        }
+        
+        // Replace the ledger with the first game in an archive. A table's
+        // ledger belongs to the server and a following tab's to the leader,
+        // so neither can import; the leader passes its import on.
+        function importOperation(bytes) {
+            if (serverTable) {
+                return { ok: false, reason: 'server' };
+            }
+            if (syncChannel && !leading) {
+                return { ok: false, reason: 'follower' };
+            }
+            const snapshot = decodeArchive(bytes).next().value;
+            if (!snapshot) {
+                throw new Error("Archive is empty");
+            }
+            clearAuctions();
+            clearLedger();
+            loadSnapshot(snapshot);
+            saveCardData();
+            if (leading) shareState();
+            publishCards(allCards());
+            return { ok: true };
+        }
+        
+        // Answer the ledger server's request with the page's metrics and ours
+        function reportMetricsOperation(pageMetrics) {
+            if (!serverSocket) {
+                return { ok: false, reason: 'offline' };
+            }
+            const report = Object.assign(metricSummary(), pageMetrics);
+            serverSocket.send(JSON.stringify({ type: 'metrics', metrics: report }));
+            return { ok: true };
+        }
+        
+        function transferOperation(from, to, amount, timestamp) {
+            if (!isCard(from) || !isCard(to)) {
+                return { ok: false, reason: 'unknown_card' };
+            }
+            if (from === to) {
+                return { ok: false, reason: 'same_card' };
+            }
+            if (amount > balances[from]) {
+                return { ok: false, reason: 'insufficient_funds' };
+            }
+            commitAndPublish({ type: 'transfer', from: from, to: to, amount: amount, timestamp: stamp(timestamp) });
+            return { ok: true };
+        }
+        
+        function bidOperation(card, amount, timestamp) {
+            if (!isCard(card)) {
+                return { ok: false, reason: 'unknown_card' };
+            }
+            if (amount > balances[card]) {
+                return { ok: false, reason: 'insufficient_funds' };
+            }
+            // Deduct bid amount and increment transactions counter
+            commitAndPublish({ type: 'bid', card: card, amount: amount, timestamp: stamp(timestamp) });
+            return { ok: true };
+        }
+        
+        // `terms` may carry a rate and a number of installments; loans
+        // without them are taken on default terms
+        function loanOperation(card, amount, terms, timestamp) {
+            if (!isCard(card)) {
+                return { ok: false, reason: 'unknown_card' };
+            }
+            const entry = { type: 'loan', card: card, amount: amount };
+            if (terms.rate !== undefined) entry.rate = terms.rate;
+            if (terms.installments !== undefined) entry.installments = terms.installments;
+            try {
+                checkLoanTerms(entry);
+            } catch (e) {
+                return { ok: false, reason: 'invalid_terms' };
+            }
+            entry.timestamp = stamp(timestamp);
+            commitAndPublish(entry);
+            return { ok: true, loan: loans.card.length - 1 };
+        }
+        
+        function repayOperation(card, timestamp) {
+            if (!isCard(card)) {
+                return { ok: false, reason: 'unknown_card' };
+            }
+            if (transactionCounts[card] === 0) {
+                return { ok: false, reason: 'no_transactions' };
+            }
+            if (openLoans[card].length === 0) {
+                return { ok: false, reason: 'no_loans' };
+            }
+            
+            const { interestAmount, totalRepayment } = calculateRepayment(card);
+            if (totalRepayment > balances[card]) {
+                return { ok: false, reason: 'insufficient_funds' };
+            }
+            
+            // Mark loans as paid and reset the transaction counter
+            commitAndPublish({ type: 'repay', card: card, amount: totalRepayment, timestamp: stamp(timestamp) });
+            return { ok: true, interestAmount: interestAmount, totalRepayment: totalRepayment };
+        }
+        
+        // Pay the next installment of one of the card's loans, by default
+        // its oldest open one
+        function installmentOperation(card, loan, timestamp) {
+            if (!isCard(card)) {
+                return { ok: false, reason: 'unknown_card' };
+            }
+            const row = loan === undefined ? openLoans[card][0] : loan;
+            if (row === undefined || loans.card[row] !== card || loans.paid[row]) {
+                return { ok: false, reason: 'no_loans' };
+            }
+            const due = nextInstallment(row);
+            if (due.amount > balances[card]) {
+                return { ok: false, reason: 'insufficient_funds' };
+            }
+            commitAndPublish({
+                type: 'installment', card: card, loan: row,
+                principal: due.principal, interest: due.interest, amount: due.amount,
+                timestamp: stamp(timestamp)
+            });
+            return Object.assign({ ok: true, loan: row, remaining: loans.installments[row] - loans.paidInstallments[row] }, due);
+        }
+        
+        // The open loans of a card, or of every card, plus the settled ones
+        // if asked for, oldest first
+        function loansOperation(card, settled) {
+            if (card !== undefined && !isCard(card)) {
+                return { ok: false, reason: 'unknown_card' };
+            }
+            const cards = card === undefined ? allCards() : [card];
+            const rows = [];
+            cards.forEach(index => {
+                rows.push(...openLoans[index]);
+                if (settled) rows.push(...settledLoans[index]);
+            });
+            rows.sort((a, b) => a - b);
+            return { ok: true, loans: rows.map(loanSummary) };
+        }
+        
+        function scheduleOperation(loan) {
+            if (!Number.isInteger(loan) || loan < 0 || loan >= loans.card.length) {
+                return { ok: false, reason: 'no_loans' };
+            }
+            return { ok: true, loan: loanSummary(loan), schedule: loanSchedule(loan) };
+        }
+        
+        // Bulk Operations
+        // Many transfers committed as one 'batch' entry: checked as a whole,
+        // applied in one pass and persisted as a single write, so a payday
+        // or a round of rent lands on every card or on none.
+        // Intents:
+        //   batch      { transfers: [{ from, to, amount }] }  null is the bank
+        //   payAll     { amount, cards? }  the bank pays each card
+        //   collectAll { amount, cards? }  each card pays the bank
+        // `cards` defaults to every card. A batch that cannot apply is
+        // answered with { ok: false, reason: 'rejected', message }.
+        function batchOperation(transfers, timestamp) {
+            const entry = { type: 'batch', transfers: transfers };
+            try {
+                checkEntry(entry);
+            } catch (e) {
+                return { ok: false, reason: 'rejected', message: e.message };
+            }
+            entry.timestamp = stamp(timestamp);
+            commitAndPublish(entry);
+            return { ok: true, count: transfers.length };
+        }
+        
+        function everyCard(cards) {
+            return cards === undefined ? allCards() : cards;
+        }
+        
+        // Auctions
+        // A lot is sold by open bidding between cards. Its bid book holds the
+        // bids in the order they were placed, each higher than the one before,
+        // so the last bid leads. Bidding closes `timeout` ms after the latest
+        // bid, or when the leader's card is tapped to settle. Settlement
+        // commits a single 'bid' entry for the winner, so no other card is
+        // charged. A winner who cannot pay by then loses their bids and the
+        // lot falls to the highest remaining bidder.
+        // Intents: { op: 'auction', action, lot, ... } with the actions
+        //   open   { base, card?, timeout? }  card opens the bidding at base
+        //   raise  { card, increment }        bid the price plus increment
+        //   reset  { card? }                  clear the book, card rebids base
+        //   settle { card }                   charge the leader, who tapped
+        //   cancel {}
+        // Results carry the lot's summary; timed-out lots are published as
+        // 'auction' events, once per task however many lots changed. At a
+        // table the lots are the server's, so bidders at every terminal
+        // share them: the intents go to the server, and each change it
+        // sends is published the same way.
+        const AUCTION_TIMEOUT = 30000;
+        let auctions = new Map();
+        let nextLot = 1;
+        let changedLots = new Set();
+        
+        function lotSummary(lot) {
+            const auction = auctions.get(lot);
+            const count = auction.bids.card.length;
+            return {
+                lot: lot,
+                base: auction.base,
+                price: count > 0 ? auction.bids.amount[count - 1] : auction.base,
+                leader: count > 0 ? auction.bids.card[count - 1] : null,
+                bids: count,
+                closesAt: auction.closesAt,
+                status: auction.status
+            };
+        }
+        
+        function publishLot(lot) {
+            if (changedLots.size === 0) {
+                queueMicrotask(() => {
+                    const lots = Array.from(changedLots).filter(lot => auctions.has(lot)).map(lotSummary);
+                    changedLots.clear();
+                    if (lots.length > 0) emit({ type: 'auction', lots: lots });
+                });
+            }
+            changedLots.add(lot);
+        }
+        
+        function scheduleLotClose(lot, now) {
+            const auction = auctions.get(lot);
+            clearTimeout(auction.timer);
+            auction.timer = setTimeout(() => expireLot(lot, clock()), Math.max(0, auction.closesAt - now));
+        }
+        
+        function expireLot(lot, now) {
+            const auction = auctions.get(lot);
+            if (!auction || auction.status !== 'open') return;
+            if (now < auction.closesAt) {
+                scheduleLotClose(lot, now);
+                return;
+            }
+            auction.status = auction.bids.card.length > 0 ? 'closed' : 'unsold';
+            publishLot(lot);
+        }
+        
+        function endLot(lot) {
+            clearTimeout(auctions.get(lot).timer);
+            auctions.delete(lot);
+        }
+        
+        function clearAuctions() {
+            Array.from(auctions.keys()).forEach(endLot);
+        }
+        
+        // Append a bid if the lot is still open and the card can pay it
+        function placeBid(lot, card, amount, now) {
+            const auction = auctions.get(lot);
+            expireLot(lot, now);
+            if (auction.status !== 'open') {
+                return { ok: false, reason: 'closed', lot: lotSummary(lot) };
+            }
+            const count = auction.bids.card.length;
+            if (count > 0 ? amount <= auction.bids.amount[count - 1] : amount < auction.base) {
+                return { ok: false, reason: 'too_low', lot: lotSummary(lot) };
+            }
+            if (!isCard(card)) {
+                return { ok: false, reason: 'unknown_card', lot: lotSummary(lot) };
+            }
+            if (amount > balances[card]) {
+                return { ok: false, reason: 'insufficient_funds', lot: lotSummary(lot) };
             }
+            auction.bids.card.push(card);
+            auction.bids.amount.push(amount);
+            auction.bids.timestamp.push(now);
+            auction.closesAt = now + auction.timeout;
+            scheduleLotClose(lot, now);
+            return { ok: true, lot: lotSummary(lot) };
         }
         
-        function resetCardData() {
-            cards = {
-                "card1": {
-                    balance: DEFAULT_BALANCE,
-                    transactions: 0,
-                    loans: []
-                },
-                "card2": {
-                    balance: DEFAULT_BALANCE,
-                    transactions: 0,
-                    loans: []
+        function auctionOperation(intent, timestamp) {
+            if (serverTable) {
+                return serverAuction(intent);
+            }
+            if (intent.action === 'open') {
+                const now = stamp(timestamp);
+                const lot = nextLot++;
+                auctions.set(lot, {
+                    base: intent.base,
+                    timeout: intent.timeout || AUCTION_TIMEOUT,
+                    closesAt: now + (intent.timeout || AUCTION_TIMEOUT),
+                    status: 'open',
+                    bids: { card: [], amount: [], timestamp: [] },
+                    timer: null
+                });
+                scheduleLotClose(lot, now);
+                if (intent.card === undefined) {
+                    return { ok: true, lot: lotSummary(lot) };
                 }
-            };
-            saveCardData();
+                const result = placeBid(lot, intent.card, intent.base, now);
+                if (!result.ok) endLot(lot);
+                return result;
+            }
+            
+            const lot = intent.lot;
+            const auction = auctions.get(lot);
+            if (!auction) {
+                return { ok: false, reason: 'no_lot' };
+            }
+            if (intent.action === 'cancel') {
+                endLot(lot);
+                return { ok: true };
+            }
+            const now = stamp(timestamp);
+            switch (intent.action) {
+                case 'raise': {
+                    const count = auction.bids.card.length;
+                    const price = count > 0 ? auction.bids.amount[count - 1] : auction.base;
+                    return placeBid(lot, intent.card, price + intent.increment, now);
+                }
+                case 'reset':
+                    auction.bids = { card: [], amount: [], timestamp: [] };
+                    auction.status = 'open';
+                    auction.closesAt = now + auction.timeout;
+                    scheduleLotClose(lot, now);
+                    return intent.card === undefined ? { ok: true, lot: lotSummary(lot) } :
+                        placeBid(lot, intent.card, auction.base, now);
+                case 'settle':
+                    return settleLot(lot, intent.card, now);
+                default:
+                    throw new Error("Unknown auction action: " + intent.action);
+            }
+        }
+        
+        function settleLot(lot, card, now) {
+            const auction = auctions.get(lot);
+            const bids = auction.bids;
+            const count = bids.card.length;
+            if (count === 0) {
+                return { ok: false, reason: 'no_bids', lot: lotSummary(lot) };
+            }
+            const winner = bids.card[count - 1];
+            if (card !== winner) {
+                return { ok: false, reason: 'not_winner', lot: lotSummary(lot) };
+            }
+            const amount = bids.amount[count - 1];
+            if (amount > balances[winner]) {
+                // Withdraw the winner's bids; what remains is still in order
+                const kept = Array.from(bids.card.keys()).filter(row => bids.card[row] !== winner);
+                auction.bids = {
+                    card: kept.map(row => bids.card[row]),
+                    amount: kept.map(row => bids.amount[row]),
+                    timestamp: kept.map(row => bids.timestamp[row])
+                };
+                if (kept.length === 0) auction.status = 'unsold';
+                return { ok: false, reason: 'insufficient_funds', lot: lotSummary(lot) };
+            }
+            
+            commitAndPublish({ type: 'bid', card: winner, amount: amount, timestamp: now });
+            auction.status = 'sold';
+            const summary = lotSummary(lot);
+            endLot(lot);
+            return { ok: true, lot: summary };
         }
+    </script>
+    <script id="ledger-worker" type="text/plain">
+        // Appended to the engine's source when it runs in a worker
+        emit = event => postMessage(event);
+        onmessage = event => {
+            // Auction intents at a table resolve once the server answers
+            Promise.resolve(runOperation(event.data.intent)).then(result => {
+                postMessage({ type: 'result', id: event.data.id, result: result });
+            });
+        };
+        startEngine().then(() => postMessage({ type: 'ready' }), error => {
+            console.error("Ledger engine cannot run in a worker:", error);
+            postMessage({ type: 'unavailable' });
+        });
+    </script>
+    <script>
+        // Ledger Engine Host
+        // The engine above runs in a Web Worker built from its own source, so
+        // persistence, serialization and server traffic stay off the UI
+        // thread. The page sends intents and keeps a copy of the card
+        // summaries from 'cards' events, which is all the UI reads. Without
+        // Worker or IndexedDB support, or while a localStorage save is still
+        // waiting to be migrated, the same engine runs in the page instead.
+        let engineWorker = null;
+        let engineReady = false;
+        let pendingResults = new Map();
+        let nextRequestId = 1;
+        let cardViews = [];
+        let cardViewIndex = new Map();
         
-        function saveCardData() {
+        function startLedgerEngine() {
+            const workerUsable = self.Worker && self.Blob &&
+                (serverTable || (self.indexedDB && localStorage.getItem(STORAGE_KEY) === null));
+            if (!workerUsable) {
+                startPageEngine();
+                return;
+            }
+            
+            const source = [
+                `self.pageHref = ${JSON.stringify(location.href)};`,
+                document.getElementById('ledger-engine').textContent,
+                document.getElementById('ledger-worker').textContent
+            ].join('\n');
+            const url = URL.createObjectURL(new Blob([source], { type: 'text/javascript' }));
             try {
-                localStorage.setItem('monopolyCards', JSON.stringify(cards));
+                engineWorker = new Worker(url);
             } catch (e) {
-                console.error("Error saving card data:", e);
-                showNotification("Error saving data", "error");
+                console.error("Ledger worker failed to start:", e);
+                URL.revokeObjectURL(url);
+                startPageEngine();
+                return;
+            }
+            engineWorker.addEventListener('message', event => {
+                if (event.data.type === 'ready') URL.revokeObjectURL(url);
+                handleWorkerMessage(event.data);
+            });
+            engineWorker.addEventListener('error', event => {
+                console.error("Ledger worker error:", event.message);
+                if (!engineReady) fallBackToPage();
+            });
+        }
+        
+        function startPageEngine() {
+            emit = handleEngineEvent;
+            engineReady = true;
+            startEngine();
+        }
+        
+        function fallBackToPage() {
+            engineWorker.terminate();
+            engineWorker = null;
+            startPageEngine();
+        }
+        
+        function handleWorkerMessage(message) {
+            switch (message.type) {
+                case 'ready':
+                    engineReady = true;
+                    break;
+                case 'unavailable':
+                    fallBackToPage();
+                    break;
+                case 'result':
+                    pendingResults.get(message.id)(message.result);
+                    pendingResults.delete(message.id);
+                    break;
+                default:
+                    handleEngineEvent(message);
+            }
+        }
+        
+        function handleEngineEvent(event) {
+            switch (event.type) {
+                case 'cards':
+                    event.cards.forEach(summary => {
+                        cardViews[summary.index] = summary;
+                        cardViewIndex.set(summary.id, summary.index);
+                    });
+                    refreshCardDisplay();
+                    break;
+                case 'notification':
+                    showNotification(event.message, event.kind);
+                    break;
+                case 'auction':
+                    event.lots.forEach(handleLotUpdate);
+                    break;
+                case 'metrics':
+                    requestEngine({ op: 'reportMetrics', metrics: metricSummary() });
+                    break;
+            }
+        }
+        
+        // Resolves once no intent has been waiting for its result for a task
+        async function engineIdle() {
+            do {
+                await new Promise(resolve => setTimeout(resolve, 0));
+            } while (pendingResults.size > 0);
+        }
+        
+        // Resolves with the operation's result; by then the summaries of the
+        // cards it changed have been received
+        function requestEngine(intent) {
+            if (!engineWorker) {
+                return Promise.resolve(runOperation(intent));
+            }
+            const id = nextRequestId++;
+            engineWorker.postMessage({ id: id, intent: intent });
+            return new Promise(resolve => pendingResults.set(id, resolve));
+        }
+        
+        function refreshCardDisplay() {
+            if (currentCard !== null) {
+                updateBalanceDisplay(cardViews[currentCard].balance);
             }
         }
         
@@ -278,6 +2672,8 @@
         let amount = 0;
         let baseBid = 0;
         let currentBid = 0;
+        let auction = null; // { lot, opener, raises } while bidding
+        let tableLots = new Map(); // open lots at the table, by lot
         
         // UI Element References
         const modeDisplay = document.getElementById('mode-display');
@@ -289,305 +2685,396 @@
         const keypadContainer = document.getElementById('keypad-container');
         const biddingContainer = document.getElementById('bidding-container');
         const notification = document.getElementById('notification');
+        const registerButton = document.getElementById('register-btn');
         
         // Format Currency Functions
-        function formatAmount(amount) {
+        // Amounts are formatted in integer arithmetic, and the strings for
+        // the latest FORMAT_CACHE_SIZE amounts are kept, so redrawing the
+        // same balances and keypad values builds nothing new.
+        const FORMAT_CACHE_SIZE = 256;
+        
+        // A Map iterates in insertion order, so moving each hit to the end
+        // leaves the least recently used key first, ready to be evicted
+        function lruCache(compute, size = FORMAT_CACHE_SIZE) {
+            const cache = new Map();
+            return key => {
+                let value = cache.get(key);
+                if (value !== undefined) {
+                    cache.delete(key);
+                } else {
+                    value = compute(key);
+                    if (cache.size >= size) cache.delete(cache.keys().next().value);
+                }
+                cache.set(key, value);
+                return value;
+            };
+        }
+        
+        // amount / unit to two decimals, rounded half up, without ".00"
+        function scaledAmount(amount, unit) {
+            const step = unit / 100;
+            const remainder = amount % step;
+            const hundredths = (amount - remainder) / step + (remainder * 2 >= step ? 1 : 0);
+            const cents = hundredths % 100;
+            const whole = (hundredths - cents) / 100;
+            return cents === 0 ? `${whole}` : `${whole}.${String(cents).padStart(2, '0')}`;
+        }
+        
+        const formatAmount = lruCache(amount => {
             if (amount >= 1000000) {
-                return `$${(amount/1000000).toFixed(2).replace(/\.00$/, '')}M`;
+                return `$${scaledAmount(amount, 1000000)}M`;
             } else if (amount >= 1000) {
-                return `$${(amount/1000).toFixed(2).replace(/\.00$/, '')}K`;
+                return `$${scaledAmount(amount, 1000)}K`;
             } else {
                 return `$${amount}`;
             }
+        });
+        
+        // Digits grouped in threes, as the amount input shows them
+        const groupDigits = lruCache(amount => {
+            let text = '';
+            let rest = amount;
+            while (rest >= 1000) {
+                const group = rest % 1000;
+                text = `,${group < 10 ? '00' : group < 100 ? '0' : ''}${group}${text}`;
+                rest = (rest - group) / 1000;
+            }
+            return `${rest}${text}`;
+        });
+        
+        // Render Scheduler
+        // The UI functions below only record what the screen should show in
+        // `view`. Changes made during a frame are written to the DOM in one
+        // pass on the next animation frame, and only where the value differs
+        // from what was last rendered.
+        const view = {
+            mode: 'Mode: Idle',
+            balance: 'Balance: -',
+            message: 'Tap a card to begin',
+            amount: '0',
+            currentBid: 'Current Bid: $0',
+            input: 'hidden', // 'hidden', 'keypad' or 'bidding'
+            notification: 'Operation successful!',
+            notificationType: 'success',
+            notificationVisible: false,
+            shake: false,
+            newCard: false // Add Card offered for an unknown tag
+        };
+        const rendered = Object.assign({}, view);
+        const textBindings = [
+            ['mode', modeDisplay],
+            ['balance', balanceDisplay],
+            ['message', messageDisplay],
+            ['amount', amountDisplay],
+            ['currentBid', currentBidDisplay],
+            ['notification', notification]
+        ];
+        let renderScheduled = false;
+        let notificationTimer = null;
+        let tapStart = null; // time of the latest card tap not yet rendered
+        
+        function setView(key, value) {
+            if (view[key] === value) return;
+            view[key] = value;
+            if (!renderScheduled) {
+                renderScheduled = true;
+                requestAnimationFrame(render);
+            }
         }
         
-        function formatDisplayAmount(amountStr) {
-            // Format for display in the amount input
-            if (!amountStr || amountStr === '0') return '0';
+        function render() {
+            renderScheduled = false;
+            const start = performance.now();
+            
+            textBindings.forEach(([key, element]) => {
+                if (rendered[key] !== view[key]) {
+                    element.textContent = view[key];
+                    rendered[key] = view[key];
+                }
+            });
             
-            const num = parseInt(amountStr.replace(/,/g, ''));
-            return num.toLocaleString();
+            if (rendered.input !== view.input) {
+                inputArea.classList.toggle('hidden', view.input === 'hidden');
+                keypadContainer.classList.toggle('hidden', view.input !== 'keypad');
+                biddingContainer.classList.toggle('hidden', view.input !== 'bidding');
+                rendered.input = view.input;
+            }
+            if (rendered.notificationType !== view.notificationType) {
+                notification.classList.toggle('bg-red-500', view.notificationType === 'error');
+                notification.classList.toggle('bg-green-500', view.notificationType !== 'error');
+                rendered.notificationType = view.notificationType;
+            }
+            if (rendered.notificationVisible !== view.notificationVisible) {
+                notification.classList.toggle('hidden', !view.notificationVisible);
+                rendered.notificationVisible = view.notificationVisible;
+            }
+            if (rendered.shake !== view.shake) {
+                messageDisplay.classList.toggle('shake', view.shake);
+                rendered.shake = view.shake;
+            }
+            if (rendered.newCard !== view.newCard) {
+                registerButton.classList.toggle('hidden', !view.newCard);
+                rendered.newCard = view.newCard;
+            }
+            
+            measureSince('render', start);
+            if (tapStart !== null) {
+                measureSince('tap.feedback', tapStart);
+                tapStart = null;
+            }
         }
         
         // UI Update Functions
         function updateModeDisplay(mode) {
-            modeDisplay.textContent = `Mode: ${mode.charAt(0).toUpperCase() + mode.slice(1)}`;
+            setView('mode', `Mode: ${mode.charAt(0).toUpperCase() + mode.slice(1)}`);
         }
         
         function updateBalanceDisplay(balance) {
-            balanceDisplay.textContent = balance ? `Balance: ${formatAmount(balance)}` : 'Balance: -';
+            setView('balance', balance ? `Balance: ${formatAmount(balance)}` : 'Balance: -');
         }
         
         function updateMessageDisplay(message) {
-            messageDisplay.textContent = message;
+            setView('message', message);
+        }
+        
+        function updateAmountDisplay(amountStr) {
+            setView('amount', amountStr);
+        }
+        
+        function updateBidDisplay(bid) {
+            setView('currentBid', `Current Bid: ${formatAmount(bid)}`);
         }
         
         function showInputArea(type = 'keypad') {
-            inputArea.classList.remove('hidden');
+            setView('input', type);
             
             if (type === 'keypad') {
-                keypadContainer.classList.remove('hidden');
-                biddingContainer.classList.add('hidden');
-                amountDisplay.textContent = '0';
+                clearAmount();
             } else if (type === 'bidding') {
-                keypadContainer.classList.add('hidden');
-                biddingContainer.classList.remove('hidden');
-                currentBidDisplay.textContent = `Current Bid: ${formatAmount(currentBid)}`;
+                updateBidDisplay(currentBid);
             }
         }
         
         function hideInputArea() {
-            inputArea.classList.add('hidden');
+            setView('input', 'hidden');
         }
         
         function showNotification(message, type = 'success') {
-            notification.textContent = message;
-            
-            if (type === 'error') {
-                notification.classList.remove('bg-green-500');
-                notification.classList.add('bg-red-500');
-            } else {
-                notification.classList.remove('bg-red-500');
-                notification.classList.add('bg-green-500');
-            }
+            setView('notification', message);
+            setView('notificationType', type);
+            setView('notificationVisible', true);
             
-            notification.classList.remove('hidden');
-            
-            setTimeout(() => {
-                notification.classList.add('hidden');
+            clearTimeout(notificationTimer);
+            notificationTimer = setTimeout(() => {
+                setView('notificationVisible', false);
             }, 3000);
         }
         
+        function shakeMessage() {
+            setView('shake', true);
+            setTimeout(() => {
+                setView('shake', false);
+            }, 500);
+        }
+        
         // Card Interaction Functions
         function simulateCardTap(cardId) {
-            currentCard = cardId;
+            tapStart = performance.now();
+            const card = cardViewIndex.get(cardId);
+            if (card === undefined) {
+                updateMessageDisplay('Unknown card');
+                showNotification('Unknown card', 'error');
+                return;
+            }
+            currentCard = card;
             
             switch(currentMode) {
                 case 'idle':
-                    displayCardInfo(cardId);
+                    displayCardInfo(card);
                     break;
                 case 'transfer_sender':
-                    senderCard = cardId;
-                    displayCardInfo(cardId);
+                    senderCard = card;
+                    displayCardInfo(card);
                     updateMessageDisplay('Enter amount to transfer');
                     currentMode = 'transfer_amount';
                     showInputArea('keypad');
                     break;
                 case 'transfer_receiver':
-                    receiverCard = cardId;
+                    receiverCard = card;
                     processTransfer();
                     break;
-                case 'bidding_card':
-                    displayCardInfo(cardId);
+                case 'bidding_card': {
+                    const shared = openTableLot();
+                    if (shared) {
+                        joinAuction(card, shared);
+                        break;
+                    }
+                    displayCardInfo(card);
                     updateMessageDisplay('Enter base bid amount');
                     currentMode = 'bidding_base';
                     showInputArea('keypad');
                     break;
+                }
+                case 'bidding_increment':
+                    // The tapped card makes the next increments
+                    updateBalanceDisplay(cardViews[card].balance);
+                    updateMessageDisplay(`${cardViews[card].label} bidding`);
+                    break;
                 case 'bidding_final':
-                    processBid(cardId);
+                    processBid(card);
                     break;
                 case 'loan_card':
-                    displayCardInfo(cardId);
+                    displayCardInfo(card);
                     updateMessageDisplay('Enter loan amount');
                     currentMode = 'loan_amount';
                     showInputArea('keypad');
                     break;
                 case 'repay_card':
-                    processRepayment(cardId);
+                    processRepayment(card);
                     break;
             }
         }
         
-        function displayCardInfo(cardId) {
-            const card = cards[cardId];
-            updateBalanceDisplay(card.balance);
+        function displayCardInfo(card) {
+            const summary = cardViews[card];
+            updateBalanceDisplay(summary.balance);
             
-            if (card.transactions > 0) {
-                updateMessageDisplay(`Please repay ${card.transactions}`);
+            if (summary.transactions > 0) {
+                updateMessageDisplay(`Please repay ${summary.transactions}`);
             } else {
-                updateMessageDisplay(`Card ${cardId.slice(-1)} - Ready`);
+                updateMessageDisplay(`${summary.label} - Ready`);
             }
         }
         
         // Process Functions
+        // The engine checks and commits each operation; these report the
+        // result. Card and amount are captured because the mode may have
+        // been reset by the time the result arrives.
         function processTransfer() {
-            if (senderCard === receiverCard) {
-                updateMessageDisplay('Cannot transfer to the same card');
-                showNotification('Cannot transfer to the same card', 'error');
-                return;
-            }
-            
-            try {
-                // Check for sufficient funds
-                if (amount > cards[senderCard].balance) {
+            const from = senderCard;
+            const to = receiverCard;
+            const transferAmount = amount;
+            requestEngine({ op: 'transfer', from: from, to: to, amount: transferAmount }).then(timed('process.transfer', result => {
+                if (result.reason === 'same_card') {
+                    updateMessageDisplay('Cannot transfer to the same card');
+                    showNotification('Cannot transfer to the same card', 'error');
+                    return;
+                }
+                if (result.reason === 'insufficient_funds') {
                     updateMessageDisplay('Insufficient funds for transfer');
                     showNotification('Insufficient funds', 'error');
                     return;
                 }
-                
-                // Perform the transfer
-                cards[senderCard].balance -= amount;
-                cards[receiverCard].balance += amount;
+                if (!result.ok) {
+                    updateMessageDisplay('Error processing transfer');
+                    showNotification('Error processing transfer', 'error');
+                    return;
+                }
                 
                 // Update display
-                displayCardInfo(receiverCard);
+                displayCardInfo(to);
                 
                 // Show notification
-                const amountStr = formatAmount(amount);
+                const amountStr = formatAmount(transferAmount);
                 showNotification(`Transferred ${amountStr} successfully`);
-                updateMessageDisplay(`Transferred ${amountStr} from Card ${senderCard.slice(-1)} to Card ${receiverCard.slice(-1)}`);
-                
-                // Save data
-                saveCardData();
+                updateMessageDisplay(`Transferred ${amountStr} from ${cardViews[from].label} to ${cardViews[to].label}`);
                 
                 // Reset after delay
                 setTimeout(resetToIdle, 3000);
-                
-            } catch (error) {
-                console.error("Transfer error:", error);
-                updateMessageDisplay('Error processing transfer');
-                showNotification('Error processing transfer', 'error');
-            }
+            }));
         }
         
-        function processBid(cardId) {
-            try {
-                // Check for sufficient funds
-                if (currentBid > cards[cardId].balance) {
+        // Settle the lot; only the leader's card can pay for it
+        function processBid(card) {
+            queueAuction(session => ({ action: 'settle', card: card }), timed('process.bid', (result, session) => {
+                if (result.reason === 'not_winner') {
+                    updateMessageDisplay(`Winning bid is ${cardViews[result.lot.leader].label}'s`);
+                    showNotification('Not the winning bid', 'error');
+                    return;
+                }
+                if (result.reason === 'insufficient_funds') {
                     updateMessageDisplay('Insufficient funds for bid');
                     showNotification('Insufficient funds', 'error');
+                    if (auction === session) showLot(result.lot);
                     return;
                 }
-                
-                // Deduct bid amount
-                cards[cardId].balance -= currentBid;
-                
-                // Increment transactions counter
-                cards[cardId].transactions += 1;
+                if (!result.ok) {
+                    updateMessageDisplay('Error processing bid');
+                    showNotification('Error processing bid', 'error');
+                    return;
+                }
+                if (auction === session) auction = null;
                 
                 // Update display
-                displayCardInfo(cardId);
+                displayCardInfo(card);
                 
                 // Show notification
-                const bidStr = formatAmount(currentBid);
+                const bidStr = formatAmount(result.lot.price);
                 showNotification(`Bid of ${bidStr} paid successfully`);
                 
-                // Save data
-                saveCardData();
-                
                 // Reset after delay
                 setTimeout(resetToIdle, 3000);
-                
-            } catch (error) {
-                console.error("Bid error:", error);
-                updateMessageDisplay('Error processing bid');
-                showNotification('Error processing bid', 'error');
-            }
+            }));
         }
         
         function processLoan() {
-            try {
-                // Add loan amount to card
-                cards[currentCard].balance += amount;
-                
-                // Store loan information
-                cards[currentCard].loans.push({
-                    amount: amount,
-                    paid: false,
-                    timestamp: Date.now()
-                });
+            const card = currentCard;
+            const loanAmount = amount;
+            requestEngine({ op: 'loan', card: card, amount: loanAmount }).then(timed('process.loan', result => {
+                if (!result.ok) {
+                    updateMessageDisplay('Error processing loan');
+                    showNotification('Error processing loan', 'error');
+                    return;
+                }
                 
                 // Update display
-                displayCardInfo(currentCard);
+                displayCardInfo(card);
                 
                 // Show notification
-                const amountStr = formatAmount(amount);
+                const amountStr = formatAmount(loanAmount);
                 showNotification(`Loan of ${amountStr} added successfully`);
-                updateMessageDisplay(`Loan of ${amountStr} added to Card ${currentCard.slice(-1)}`);
-                
-                // Save data
-                saveCardData();
+                updateMessageDisplay(`Loan of ${amountStr} added to ${cardViews[card].label}`);
                 
                 // Reset after delay
                 setTimeout(resetToIdle, 3000);
-                
-            } catch (error) {
-                console.error("Loan error:", error);
-                updateMessageDisplay('Error processing loan');
-                showNotification('Error processing loan', 'error');
-            }
+            }));
         }
         
-        function processRepayment(cardId) {
-            try {
-                const card = cards[cardId];
-                const transactions = card.transactions;
-                
-                if (transactions === 0) {
+        function processRepayment(card) {
+            requestEngine({ op: 'repay', card: card }).then(timed('process.repay', result => {
+                if (result.reason === 'no_transactions') {
                     updateMessageDisplay('No loans to repay');
                     showNotification('No loans to repay', 'error');
                     return;
                 }
-                
-                // Calculate interest (5% base + 1% per transaction after the first)
-                let interestRate = 0.05;
-                if (transactions > 1) {
-                    interestRate += (transactions - 1) * 0.01;
-                }
-                
-                // Find unpaid loans
-                const unpaidLoans = card.loans.filter(loan => !loan.paid);
-                
-                if (unpaidLoans.length === 0) {
+                if (result.reason === 'no_loans') {
                     updateMessageDisplay('No unpaid loans found');
                     showNotification('No unpaid loans found', 'error');
                     return;
                 }
-                
-                // Calculate total repayment
-                const loanTotal = unpaidLoans.reduce((sum, loan) => sum + loan.amount, 0);
-                const interestAmount = Math.round(loanTotal * interestRate);
-                const totalRepayment = loanTotal + interestAmount;
-                
-                // Check for sufficient funds
-                if (totalRepayment > card.balance) {
+                if (result.reason === 'insufficient_funds') {
                     updateMessageDisplay('Insufficient funds to repay loans');
                     showNotification('Insufficient funds', 'error');
                     return;
                 }
-                
-                // Process repayment
-                card.balance -= totalRepayment;
-                
-                // Mark loans as paid
-                unpaidLoans.forEach(loan => {
-                    loan.paid = true;
-                    loan.repaidTimestamp = Date.now();
-                });
-                
-                // Reset transaction counter
-                card.transactions = 0;
+                if (!result.ok) {
+                    updateMessageDisplay('Error processing repayment');
+                    showNotification('Error processing repayment', 'error');
+                    return;
+                }
                 
                 // Update display
-                displayCardInfo(cardId);
+                displayCardInfo(card);
                 
                 // Show notification
-                const repaymentStr = formatAmount(totalRepayment);
-                const interestStr = formatAmount(interestAmount);
+                const repaymentStr = formatAmount(result.totalRepayment);
+                const interestStr = formatAmount(result.interestAmount);
                 showNotification(`Repayment successful`);
                 updateMessageDisplay(`Repaid ${repaymentStr} (incl. ${interestStr} interest)`);
                 
-                // Save data
-                saveCardData();
-                
                 // Reset after delay
                 setTimeout(resetToIdle, 3000);
-                
-            } catch (error) {
-                console.error("Repayment error:", error);
-                updateMessageDisplay('Error processing repayment');
-                showNotification('Error processing repayment', 'error');
-            }
+            }));
         }
         
         // Mode Functions
@@ -620,12 +3107,21 @@
         }
         
         function resetToIdle() {
+            offerNewCard(null);
             currentMode = 'idle';
             updateModeDisplay('Idle');
             updateBalanceDisplay(null);
             updateMessageDisplay('Tap a card to begin');
             hideInputArea();
             
+            if (auction !== null) {
+                // A lot joined at the table stays open for its opener
+                if (auction.opener !== null) {
+                    queueAuction(session => ({ action: 'cancel' }), () => {});
+                }
+                auction = null;
+            }
+            
             // Reset variables
             currentCard = null;
             senderCard = null;
@@ -636,48 +3132,51 @@
         }
         
         // Amount Input Functions
+        // The amount being typed is kept as a number and the count of its
+        // digits; the display is only ever written, through the view.
+        const MAX_AMOUNT_DIGITS = 9;
+        let keypadAmount = 0;
+        let keypadDigits = 1;
+        
+        function setKeypadAmount(value, digits) {
+            keypadAmount = value;
+            keypadDigits = digits;
+            updateAmountDisplay(groupDigits(value));
+        }
+        
+        // `value` is a key's label: a digit, '00' or '000'
         function handleNumpadInput(value) {
-            const currentAmount = amountDisplay.textContent.replace(/,/g, '');
-            
             // Prevent adding too many digits
-            if (currentAmount.length >= 9 && currentAmount !== '0') {
+            if (keypadDigits >= MAX_AMOUNT_DIGITS && keypadAmount !== 0) {
                 return;
             }
             
-            let newAmount;
-            if (currentAmount === '0') {
-                newAmount = value;
+            if (keypadAmount === 0) {
+                setKeypadAmount(Number(value), 1);
             } else {
-                newAmount = currentAmount + value;
+                setKeypadAmount(keypadAmount * 10 ** value.length + Number(value), keypadDigits + value.length);
             }
-            
-            amountDisplay.textContent = formatDisplayAmount(newAmount);
         }
         
         function clearAmount() {
-            amountDisplay.textContent = '0';
+            setKeypadAmount(0, 1);
         }
         
         function backspaceAmount() {
-            const currentAmount = amountDisplay.textContent.replace(/,/g, '');
-            if (currentAmount.length <= 1) {
-                amountDisplay.textContent = '0';
+            if (keypadDigits <= 1) {
+                setKeypadAmount(0, 1);
             } else {
-                const newAmount = currentAmount.slice(0, -1);
-                amountDisplay.textContent = formatDisplayAmount(newAmount);
+                setKeypadAmount(Math.floor(keypadAmount / 10), keypadDigits - 1);
             }
         }
         
         function confirmAmount() {
             try {
-                const enteredAmount = parseInt(amountDisplay.textContent.replace(/,/g, ''));
+                const enteredAmount = keypadAmount;
                 
-                if (isNaN(enteredAmount) || enteredAmount <= 0) {
+                if (enteredAmount <= 0) {
                     updateMessageDisplay('Please enter a valid amount');
-                    messageDisplay.classList.add('shake');
-                    setTimeout(() => {
-                        messageDisplay.classList.remove('shake');
-                    }, 500);
+                    shakeMessage();
                     return;
                 }
                 
@@ -686,7 +3185,7 @@
                 switch (currentMode) {
                     case 'transfer_amount':
                         // Check if sender has enough funds
-                        if (amount > cards[senderCard].balance) {
+                        if (amount > cardViews[senderCard].balance) {
                             updateMessageDisplay('Insufficient funds');
                             showNotification('Insufficient funds', 'error');
                             return;
@@ -700,6 +3199,7 @@
                     case 'bidding_base':
                         baseBid = amount;
                         currentBid = amount;
+                        openAuction(currentCard, amount);
                         updateMessageDisplay('Adjust bid with increments');
                         currentMode = 'bidding_increment';
                         showInputArea('bidding');
@@ -719,30 +3219,402 @@
         }
         
         // Bidding Functions
+        // The engine keeps the lot's bid book; the page sends it one auction
+        // intent at a time, in order. Increments tapped while an intent is on
+        // its way are added up and go out as a single raise, so a burst of
+        // taps costs one round trip, not one each. Each intent is built
+        // when it is sent, from the session it was queued for; a session that
+        // has been reset since is left alone.
+        let auctionQueue = Promise.resolve();
+        
+        function queueAuction(build, handle) {
+            const session = auction;
+            if (session === null) return;
+            auctionQueue = auctionQueue.then(() => {
+                const intent = build(session);
+                if (intent === null || session.lot === null) return;
+                return requestEngine(Object.assign({ op: 'auction', lot: session.lot }, intent))
+                    .then(result => handle(result, session));
+            }).catch(error => console.error("Auction error:", error));
+        }
+        
+        function openAuction(card, base) {
+            const session = auction = { lot: null, opener: card, raises: [] };
+            auctionQueue = auctionQueue.then(() => requestEngine({ op: 'auction', action: 'open', base: base, card: card }))
+                .then(result => {
+                    if (result.lot) session.lot = result.lot.lot;
+                    if (auction !== session) return;
+                    if (!result.ok) {
+                        const insufficient = result.reason === 'insufficient_funds';
+                        updateMessageDisplay(insufficient ? 'Insufficient funds for bid' : 'Error processing bid');
+                        showNotification(insufficient ? 'Insufficient funds' : 'Error processing bid', 'error');
+                        auction = null;
+                        setTimeout(resetToIdle, 3000);
+                        return;
+                    }
+                    showLot(result.lot);
+                }).catch(error => console.error("Auction error:", error));
+        }
+        
+        // At a table, bidding mode joins a lot another terminal has open:
+        // the tapped card bids on it from here, and only the opener can
+        // reset or cancel it
+        function openTableLot() {
+            return tableLots.values().next().value;
+        }
+        
+        function joinAuction(card, lot) {
+            auction = { lot: lot.lot, opener: null, raises: [] };
+            baseBid = lot.base;
+            updateBalanceDisplay(cardViews[card].balance);
+            updateMessageDisplay(`${cardViews[card].label} bidding`);
+            currentMode = 'bidding_increment';
+            showInputArea('bidding');
+            showLot(lot);
+        }
+        
+        // Show the engine's view of the lot plus any increments not yet sent
+        function showLot(lot) {
+            const pending = auction.raises.reduce((sum, raise) => sum + raise.increment, 0);
+            currentBid = lot.price + pending;
+            updateBidDisplay(currentBid);
+            if (lot.status === 'unsold') {
+                updateMessageDisplay('No bids left');
+                auction = null;
+                setTimeout(resetToIdle, 3000);
+            } else if (lot.status === 'sold' || lot.status === 'cancelled') {
+                // Settled or called off at another terminal
+                updateMessageDisplay(lot.status === 'sold' ? `Sold to ${cardViews[lot.leader].label}` : 'Auction cancelled');
+                auction = null;
+                setTimeout(resetToIdle, 3000);
+            } else if (lot.status === 'closed' && currentMode === 'bidding_increment') {
+                confirmBid();
+            }
+        }
+        
+        function handleLotUpdate(lot) {
+            if (lot.status === 'open') {
+                tableLots.set(lot.lot, lot);
+            } else {
+                tableLots.delete(lot.lot);
+            }
+            if (auction === null || auction.lot !== lot.lot) return;
+            showLot(lot);
+            // Bids placed at other terminals of the table
+            if (auction !== null && lot.status === 'open' && lot.leader !== null &&
+                auction.raises.length === 0 && currentMode === 'bidding_increment') {
+                updateMessageDisplay(`${cardViews[lot.leader].label} leads`);
+            }
+        }
+        
         function addToBid(increment) {
+            if (auction === null) return;
             currentBid += increment;
-            currentBidDisplay.textContent = `Current Bid: ${formatAmount(currentBid)}`;
+            updateBidDisplay(currentBid);
+            
+            const raises = auction.raises;
+            const last = raises[raises.length - 1];
+            if (last && last.card === currentCard) {
+                last.increment += increment;
+                return;
+            }
+            const raise = { card: currentCard, increment: increment };
+            raises.push(raise);
+            queueAuction(session => {
+                const index = session.raises.indexOf(raise);
+                if (index === -1) return null;
+                session.raises.splice(index, 1);
+                return { action: 'raise', card: raise.card, increment: raise.increment };
+            }, (result, session) => {
+                if (auction !== session) return;
+                if (result.reason === 'insufficient_funds') {
+                    updateMessageDisplay(`${cardViews[raise.card].label} cannot afford that bid`);
+                    showNotification('Insufficient funds', 'error');
+                } else if (result.reason === 'closed') {
+                    showNotification('Bidding has closed', 'error');
+                } else if (!result.ok) {
+                    showNotification('Error processing bid', 'error');
+                } else if (session.raises.length === 0 && currentMode === 'bidding_increment') {
+                    updateMessageDisplay(`${cardViews[result.lot.leader].label} leads`);
+                }
+                if (result.lot) showLot(result.lot);
+            });
         }
         
+        // Back to the opening bid
         function resetBid() {
+            if (auction === null || auction.opener === null) return;
+            auction.raises = [];
             currentBid = baseBid;
-            currentBidDisplay.textContent = `Current Bid: ${formatAmount(baseBid)}`;
+            updateBidDisplay(baseBid);
+            queueAuction(session => ({ action: 'reset', card: session.opener }), (result, session) => {
+                if (auction === session && result.lot) showLot(result.lot);
+            });
         }
         
         function confirmBid() {
-            updateMessageDisplay('Tap card to confirm and pay bid');
+            if (auction === null) return;
+            updateMessageDisplay('Tap winning card to pay bid');
             currentMode = 'bidding_final';
             hideInputArea();
         }
         
+        // Diagnostics
+        // Tapping the version line five times in quick succession shows the
+        // page's and the engine's metrics, refreshed every second: tap to
+        // feedback (from a card tap to the next render pass), the process*
+        // functions from request to handled result, render passes, storage
+        // calls and the sizes of storage writes.
+        const DIAGNOSTICS_TAPS = 5;
+        const DIAGNOSTICS_TAP_WINDOW = 2000;
+        const DIAGNOSTICS_REFRESH = 1000;
+        let diagnosticsTaps = [];
+        let diagnosticsTimer = null;
+        
+        // Wraps a result handler so the time from now until it has run is
+        // recorded under `name`
+        function timed(name, handle) {
+            const start = performance.now();
+            return (...args) => {
+                try {
+                    return handle(...args);
+                } finally {
+                    measureSince(name, start);
+                }
+            };
+        }
+        
+        function tapVersion() {
+            const now = performance.now();
+            diagnosticsTaps = diagnosticsTaps.filter(at => now - at < DIAGNOSTICS_TAP_WINDOW).concat(now);
+            if (diagnosticsTaps.length < DIAGNOSTICS_TAPS) return;
+            diagnosticsTaps = [];
+            toggleDiagnostics();
+        }
+        
+        function toggleDiagnostics() {
+            const panel = document.getElementById('diagnostics');
+            const show = diagnosticsTimer === null;
+            panel.classList.toggle('hidden', !show);
+            if (show) {
+                refreshDiagnostics();
+                diagnosticsTimer = setInterval(refreshDiagnostics, DIAGNOSTICS_REFRESH);
+            } else {
+                clearInterval(diagnosticsTimer);
+                diagnosticsTimer = null;
+            }
+        }
+        
+        function refreshDiagnostics() {
+            requestEngine({ op: 'metrics' }).then(result => {
+                const summary = Object.assign({}, result.metrics, metricSummary());
+                const number = value => value.toFixed(value < 10 ? 2 : 0).padStart(9);
+                const lines = Object.keys(summary).sort().map(name => {
+                    const { unit, count, p50, p99, max } = summary[name];
+                    return `${name.padEnd(27)}${String(count).padStart(7)}${number(p50)}${number(p99)}${number(max)} ${unit}`;
+                });
+                const header = `${'metric'.padEnd(27)}${'count'.padStart(7)}${'p50'.padStart(9)}${'p99'.padStart(9)}${'max'.padStart(9)}`;
+                document.getElementById('diagnostics-output').textContent = [header].concat(lines).join('\n');
+            });
+        }
+        
+        // Card Readers
+        // Taps come from readers: Web NFC where the browser has it, or a
+        // serial reader sending one hexadecimal UID per line. Each read goes
+        // through handleCardRead. A reader reports a tag again and again
+        // while it rests on the antenna, so a read of the same UID within
+        // TAP_DEBOUNCE ms of the previous one is dropped. A tag's UID is its
+        // card id, so the ledger's id index finds the card; a tag the ledger
+        // has not seen is registered only when the banker adds it. The
+        // buttons above stand in for the two default cards.
+        // A reader is a function that starts reading into `onRead(uid)` and
+        // resolves to a function that stops it. replayReader plays back a
+        // stream of { uid, at } reads, `at` in ms, such as one recorded
+        // with startTapRecording; benchmarkTaps replays one as fast as it
+        // can and reports the sustained taps per second.
+        const TAP_DEBOUNCE = 1000;
+        const SERIAL_BAUD_RATE = 9600;
+        let lastRead = { uid: null, at: -Infinity };
+        let stopReader = null;
+        let waitingReads = null;
+        let tapRecording = null;
+        let newCard = null; // unknown UID waiting for the banker to add it
+        
+        // "04:a2:5b:1c" or "04 A2 5B 1C" -> "04A25B1C"; null if not a UID
+        function tagUid(text) {
+            const uid = text.replace(/[\s:-]/g, '').toUpperCase();
+            return /^[0-9A-F]+$/.test(uid) ? uid : null;
+        }
+        
+        function handleCardRead(uid, at = performance.now()) {
+            const repeated = uid === lastRead.uid && at - lastRead.at < TAP_DEBOUNCE;
+            lastRead = { uid: uid, at: at };
+            if (repeated) return;
+            if (tapRecording) tapRecording.taps.push({ uid: uid, at: at - tapRecording.start });
+            
+            if (waitingReads) {
+                waitingReads.push(uid);
+            } else {
+                tapCard(uid);
+            }
+        }
+        
+        // A UID the ledger has not seen is only offered for registration: it
+        // joins with the opening balance once the banker presses Add Card,
+        // so a stray tag or phone near the reader brings no money into play
+        function tapCard(uid) {
+            if (cardViewIndex.has(uid)) {
+                offerNewCard(null);
+                simulateCardTap(uid);
+                return;
+            }
+            offerNewCard(uid);
+        }
+        
+        function offerNewCard(uid) {
+            newCard = uid;
+            setView('newCard', uid !== null);
+            if (uid !== null) {
+                updateMessageDisplay(`New card ${uid}: press Add Card to register it`);
+            }
+        }
+        
+        // Taps that arrive while the new card is being registered wait for
+        // it, so the state machine sees them in order
+        function registerNewCard() {
+            const uid = newCard;
+            if (uid === null || waitingReads) return;
+            offerNewCard(null);
+            waitingReads = [];
+            requestEngine({ op: 'register', id: uid }).then(result => {
+                if (result.ok) simulateCardTap(uid);
+                const waiting = waitingReads;
+                waitingReads = null;
+                waiting.forEach(next => tapCard(next));
+            });
+        }
+        
+        async function nfcReader(onRead) {
+            const reader = new NDEFReader();
+            const controller = new AbortController();
+            reader.addEventListener('reading', event => {
+                const uid = tagUid(event.serialNumber);
+                if (uid) onRead(uid);
+            });
+            await reader.scan({ signal: controller.signal });
+            return () => controller.abort();
+        }
+        
+        async function serialReader(onRead) {
+            const port = await navigator.serial.requestPort();
+            await port.open({ baudRate: SERIAL_BAUD_RATE });
+            const decoder = new TextDecoderStream();
+            const piped = port.readable.pipeTo(decoder.writable).catch(() => {});
+            const lines = decoder.readable.getReader();
+            let stopped = false;
+            
+            (async () => {
+                let buffered = '';
+                try {
+                    for (;;) {
+                        const { value, done } = await lines.read();
+                        if (done) break;
+                        const parts = (buffered + value).split(/[\r\n]+/);
+                        buffered = parts.pop();
+                        parts.map(tagUid).filter(uid => uid !== null).forEach(uid => onRead(uid));
+                    }
+                } catch (e) {
+                    if (!stopped) {
+                        console.error("Card reader error:", e);
+                        showNotification('Card reader disconnected', 'error');
+                    }
+                }
+                lines.releaseLock();
+                await piped;
+                await port.close().catch(() => {});
+            })();
+            return () => {
+                stopped = true;
+                lines.cancel();
+            };
+        }
+        
+        // Plays `taps` into onRead, `speed` times as fast as they were
+        // recorded (Infinity: all at once); `done` resolves after the last
+        function replayTaps(taps, onRead, speed = 1) {
+            let index = 0;
+            let timer = null;
+            const started = performance.now();
+            const done = new Promise(resolve => {
+                function next() {
+                    while (index < taps.length) {
+                        const wait = taps[index].at / speed - (performance.now() - started);
+                        if (wait > 0) {
+                            timer = setTimeout(next, wait);
+                            return;
+                        }
+                        onRead(taps[index].uid, taps[index].at);
+                        index++;
+                    }
+                    resolve();
+                }
+                next();
+            });
+            return { done: done, stop: () => { index = taps.length; clearTimeout(timer); } };
+        }
+        
+        // Replayed reads keep their recorded times, so they debounce the same
+        // way at any speed
+        function replayReader(taps, speed = 1) {
+            return onRead => {
+                lastRead = { uid: null, at: -Infinity };
+                return Promise.resolve(replayTaps(taps, onRead, speed).stop);
+            };
+        }
+        
+        async function connectReader(reader) {
+            if (stopReader) stopReader();
+            stopReader = null;
+            try {
+                stopReader = await reader(handleCardRead);
+                showNotification('Card reader connected');
+            } catch (e) {
+                console.error("Card reader failed to start:", e);
+                showNotification('Card reader unavailable', 'error');
+            }
+        }
+        
+        function startTapRecording() {
+            tapRecording = { start: performance.now(), taps: [] };
+        }
+        
+        function stopTapRecording() {
+            const taps = tapRecording ? tapRecording.taps : [];
+            tapRecording = null;
+            return taps;
+        }
+        
+        // Reads, debounce, card lookup, the state machine and the engine,
+        // end to end
+        async function benchmarkTaps(taps, speed = Infinity) {
+            lastRead = { uid: null, at: -Infinity };
+            const started = performance.now();
+            await replayTaps(taps, handleCardRead, speed).done;
+            await engineIdle();
+            const seconds = (performance.now() - started) / 1000;
+            return { taps: taps.length, seconds: seconds, tapsPerSecond: taps.length / seconds };
+        }
+        
         // Event Listeners
         document.addEventListener('DOMContentLoaded', () => {
             // Initialize data
-            initializeCardData();
+            startLedgerEngine();
             
             // Card simulation buttons
-            document.getElementById('card1-btn').addEventListener('click', () => simulateCardTap('card1'));
-            document.getElementById('card2-btn').addEventListener('click', () => simulateCardTap('card2'));
+            const cardButtons = document.querySelectorAll('[data-card]');
+            cardButtons.forEach(button => {
+                button.addEventListener('click', () => simulateCardTap(button.getAttribute('data-card')));
+            });
             
             // Mode buttons
             document.getElementById('transfer-btn').addEventListener('click', startTransferMode);
@@ -750,11 +3622,22 @@
             document.getElementById('loan-btn').addEventListener('click', startLoanMode);
             document.getElementById('repay-btn').addEventListener('click', startRepayMode);
             document.getElementById('reset-btn').addEventListener('click', resetToIdle);
+            registerButton.addEventListener('click', registerNewCard);
+            document.getElementById('version').addEventListener('click', tapVersion);
+            
+            // Card reader, where the browser can talk to one
+            const readerButton = document.getElementById('reader-btn');
+            const reader = 'NDEFReader' in self ? nfcReader : (navigator.serial ? serialReader : null);
+            if (reader) {
+                readerButton.classList.remove('hidden');
+                readerButton.addEventListener('click', () => connectReader(reader));
+            }
             
             // Keypad buttons
             const numpadButtons = document.querySelectorAll('.numpad-btn');
             numpadButtons.forEach(button => {
-                button.addEventListener('click', () => handleNumpadInput(button.textContent));
+                const value = button.textContent;
+                button.addEventListener('click', () => handleNumpadInput(value));
             });
             
             document.getElementById('clear-btn').addEventListener('click', clearAmount);
@@ -770,6 +3653,15 @@
             document.getElementById('reset-bid-btn').addEventListener('click', resetBid);
             document.getElementById('confirm-bid-btn').addEventListener('click', confirmBid);
         });
+        
+        // Offline support: sw.js precaches the page once it is served over http(s)
+        window.addEventListener('load', () => {
+            if ('serviceWorker' in navigator && location.protocol.startsWith('http')) {
+                navigator.serviceWorker.register('sw.js').catch(e => {
+                    console.error("Service worker registration failed:", e);
+                });
+            }
+        });
     </script>
 </body>
 </html>
@@ -0,0 +1,801 @@
+"""Local ledger server shared by several banker terminals.
+
+A single asyncio process holding one :class:`ledger.Ledger` per table.
+It serves the page and lets terminals at the same table share a ledger
+in place of the browser's ``localStorage``::
+
+    python server.py --port 8765 --data-dir games/
+    # then open http://localhost:8765/?table=<name> on each tablet
+
+HTTP/1.1 with keep-alive and WebSocket are implemented directly on
+asyncio streams, so no third-party packages are needed.
+
+Tables share the process's event loop and are loaded on first use. To
+host a whole tournament, ``--workers N`` starts N server processes and
+puts a front end on ``--port`` that sends each table to the same worker
+every time (by a hash of its name), so busy tables run in parallel::
+
+    python server.py --workers 4 --data-dir games/
+
+Routes:
+
+``GET /``
+    The page (``monopoly.py``).
+``GET /sw.js``, ``/manifest.webmanifest``, ``/icon.svg``
+    Offline support; the service worker's cache is versioned by a hash of
+    the page.
+``GET /tables/<name>``
+    The table's snapshot, in the page's ``saveCardData`` layout.
+``POST /tables/<name>/ops``
+    Apply ``{"ops": [entry, ...]}``; returns the same ack as a socket.
+``GET /tables/<name>/history?card=&type=&since=&until=&before=&limit=``
+    ``{"records": [...], "next": row}``, newest first, from the table's
+    transaction history; every parameter is optional and ``card`` is a
+    card id. Pass ``next`` as ``before`` for the following page.
+``GET /tables/<name>/cards?at=<ms>``
+    ``{"at": ms, "cards": [...]}``, each card's balance, transaction
+    count and unpaid principal as of that moment (rebuilt from the
+    nearest checkpoint), or now if ``at`` is omitted.
+``GET /tables/<name>/loans?card=&settled=``
+    ``{"loans": [...]}``, the open loans of a card (an id), or of every
+    card, oldest first, plus the settled ones if ``settled=1``. Each has
+    its terms, installments paid, outstanding principal, the interest
+    repaying it now would add and the next installment, all worked out
+    on request. ``?loan=<row>`` gives ``{"loan": ..., "schedule": [...]}``,
+    one loan with the installments still due on it.
+``GET /tables/<name>/archive``
+    The snapshot as a binary archive (see ``archive.py``), which the page
+    can ``import``.
+``GET /tables/<name>/metrics``
+    ``{"terminals": [{"address": ..., "metrics": {...}}]}``, scraped from
+    every terminal connected to the table: each metric's ``unit``,
+    ``count`` and ``p50``, ``p99`` and ``max`` of its latest samples (tap
+    to feedback, render passes, the process functions, storage calls and
+    write sizes). Terminals that do not answer within a second are left
+    out.
+``GET /ws?table=<name>`` (WebSocket upgrade)
+    Sends ``{"type": "state", "snapshot": ...}`` on connect, then takes
+    ``{"type": "ops", "id": n, "ops": [...]}`` batches. The sender gets
+    ``{"type": "ack", "id": n, "seq": s, "applied": k, "rejected": [...]}``
+    (each rejection has ``index``, ``error`` and ``conflict``)
+    and every other subscriber gets ``{"type": "entries", "seq": s,
+    "entries": [...]}``, coalesced per event-loop pass. ``{"type":
+    "sync"}`` asks for a fresh state message. The server sends ``{"type":
+    "metrics"}`` to scrape a terminal, which answers ``{"type": "metrics",
+    "metrics": {...}}``.
+
+    Auction lots belong to the table, so bidders at every terminal share
+    them. ``{"type": "auction", "id": n, "auction": {...}}`` runs one of
+    the page's auction actions (open, raise, reset, settle, cancel) and
+    is answered with ``{"type": "auction", "id": n, "result": {...}}``,
+    the result the page's engine would give. Every subscriber gets
+    ``{"type": "lots", "lots": [...]}`` with the summary of each lot that
+    changed, including lots whose bidding timed out and lots that were
+    sold or cancelled, and the open lots right after the state message.
+    A settled lot's bid is applied and sent out like any other entry. A
+    lot is dropped once it is sold, cancelled or ends unsold; one whose
+    winner has not settled it a timeout after bidding closed is cancelled.
+
+Entries are applied in arrival order and validated against the
+server's ledger. Money entries that arrive without a ``timestamp`` are
+stamped with the server's clock before they are journaled, so replaying
+a journal always rebuilds the same history. An entry that carries the
+``version`` its terminal saw for the card it debits is committed only
+if that card is unchanged (compare-and-swap); a terminal whose
+optimistic entry is rejected should resync from a fresh state message
+and, for a conflict, try again.
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import multiprocessing
+import os
+import struct
+import sys
+import zlib
+from urllib.parse import parse_qs, urlsplit
+
+import archive
+from build import stamp_service_worker
+from ledger import AUCTION_TIMEOUT, DEFAULT_CARDS, Auction, AuctionError, ConflictError, Ledger, LedgerError
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PAGE_PATH = os.path.join(ROOT, "monopoly.py")
+ASSETS = {
+    "sw.js": "application/javascript",
+    "manifest.webmanifest": "application/manifest+json",
+    "icon.svg": "image/svg+xml",
+}
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_BODY = 1 << 20
+MAX_BATCH = 1000
+MAX_HISTORY_PAGE = 500
+METRICS_TIMEOUT = 1.0  # seconds terminals get to answer a scrape
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+STATUS_TEXT = {
+    101: "Switching Protocols",
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+}
+
+
+class Table:
+    """One shared ledger, its auction lots and the sockets subscribed to it."""
+
+    __slots__ = ("name", "ledger", "journal", "seq", "subscribers", "auctions", "_next_lot",
+                 "_lot_timers", "_lot_updates", "_outgoing", "_flush_scheduled", "_scrapes")
+
+    def __init__(self, name, ledger, journal=None, seq=0):
+        self.name = name
+        self.ledger = ledger
+        self.journal = journal
+        self.seq = seq
+        self.subscribers = set()
+        self.auctions = {}  # lot -> Auction
+        self._next_lot = 1
+        self._lot_timers = {}  # lot -> handle that publishes it when bidding closes
+        self._lot_updates = {}  # lot -> summary not yet sent to subscribers
+        self._outgoing = []
+        self._flush_scheduled = False
+        self._scrapes = {}  # socket -> futures waiting for its metrics
+
+    def apply(self, ops, origin=None):
+        """Apply a batch of entries in order and queue them for subscribers."""
+        applied = []
+        rejected = []
+        for position, entry in enumerate(ops[:MAX_BATCH]):
+            try:
+                if not isinstance(entry, dict):
+                    raise LedgerError("Invalid entry")
+                if entry.get("type") != "register" and entry.get("timestamp") is None:
+                    entry["timestamp"] = self.ledger.clock()
+                self.ledger.apply_entry(entry)
+            except LedgerError as e:
+                rejected.append({"index": position, "error": str(e),
+                                 "conflict": isinstance(e, ConflictError)})
+                continue
+            applied.append(entry)
+        for position in range(MAX_BATCH, len(ops)):
+            rejected.append({"index": position, "error": "Batch too large", "conflict": False})
+
+        if applied:
+            self.seq += len(applied)
+            if self.journal is not None:
+                self.journal.write("".join(json.dumps(e, separators=(",", ":")) + "\n" for e in applied))
+                self.journal.flush()
+            self._outgoing.append((origin, applied))
+            self._schedule_flush()
+        return {"type": "ack", "seq": self.seq, "applied": len(applied), "rejected": rejected}
+
+    def state(self):
+        return {"type": "state", "snapshot": self.ledger.snapshot(self.seq)}
+
+    def auction(self, request):
+        """Run an auction action like the page's ``auction`` intent and
+        return its result. Every change to a lot is sent to every
+        subscriber, and a settled lot's bid is applied like any entry."""
+        action = request.get("action")
+        now = self.ledger.clock()
+        lot = request.get("lot")
+        if action == "open":
+            timeout = request.get("timeout") or AUCTION_TIMEOUT
+            if not positive_int(request.get("base")) or not positive_int(timeout):
+                return {"ok": False, "reason": "error"}
+            lot = self._next_lot
+            self._next_lot += 1
+            self.auctions[lot] = Auction(self.ledger, request["base"], timeout, now)
+        auction = self.auctions.get(lot) if isinstance(lot, int) else None
+        if auction is None:
+            return {"ok": False, "reason": "no_lot"}
+
+        card = request.get("card")
+        try:
+            if action == "open":
+                if card is not None:
+                    auction.place(card, auction.base, now)
+            elif action == "raise":
+                if not positive_int(request.get("increment")):
+                    raise AuctionError("Invalid increment", "error")
+                auction.raise_bid(card, request["increment"], now)
+            elif action == "reset":
+                auction.reset(card, now)
+            elif action == "settle":
+                amount = auction.claim(card)
+                ack = self.apply([{"type": "bid", "card": card, "amount": amount, "timestamp": now}])
+                if ack["rejected"]:
+                    raise AuctionError(ack["rejected"][0]["error"], "error")
+                auction.status = "sold"
+            elif action == "cancel":
+                auction.status = "cancelled"
+            else:
+                raise AuctionError("Unknown auction action", "error")
+        except AuctionError as e:
+            result = {"ok": False, "reason": e.reason}
+            if action == "open":
+                # Nobody else has seen the lot yet
+                del self.auctions[lot]
+                result["lot"] = auction.summary(lot)
+                return result
+        else:
+            result = {"ok": True}
+
+        result["lot"] = summary = auction.summary(lot)
+        self._lot_updates[lot] = summary
+        self._watch_lot(lot)
+        # Entries and lots go out before the result, so the sender's
+        # ledger has the settled bid by the time it hears of it
+        self._flush()
+        return result
+
+    def lots(self):
+        return [auction.summary(lot) for lot, auction in self.auctions.items()]
+
+    def _watch_lot(self, lot):
+        # An open lot is looked at again when its bidding closes, and a closed
+        # one left unsettled for another timeout is cancelled. Any other lot
+        # is finished: its last summary is queued and it is dropped.
+        handle = self._lot_timers.pop(lot, None)
+        if handle is not None:
+            handle.cancel()
+        auction = self.auctions[lot]
+        if auction.status not in ("open", "closed"):
+            del self.auctions[lot]
+            return
+        deadline = auction.closes_at if auction.status == "open" else auction.closes_at + auction.timeout
+        delay = max(0, deadline - self.ledger.clock()) / 1000
+        self._lot_timers[lot] = asyncio.get_running_loop().call_later(delay, self._close_lot, lot)
+
+    def _close_lot(self, lot):
+        self._lot_timers.pop(lot, None)
+        auction = self.auctions.get(lot)
+        if auction is None:
+            return
+        status = auction.status
+        now = self.ledger.clock()
+        auction.expire(now)
+        if status == "closed" and now >= auction.closes_at + auction.timeout:
+            auction.status = "cancelled"
+        if auction.status != status:
+            self._lot_updates[lot] = auction.summary(lot)
+            self._schedule_flush()
+        self._watch_lot(lot)
+
+    def history(self, params):
+        """Query the history with ``parse_qs`` parameters; raises ``ValueError``."""
+        def number(name):
+            return int(params[name][0]) if name in params else None
+
+        card = params.get("card", [None])[0]
+        limit = number("limit")
+        return self.ledger.history.query(
+            card=None if card is None else self.ledger.card_index(card),
+            kind=params.get("type", [None])[0],
+            since=number("since"), until=number("until"), before=number("before"),
+            limit=min(MAX_HISTORY_PAGE, 20 if limit is None else max(limit, 1)))
+
+    def loans(self, params):
+        """The loan book for ``parse_qs`` parameters; raises ``ValueError``."""
+        ledger = self.ledger
+        if "loan" in params:
+            row = int(params["loan"][0])
+            if not 0 <= row < len(ledger.loan_card):
+                raise LedgerError("Unknown loan")
+            return {"loan": ledger.loan_summary(row), "schedule": ledger.loan_schedule(row)}
+        card = params.get("card", [None])[0]
+        settled = params.get("settled", ["0"])[0] not in ("", "0")
+        return {"loans": ledger.loan_book(None if card is None else ledger.card_index(card), settled)}
+
+    async def scrape(self, timeout=METRICS_TIMEOUT):
+        """Ask every subscribed terminal for its metrics."""
+        loop = asyncio.get_running_loop()
+        waiting = {}
+        for socket in list(self.subscribers):
+            future = waiting[socket] = loop.create_future()
+            self._scrapes.setdefault(socket, []).append(future)
+            socket.send_json({"type": "metrics"})
+        if waiting:
+            await asyncio.wait(waiting.values(), timeout=timeout)
+        terminals = []
+        for socket, future in waiting.items():
+            if future.done() and not future.cancelled():
+                terminals.append({"address": socket.address, "metrics": future.result()})
+            else:
+                future.cancel()
+        return terminals
+
+    def receive_metrics(self, socket, metrics):
+        """Pass a terminal's metrics to the scrapes waiting for them;
+        ``None`` once the terminal has disconnected."""
+        for future in self._scrapes.pop(socket, ()):
+            if future.done():
+                continue
+            if metrics is None:
+                future.cancel()
+            else:
+                future.set_result(metrics)
+
+    def _schedule_flush(self):
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+
+    def subscribe(self, socket):
+        # Deliver queued entries first; the new subscriber's state includes them
+        self._flush()
+        self.subscribers.add(socket)
+        socket.send_json(self.state())
+        if self.auctions:
+            socket.send_json({"type": "lots", "lots": self.lots()})
+
+    def _flush(self):
+        # One message per subscriber per loop pass, skipping its own entries
+        self._flush_scheduled = False
+        batches, self._outgoing = self._outgoing, []
+        lots, self._lot_updates = list(self._lot_updates.values()), {}
+        seq = self.seq
+        for socket in list(self.subscribers):
+            entries = [e for origin, batch in batches if origin is not socket for e in batch]
+            if entries:
+                socket.send_json({"type": "entries", "seq": seq, "entries": entries})
+            if lots:
+                socket.send_json({"type": "lots", "lots": lots})
+
+
+class LedgerServer:
+    """Registry of tables, each loaded lazily and journaled to ``data_dir``."""
+
+    def __init__(self, data_dir=None, cards=len(DEFAULT_CARDS)):
+        self.data_dir = data_dir
+        self.cards = cards
+        self.tables = {}
+        with open(PAGE_PATH, "rb") as f:
+            self.page = f.read()
+        self.assets = {}
+        for name, content_type in ASSETS.items():
+            with open(os.path.join(ROOT, name), "rb") as f:
+                self.assets[name] = (content_type, f.read())
+        content_type, script = self.assets["sw.js"]
+        self.assets["sw.js"] = (content_type, stamp_service_worker(script.decode(), self.page).encode())
+
+    def table(self, name):
+        table = self.tables.get(name)
+        if table is None:
+            table = self.tables[name] = self._load_table(name)
+        return table
+
+    def _load_table(self, name):
+        ledger = Ledger.with_cards(self.cards)
+        if self.data_dir is None:
+            return Table(name, ledger)
+
+        path = os.path.join(self.data_dir, name + ".jsonl")
+        seq = 0
+        torn = False
+        if os.path.exists(path):
+            with open(path) as f:
+                for number, line in enumerate(f, 1):
+                    torn = not line.endswith("\n")
+                    # Like the page's journal replay, a line that cannot be
+                    # applied is reported and the rest of the journal still is
+                    try:
+                        entry = json.loads(line)
+                        if not isinstance(entry, dict):
+                            raise LedgerError("Invalid entry")
+                        ledger.apply_entry(entry)
+                    except (ValueError, LedgerError) as e:
+                        print("%s:%d: skipping journal entry: %s" % (path, number, e), file=sys.stderr)
+                        continue
+                    seq += 1
+        journal = open(path, "a")
+        if torn:
+            # Start the next entry on a line of its own
+            journal.write("\n")
+        return Table(name, ledger, journal, seq)
+
+    def close(self):
+        for table in self.tables.values():
+            if table.journal is not None:
+                table.journal.close()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                url = urlsplit(target)
+                if headers.get("upgrade", "").lower() == "websocket":
+                    await self._websocket(url, headers, reader, writer)
+                    break
+                table = self._metrics_table(method, url.path)
+                if table is not None:
+                    # Answered by the terminals, so this one has to wait
+                    status, content_type = 200, "application/json"
+                    payload = json_bytes({"terminals": await table.scrape()})
+                else:
+                    status, content_type, payload = self._route(method, url.path, body, url.query)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                write_response(writer, status, content_type, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def _metrics_table(self, method, path):
+        parts = [p for p in path.split("/") if p]
+        if (method == "GET" and len(parts) == 3 and parts[0] == "tables" and parts[2] == "metrics"
+                and valid_table_name(parts[1])):
+            return self.table(parts[1])
+        return None
+
+    def _route(self, method, path, body, query=""):
+        parts = [p for p in path.split("/") if p]
+        if not parts:
+            if method != "GET":
+                return 405, "text/plain", b"Method not allowed"
+            return 200, "text/html; charset=utf-8", self.page
+        if len(parts) == 1 and parts[0] in self.assets:
+            if method != "GET":
+                return 405, "text/plain", b"Method not allowed"
+            content_type, payload = self.assets[parts[0]]
+            return 200, content_type, payload
+        if parts[0] != "tables" or len(parts) not in (2, 3) or not valid_table_name(parts[1]):
+            return 404, "text/plain", b"Not found"
+
+        table = self.table(parts[1])
+        if len(parts) == 2 and method == "GET":
+            return 200, "application/json", json_bytes(table.state()["snapshot"])
+        if len(parts) == 3 and parts[2] == "ops" and method == "POST":
+            try:
+                ops = json.loads(body)["ops"]
+            except (ValueError, KeyError, TypeError):
+                return 400, "text/plain", b"Expected {\"ops\": [...]}"
+            if not isinstance(ops, list):
+                return 400, "text/plain", b"Expected {\"ops\": [...]}"
+            return 200, "application/json", json_bytes(table.apply(ops))
+        if len(parts) == 3 and parts[2] == "cards" and method == "GET":
+            try:
+                at = parse_qs(query).get("at", [None])[0]
+                at = table.ledger.clock() if at is None else int(at)
+            except ValueError:
+                return 400, "text/plain", b"Expected ?at=<milliseconds>"
+            return 200, "application/json", json_bytes({"at": at, "cards": table.ledger.state_at(at)})
+        if len(parts) == 3 and parts[2] == "history" and method == "GET":
+            try:
+                records, next_row = table.history(parse_qs(query))
+            except (ValueError, LedgerError) as e:
+                return 400, "text/plain", str(e).encode("utf-8")
+            return 200, "application/json", json_bytes({"records": records, "next": next_row})
+        if len(parts) == 3 and parts[2] == "loans" and method == "GET":
+            try:
+                return 200, "application/json", json_bytes(table.loans(parse_qs(query)))
+            except (ValueError, LedgerError) as e:
+                return 400, "text/plain", str(e).encode("utf-8")
+        if len(parts) == 3 and parts[2] == "archive" and method == "GET":
+            return 200, "application/octet-stream", archive.dumps(table.ledger.snapshot(table.seq))
+        return 405, "text/plain", b"Method not allowed"
+
+    async def _websocket(self, url, headers, reader, writer):
+        name = parse_qs(url.query).get("table", [""])[0]
+        key = headers.get("sec-websocket-key")
+        if url.path != "/ws" or not key or not valid_table_name(name):
+            write_response(writer, 400, "text/plain", b"Bad WebSocket request", False)
+            return
+
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                      "Connection: Upgrade\r\nSec-WebSocket-Accept: %s\r\n\r\n" % accept).encode())
+        socket = WebSocket(reader, writer)
+        table = self.table(name)
+        try:
+            table.subscribe(socket)
+            while True:
+                message = await socket.receive()
+                if message is None:
+                    break
+                try:
+                    request = json.loads(message)
+                except ValueError:
+                    continue
+                kind = request.get("type") if isinstance(request, dict) else None
+                if kind == "ops" and isinstance(request.get("ops"), list):
+                    ack = table.apply(request["ops"], origin=socket)
+                    ack["id"] = request.get("id")
+                    socket.send_json(ack)
+                elif kind == "sync":
+                    socket.send_json(table.state())
+                elif kind == "auction" and isinstance(request.get("auction"), dict):
+                    result = table.auction(request["auction"])
+                    socket.send_json({"type": "auction", "id": request.get("id"), "result": result})
+                elif kind == "metrics" and isinstance(request.get("metrics"), dict):
+                    table.receive_metrics(socket, request["metrics"])
+                await writer.drain()
+        finally:
+            table.subscribers.discard(socket)
+            table.receive_metrics(socket, None)
+
+
+class WebSocket:
+    """Server side of an RFC 6455 connection: masked frames in, plain frames out."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.closed = False
+        peer = writer.get_extra_info("peername")
+        self.address = "%s:%d" % peer[:2] if peer else None
+
+    def send_json(self, message):
+        self.send(OP_TEXT, json_bytes(message))
+
+    def send(self, opcode, payload):
+        if self.closed or self.writer.is_closing():
+            return
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 1 << 16:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        self.writer.write(header + payload)
+
+    async def receive(self):
+        """Return the next text message, or ``None`` once the socket closes."""
+        fragments = []
+        while True:
+            head = await self.reader.readexactly(2)
+            fin = head[0] & 0x80
+            opcode = head[0] & 0x0F
+            length = head[1] & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", await self.reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", await self.reader.readexactly(8))[0]
+            if length > MAX_BODY:
+                raise ValueError("frame too large")
+            mask = await self.reader.readexactly(4) if head[1] & 0x80 else None
+            payload = await self.reader.readexactly(length)
+            if mask:
+                payload = unmask(payload, mask)
+
+            if opcode == OP_CLOSE:
+                self.send(OP_CLOSE, payload[:2])
+                self.closed = True
+                return None
+            if opcode == OP_PING:
+                self.send(OP_PONG, payload)
+                continue
+            if opcode == OP_PONG:
+                continue
+            fragments.append(payload)
+            if fin:
+                return b"".join(fragments).decode("utf-8")
+
+
+def unmask(payload, mask):
+    # XOR the whole payload at once through int arithmetic
+    repeated = (mask * (len(payload) // 4 + 1))[:len(payload)]
+    value = int.from_bytes(payload, "big") ^ int.from_bytes(repeated, "big")
+    return value.to_bytes(len(payload), "big")
+
+
+class ShardRouter:
+    """Front end spreading tables over several server processes.
+
+    Each table belongs to one worker, chosen by a hash of its name, so its
+    ledger and journal are only ever touched by that process. Requests are
+    forwarded as they arrive; a WebSocket upgrade is forwarded and the
+    connection is then spliced through to the worker.
+    """
+
+    def __init__(self, ports):
+        self.ports = ports
+
+    def port_for(self, name):
+        return self.ports[zlib.crc32(name.encode()) % len(self.ports)]
+
+    async def handle(self, reader, writer):
+        upstreams = {}  # port -> (reader, writer), kept for this connection
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                url = urlsplit(target)
+                port = self.port_for(table_name(url))
+                upstream = upstreams.get(port)
+                if upstream is None:
+                    upstream = upstreams[port] = await asyncio.open_connection("127.0.0.1", port)
+                up_reader, up_writer = upstream
+                up_writer.write(request_bytes(method, target, headers, body))
+
+                if headers.get("upgrade", "").lower() == "websocket":
+                    del upstreams[port]
+                    await asyncio.gather(splice(reader, up_writer), splice(up_reader, writer))
+                    break
+                head, response_headers, payload = await read_response(up_reader)
+                writer.write(head + payload)
+                await writer.drain()
+                if response_headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            for _, up_writer in upstreams.values():
+                up_writer.close()
+            writer.close()
+
+
+def table_name(url):
+    """The table a request is for: ``/tables/<name>/...`` or ``?table=``."""
+    parts = [p for p in url.path.split("/") if p]
+    if len(parts) >= 2 and parts[0] == "tables":
+        return parts[1]
+    return parse_qs(url.query).get("table", [""])[0]
+
+
+def request_bytes(method, target, headers, body):
+    lines = ["%s %s HTTP/1.1" % (method, target)]
+    lines.extend("%s: %s" % item for item in headers.items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+async def read_response(reader):
+    """Read one response from a worker: ``(head, headers, body)``."""
+    head = await reader.readuntil(b"\r\n\r\n")
+    headers = {}
+    for line in head.decode("latin-1").split("\r\n")[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    return head, headers, await reader.readexactly(length) if length else b""
+
+
+async def splice(reader, writer):
+    try:
+        while True:
+            data = await reader.read(1 << 16)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+def valid_table_name(name):
+    return 0 < len(name) <= 64 and all(c.isalnum() or c in "-_" for c in name)
+
+
+def positive_int(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+def json_bytes(value):
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+async def read_request(reader):
+    """Read one HTTP/1.1 request; ``None`` when the client closed the connection."""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if e.partial.strip():
+            raise ValueError("truncated request") from None
+        return None
+    except asyncio.LimitOverrunError:
+        raise ValueError("request head too large") from None
+
+    lines = head.decode("latin-1").split("\r\n")
+    method, target, _ = lines[0].split(" ", 2)
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY:
+        raise ValueError("request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method, target, headers, body
+
+
+def write_response(writer, status, content_type, payload, keep_alive=True):
+    writer.write(("HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n"
+                  "Connection: %s\r\n\r\n" % (
+                      status, STATUS_TEXT.get(status, ""), content_type, len(payload),
+                      "keep-alive" if keep_alive else "close")).encode() + payload)
+
+
+async def serve(host="127.0.0.1", port=8765, data_dir=None, cards=len(DEFAULT_CARDS), ready=None):
+    if data_dir is not None:
+        os.makedirs(data_dir, exist_ok=True)
+    ledger_server = LedgerServer(data_dir, cards)
+    server = await asyncio.start_server(ledger_server.handle, host, port)
+    if ready is not None:
+        ready(server.sockets[0].getsockname()[1])
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        ledger_server.close()
+
+
+def run_worker(connection, data_dir, cards):
+    """Entry point of a worker process: serve on a free local port and
+    send the port number back over ``connection``."""
+    try:
+        asyncio.run(serve("127.0.0.1", 0, data_dir, cards, ready=connection.send))
+    except KeyboardInterrupt:
+        pass
+
+
+async def serve_sharded(host="127.0.0.1", port=8765, data_dir=None, cards=len(DEFAULT_CARDS), workers=2):
+    """Serve through a :class:`ShardRouter` over ``workers`` processes."""
+    if data_dir is not None:
+        os.makedirs(data_dir, exist_ok=True)
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    ports = []
+    try:
+        for _ in range(workers):
+            parent, child = context.Pipe()
+            process = context.Process(target=run_worker, args=(child, data_dir, cards), daemon=True)
+            process.start()
+            processes.append(process)
+            ports.append(await asyncio.get_running_loop().run_in_executor(None, parent.recv))
+        server = await asyncio.start_server(ShardRouter(ports).handle, host, port)
+        async with server:
+            await server.serve_forever()
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--data-dir", help="directory for per-table journals (default: memory only)")
+    parser.add_argument("--cards", type=int, default=len(DEFAULT_CARDS),
+                        help="cards registered on a new table")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="spread tables over this many processes (default: serve in this one)")
+    args = parser.parse_args(argv)
+    print("Serving on http://%s:%d/?table=<name>" % (args.host, args.port))
+    try:
+        if args.workers > 0:
+            asyncio.run(serve_sharded(args.host, args.port, args.data_dir, args.cards, args.workers))
+        else:
+            asyncio.run(serve(args.host, args.port, args.data_dir, args.cards))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
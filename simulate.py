@@ -0,0 +1,184 @@
+"""Monte Carlo simulator for the loan and interest rules.
+
+Advances thousands of independent games at once as NumPy arrays of
+shape ``(games, cards)`` holding balances, unpaid loan principal and the
+per-card transaction counter that drives the repayment interest rate.
+Requires NumPy; the per-game rules are those of :mod:`ledger`.
+
+    python simulate.py --games 10000 --rounds 200 --step-rate 0 0.01 0.02
+
+Each round every active card, in order:
+
+* pays rent to another active card with probability ``p_rent``, borrowing
+  any shortfall as a loan;
+* places a bid with probability ``p_bid`` if it can afford it, which
+  increments its transaction counter;
+* takes a voluntary loan with probability ``p_loan``;
+* repays all open loans with probability ``p_repay``, if it has a
+  transaction on record and can afford principal plus interest.
+
+Within a phase all cards act simultaneously. A card whose balance no
+longer covers its principal plus the interest currently due is bankrupt
+and stops playing.
+"""
+
+import argparse
+import sys
+
+import numpy as np
+
+from ledger import DEFAULT_BALANCE
+
+
+class SimulationResult:
+    """Final per-card state of a batch of games."""
+
+    def __init__(self, balances, principal, interest_paid, bankrupt, bankrupt_round):
+        self.balances = balances
+        self.principal = principal
+        self.interest_paid = interest_paid
+        self.bankrupt = bankrupt
+        self.bankrupt_round = bankrupt_round
+
+    @property
+    def net_worth(self):
+        return self.balances - self.principal
+
+    def summary(self):
+        """Bankruptcy rates and wealth-distribution figures as a flat dict."""
+        net = self.net_worth[~self.bankrupt]
+        p10, p50, p90 = np.percentile(net, [10, 50, 90]) if net.size else (0, 0, 0)
+        first = self.bankrupt_round[self.bankrupt]
+        return {
+            "card_bankruptcy_rate": float(self.bankrupt.mean()),
+            "game_bankruptcy_rate": float(self.bankrupt.any(axis=1).mean()),
+            "mean_bankrupt_round": float(first.mean()) if first.size else None,
+            "net_worth_p10": float(p10),
+            "net_worth_p50": float(p50),
+            "net_worth_p90": float(p90),
+            "net_worth_gini": gini(net),
+            "mean_interest_paid": float(self.interest_paid.mean()),
+        }
+
+
+def gini(values):
+    """Gini coefficient of a 1-D array of non-negative values."""
+    values = np.sort(np.clip(values, 0, None).astype(np.float64))
+    total = values.sum()
+    if values.size == 0 or total == 0:
+        return 0.0
+    ranks = np.arange(1, values.size + 1)
+    return float((2 * (ranks * values).sum()) / (values.size * total) - (values.size + 1) / values.size)
+
+
+def interest_due(principal, transactions, base_rate=0.05, step_rate=0.01):
+    """Vectorised ``processRepayment`` interest, rounded half up.
+
+    Like the ledger, the interest is worked out in integers: the rates are
+    taken to the nearest basis point, so no fractional rate is rounded.
+    """
+    basis_points = round(base_rate * 10000) + np.maximum(transactions - 1, 0) * round(step_rate * 10000)
+    return (principal * basis_points + 5000) // 10000
+
+
+def simulate(games=1000, cards=4, rounds=100, *, base_rate=0.05, step_rate=0.01,
+             p_rent=0.5, rent=(10000, 200000), p_bid=0.1, bid=(10000, 150000),
+             p_loan=0.05, loan=(100000, 500000), p_repay=0.3, seed=None):
+    """Play ``games`` independent games of ``cards`` cards for ``rounds`` rounds.
+
+    Amount arguments are inclusive ``(low, high)`` ranges drawn uniformly.
+    """
+    if cards < 2:
+        raise ValueError("a game needs at least two cards")
+    rng = np.random.default_rng(seed)
+    shape = (games, cards)
+    game_rows = np.arange(games)[:, None]
+
+    balances = np.full(shape, DEFAULT_BALANCE, dtype=np.int64)
+    principal = np.zeros(shape, dtype=np.int64)
+    transactions = np.zeros(shape, dtype=np.int64)
+    interest_paid = np.zeros(shape, dtype=np.int64)
+    active = np.ones(shape, dtype=bool)
+    bankrupt_round = np.full(shape, -1, dtype=np.int64)
+
+    for round_no in range(rounds):
+        # Rent to a random other card; the shortfall becomes a loan
+        receivers = (np.arange(cards) + rng.integers(1, cards, size=shape)) % cards
+        amounts = rng.integers(rent[0], rent[1], size=shape, endpoint=True)
+        paying = active & (rng.random(shape) < p_rent) & active[game_rows, receivers]
+        amounts = np.where(paying, amounts, 0)
+        shortfall = np.maximum(amounts - balances, 0)
+        principal += shortfall
+        balances += shortfall - amounts
+        np.add.at(balances, (np.broadcast_to(game_rows, shape), receivers), amounts)
+
+        # Bids
+        amounts = rng.integers(bid[0], bid[1], size=shape, endpoint=True)
+        bidding = active & (rng.random(shape) < p_bid) & (amounts <= balances)
+        balances -= np.where(bidding, amounts, 0)
+        transactions += bidding
+
+        # Voluntary loans
+        amounts = rng.integers(loan[0], loan[1], size=shape, endpoint=True)
+        borrowing = active & (rng.random(shape) < p_loan)
+        amounts = np.where(borrowing, amounts, 0)
+        balances += amounts
+        principal += amounts
+
+        # Repayments
+        interest = interest_due(principal, transactions, base_rate, step_rate)
+        repaying = (active & (rng.random(shape) < p_repay) & (transactions > 0)
+                    & (principal > 0) & (principal + interest <= balances))
+        balances -= np.where(repaying, principal + interest, 0)
+        interest_paid += np.where(repaying, interest, 0)
+        principal[repaying] = 0
+        transactions[repaying] = 0
+
+        # Bankruptcy
+        interest = interest_due(principal, transactions, base_rate, step_rate)
+        failed = active & (balances < principal + interest)
+        bankrupt_round[failed] = round_no
+        active &= ~failed
+
+    return SimulationResult(balances, principal, interest_paid, ~active, bankrupt_round)
+
+
+def _amount_range(text):
+    low, _, high = text.partition(":")
+    return int(low), int(high or low)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--cards", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=100)
+    parser.add_argument("--base-rate", type=float, nargs="+", default=[0.05],
+                        help="base interest rate(s) to sweep")
+    parser.add_argument("--step-rate", type=float, nargs="+", default=[0.01],
+                        help="extra rate per transaction after the first, to sweep")
+    parser.add_argument("--p-rent", type=float, default=0.5)
+    parser.add_argument("--p-bid", type=float, default=0.1)
+    parser.add_argument("--p-loan", type=float, default=0.05)
+    parser.add_argument("--p-repay", type=float, default=0.3)
+    parser.add_argument("--rent", type=_amount_range, default=(10000, 200000), metavar="LOW:HIGH")
+    parser.add_argument("--bid", type=_amount_range, default=(10000, 150000), metavar="LOW:HIGH")
+    parser.add_argument("--loan", type=_amount_range, default=(100000, 500000), metavar="LOW:HIGH")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    for base_rate in args.base_rate:
+        for step_rate in args.step_rate:
+            result = simulate(
+                args.games, args.cards, args.rounds,
+                base_rate=base_rate, step_rate=step_rate,
+                p_rent=args.p_rent, rent=args.rent, p_bid=args.p_bid, bid=args.bid,
+                p_loan=args.p_loan, loan=args.loan, p_repay=args.p_repay, seed=args.seed)
+            print("base_rate=%g step_rate=%g" % (base_rate, step_rate))
+            for key, value in result.summary().items():
+                print("  %-22s %s" % (key, "-" if value is None else "%.4g" % value))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
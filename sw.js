@@ -0,0 +1,91 @@
+// Service worker for the Monopoly Transactor page.
+//
+// Precaches the page and its assets and serves them cache-first, so a
+// reload never waits on the network and works offline. Only the app shell
+// and the listed assets are cached; every other request, such as a
+// table's JSON from server.py, goes to the network. Everything lives in
+// a cache named after CACHE_VERSION, which server.py and build.py stamp
+// with a hash of the page; a new version installs alongside the old one
+// and the old cache is deleted on activation.
+
+const CACHE_VERSION = 'dev';
+const CACHE_NAME = `monopoly-transactor-${CACHE_VERSION}`;
+const PRECACHE_URLS = ['manifest.webmanifest', 'icon.svg'];
+// Cross-origin assets kept for offline use (the unbuilt page loads Tailwind)
+const CACHEABLE_ORIGINS = ['https://cdn.tailwindcss.com'];
+
+// The page at the worker's scope; the pages that registered the worker
+// are cached on install as well, and count as the shell from then on
+const SHELL_URLS = ['./', 'index.html'];
+
+const precached = new Set(PRECACHE_URLS.map(url => new URL(url, self.location).href));
+const shell = new Set(SHELL_URLS.map(url => new URL(url, self.location).href));
+
+self.addEventListener('install', event => {
+    event.waitUntil((async () => {
+        const cache = await caches.open(CACHE_NAME);
+        await cache.addAll(PRECACHE_URLS);
+        
+        // The page URL depends on how it is served, so cache whichever
+        // pages registered this worker
+        const windows = await self.clients.matchAll({ type: 'window', includeUncontrolled: true });
+        await Promise.all(windows.map(client => {
+            const url = new URL(client.url);
+            url.search = '';
+            url.hash = '';
+            return cache.add(url.href);
+        }));
+        await self.skipWaiting();
+    })());
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil((async () => {
+        const names = await caches.keys();
+        await Promise.all(names
+            .filter(name => name.startsWith('monopoly-transactor-') && name !== CACHE_NAME)
+            .map(name => caches.delete(name)));
+        await self.clients.claim();
+    })());
+});
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET') return;
+    
+    const url = new URL(request.url);
+    if (request.mode === 'navigate') {
+        event.respondWith(navigate(request));
+    } else if (precached.has(url.href) || CACHEABLE_ORIGINS.includes(url.origin)) {
+        event.respondWith(cacheFirst(request));
+    }
+});
+
+// ?table=<name> selects a ledger, not a different page, so the shell is
+// matched without its query
+async function navigate(request) {
+    const cache = await caches.open(CACHE_NAME);
+    const cached = await cache.match(request, { ignoreSearch: true });
+    if (cached) return cached;
+    
+    const key = new URL(request.url);
+    key.search = '';
+    key.hash = '';
+    const response = await fetch(request);
+    if (shell.has(key.href) && response.ok) {
+        cache.put(key.href, response.clone());
+    }
+    return response;
+}
+
+async function cacheFirst(request) {
+    const cache = await caches.open(CACHE_NAME);
+    const cached = await cache.match(request);
+    if (cached) return cached;
+    
+    const response = await fetch(request);
+    if (response.ok || response.type === 'opaque') {
+        cache.put(request.url, response.clone());
+    }
+    return response;
+}
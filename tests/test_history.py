@@ -0,0 +1,115 @@
+import pytest
+
+from ledger import CHECKPOINT_INTERVAL, DEFAULT_BALANCE, Ledger
+
+
+def make_ledger(cards=3):
+    return Ledger.with_cards(cards, clock=lambda: 0)
+
+
+def rows(records):
+    return [record["row"] for record in records]
+
+
+def test_every_money_operation_is_recorded():
+    ledger = make_ledger()
+    ledger.transfer(0, 1, 10, 100)
+    ledger.bid(1, 5, 200)
+    ledger.loan(2, 1000, 300)
+    assert ledger.history.record(0) == {"row": 0, "type": "transfer", "card": 0, "counterparty": 1,
+                                        "amount": 10, "timestamp": 100}
+    assert ledger.history.type == ["transfer", "bid", "loan"]
+    assert ledger.history.by_card[1] == [0, 1]
+
+
+def test_query_filters_newest_first():
+    ledger = make_ledger()
+    for timestamp in range(10):
+        ledger.transfer(timestamp % 3, (timestamp + 1) % 3, 1, timestamp * 10)
+    ledger.bid(0, 1, 100)
+    history = ledger.history
+    assert rows(history.query(card=0)[0]) == [10, 9, 8, 6, 5, 3, 2, 0]
+    assert rows(history.query(kind="bid")[0]) == [10]
+    assert rows(history.query(since=20, until=50)[0]) == [4, 3, 2]
+    assert rows(history.query(card=2, kind="transfer", since=30)[0]) == [8, 7, 5, 4]
+
+
+def test_query_pages_through_every_match():
+    ledger = make_ledger()
+    for timestamp in range(25):
+        ledger.transfer(0, 1, 1, timestamp)
+    history = ledger.history
+    first, after = history.query(card=0, limit=10)
+    second, last = history.query(card=0, limit=10, before=after)
+    third, end = history.query(card=0, limit=10, before=last)
+    assert rows(first + second + third) == list(range(24, -1, -1))
+    assert end is None
+
+
+def test_query_ends_on_the_page_holding_the_last_match():
+    ledger = make_ledger()
+    ledger.bid(0, 1, 1)
+    ledger.transfer(0, 1, 1, 2)
+    ledger.transfer(1, 2, 1, 3)
+    ledger.transfer(1, 2, 1, 4)
+    # Card 0's rows are walked, and the older one is not a transfer
+    records, after = ledger.history.query(card=0, kind="transfer", limit=1)
+    assert rows(records) == [1]
+    assert after is None
+
+
+def test_a_checkpoint_is_taken_every_interval():
+    ledger = make_ledger(2)
+    for timestamp in range(CHECKPOINT_INTERVAL * 2 + 5):
+        ledger.transfer(timestamp % 2, (timestamp + 1) % 2, 1, timestamp)
+    assert [c["row"] for c in ledger.checkpoints] == [CHECKPOINT_INTERVAL, CHECKPOINT_INTERVAL * 2]
+    assert ledger.checkpoints[0]["time"] == CHECKPOINT_INTERVAL - 1
+    assert ledger.checkpoints[0]["balances"] == [DEFAULT_BALANCE, DEFAULT_BALANCE]
+
+
+def replayed_state(entries, timestamp):
+    ledger = make_ledger()
+    for entry in entries:
+        if entry["timestamp"] <= timestamp:
+            ledger.apply_entry(entry)
+    return [(card["balance"], card["transactions"], card["principal"]) for card in ledger.state_at(timestamp)]
+
+
+def test_state_at_matches_a_replay_up_to_that_time():
+    entries = []
+    for timestamp in range(CHECKPOINT_INTERVAL * 3):
+        card = timestamp % 3
+        if timestamp % 50 == 7:
+            entries.append({"type": "loan", "card": card, "amount": 5000, "timestamp": timestamp})
+        elif timestamp % 5 == 0:
+            entries.append({"type": "bid", "card": card, "amount": 3, "timestamp": timestamp})
+        else:
+            entries.append({"type": "transfer", "from": card, "to": (card + 1) % 3,
+                            "amount": timestamp, "timestamp": timestamp})
+    ledger = make_ledger()
+    for entry in entries:
+        ledger.apply_entry(entry)
+    assert len(ledger.checkpoints) >= 2
+    for timestamp in (-1, 0, 100, CHECKPOINT_INTERVAL, CHECKPOINT_INTERVAL * 2 + 17, 10 ** 9):
+        state = [(card["balance"], card["transactions"], card["principal"]) for card in ledger.state_at(timestamp)]
+        assert state == replayed_state(entries, timestamp)
+
+
+def test_state_at_shows_cards_registered_since_at_their_opening_balance():
+    ledger = make_ledger(1)
+    ledger.register_card("card2")
+    ledger.bid(0, 10, 5)
+    state = ledger.state_at(5)
+    assert [card["id"] for card in state] == ["card1", "card2"]
+    assert [card["balance"] for card in state] == [DEFAULT_BALANCE - 10, DEFAULT_BALANCE]
+
+
+@pytest.mark.parametrize("count", [0, 10, CHECKPOINT_INTERVAL + 1])
+def test_snapshots_restore_history_and_checkpoints(count):
+    ledger = make_ledger()
+    for timestamp in range(count):
+        ledger.transfer(timestamp % 3, (timestamp + 2) % 3, 2, timestamp)
+    restored = Ledger.from_snapshot(ledger.snapshot(), clock=lambda: 0)
+    assert restored.snapshot() == ledger.snapshot()
+    assert restored.state_at(count // 2) == ledger.state_at(count // 2)
+    assert restored.history.query(card=1) == ledger.history.query(card=1)
@@ -0,0 +1,333 @@
+import pytest
+
+from ledger import (DEFAULT_BALANCE, MAX_MONEY, ConflictError, Ledger, LedgerError,
+                    format_amount, interest_percent, percent_of)
+
+
+def make_ledger(cards=2):
+    return Ledger.with_cards(cards, clock=lambda: 0)
+
+
+def transfer(sender, receiver, amount, **fields):
+    return dict({"type": "transfer", "from": sender, "to": receiver, "amount": amount, "timestamp": 1}, **fields)
+
+
+def test_cards_are_registered_in_order():
+    ledger = make_ledger(3)
+    assert ledger.ids == ["card1", "card2", "card3"]
+    assert ledger.labels == ["Card 1", "Card 2", "Card 3"]
+    assert ledger.register_card("card2") == 1
+    assert ledger.register_card("tag", "Banker") == 3
+    assert ledger.balances == [DEFAULT_BALANCE] * 4
+
+
+def test_transfer_and_bid():
+    ledger = make_ledger()
+    ledger.transfer(0, 1, 500)
+    ledger.bid(1, 200)
+    assert ledger.balances == [DEFAULT_BALANCE - 500, DEFAULT_BALANCE + 300]
+    assert ledger.transactions == [0, 1]
+
+
+def test_operations_reject_what_the_page_rejects():
+    ledger = make_ledger()
+    with pytest.raises(LedgerError, match="same card"):
+        ledger.transfer(0, 0, 1)
+    with pytest.raises(LedgerError, match="Insufficient funds"):
+        ledger.transfer(0, 1, DEFAULT_BALANCE + 1)
+    with pytest.raises(LedgerError, match="Insufficient funds"):
+        ledger.bid(0, DEFAULT_BALANCE + 1)
+    with pytest.raises(LedgerError, match="No loans to repay"):
+        ledger.repay(0)
+    ledger.bid(0, 1)
+    with pytest.raises(LedgerError, match="No unpaid loans found"):
+        ledger.repay(0)
+    assert ledger.balances == [DEFAULT_BALANCE - 1, DEFAULT_BALANCE]
+
+
+def test_loans_keep_a_running_unpaid_principal():
+    ledger = make_ledger()
+    ledger.loan(0, 1000, 1)
+    ledger.loan(0, 500, 2)
+    ledger.loan(1, 300, 3)
+    assert ledger.unpaid_principal == [1500, 300]
+    assert ledger.open_loans == [[0, 1], [2]]
+    assert ledger.settled_loans == [[], []]
+
+
+def test_repay_settles_every_open_loan_with_interest():
+    ledger = make_ledger()
+    ledger.loan(0, 1000, 1)
+    ledger.loan(0, 500, 2)
+    for timestamp in range(3):
+        ledger.bid(0, 10, timestamp)
+    # 5% plus 1% per transaction after the first
+    assert ledger.repayment_due(0) == (1500 + 105, 105)
+    assert ledger.repay(0, 9) == (1605, 105)
+    assert ledger.balances[0] == DEFAULT_BALANCE + 1500 - 30 - 1605
+    assert ledger.unpaid_principal[0] == 0
+    assert ledger.transactions[0] == 0
+    assert ledger.open_loans[0] == []
+    assert ledger.settled_loans[0] == [0, 1]
+    assert ledger.loan_paid == [True, True]
+    assert ledger.loan_repaid_timestamp == [9, 9]
+
+
+def test_repay_needs_the_whole_amount():
+    ledger = make_ledger()
+    ledger.loan(0, 1000, 1)
+    ledger.bid(0, DEFAULT_BALANCE + 1000 - 10)
+    with pytest.raises(LedgerError, match="Insufficient funds"):
+        ledger.repay(0)
+    assert ledger.unpaid_principal[0] == 1000
+
+
+def test_repay_on_default_terms_charges_interest_once():
+    ledger = make_ledger()
+    ledger.loan(0, 50000, 1)
+    ledger.loan(0, 33333, 1)
+    for timestamp in range(7):
+        ledger.bid(0, 10, timestamp)
+    # 5% plus 6% on the principal of both loans, rounded once
+    assert ledger.repayment_due(0) == (92500, 9167)
+
+
+def test_apply_entry_applies_a_transfer():
+    ledger = make_ledger()
+    ledger.apply_entry(transfer(0, 1, 250))
+    assert ledger.balances == [DEFAULT_BALANCE - 250, DEFAULT_BALANCE + 250]
+    assert ledger.versions == [1, 1]
+    assert ledger.history.type == ["transfer"]
+
+
+def test_apply_entry_accepts_card_ids():
+    ledger = make_ledger()
+    ledger.apply_entry(transfer("card2", "card1", 5))
+    assert ledger.balances == [DEFAULT_BALANCE + 5, DEFAULT_BALANCE - 5]
+
+
+def test_apply_entry_registers_cards():
+    ledger = make_ledger()
+    ledger.apply_entry({"type": "register", "id": "04A25B1C", "label": "Banker"})
+    ledger.apply_entry({"type": "register", "id": "04A25B1C"})
+    assert ledger.ids == ["card1", "card2", "04A25B1C"]
+    assert ledger.labels[2] == "Banker"
+
+
+@pytest.mark.parametrize("entry", [
+    transfer(0, 1, DEFAULT_BALANCE + 1),
+    transfer(0, 0, 1),
+    transfer(0, 1, 0),
+    transfer(0, 1, -5),
+    transfer(0, 1, 1.5),
+    transfer(0, 1, True),
+    transfer(0, 1, MAX_MONEY + 1),
+    transfer(0, 1, 5, timestamp="x"),
+    transfer(0, 1, 5, timestamp=1.5),
+    transfer(0, 1, 5, timestamp=True),
+    {"type": "bid", "card": 0, "amount": DEFAULT_BALANCE + 1},
+    {"type": "loan", "card": 0, "amount": 5, "timestamp": "x"},
+    {"type": "repay", "card": 0, "amount": 1},
+    {"type": "installment", "card": 0, "loan": 0, "principal": 1, "interest": 0, "amount": 1},
+    {"type": "mortgage", "card": 0, "amount": 1},
+    {"type": "register", "id": ""},
+    {"type": "register", "id": 7},
+    {"type": "register", "id": "tag", "label": 7},
+    {"type": "batch", "transfers": [{"from": None, "to": 0, "amount": 5}, {"from": 1, "to": 0, "amount": DEFAULT_BALANCE + 1}]},
+    {"type": "batch", "timestamp": "x", "transfers": [{"from": None, "to": 0, "amount": 5}]},
+    {"type": "batch", "transfers": [{"from": None, "to": 0, "amount": 5}, {"from": [1], "to": 0, "amount": 1}]},
+])
+def test_apply_entry_rejects_invalid_entries_without_changing_anything(entry):
+    ledger = make_ledger()
+    before = ledger.snapshot()
+    with pytest.raises(LedgerError):
+        ledger.apply_entry(entry)
+    assert ledger.snapshot() == before
+
+
+@pytest.mark.parametrize("card", [2, 5, -1, True, 1.0, [1], {"id": 1}, "card9"])
+def test_apply_entry_rejects_unknown_cards(card):
+    ledger = make_ledger()
+    before = ledger.snapshot()
+    for entry in (transfer(0, card, 1), transfer(card, 0, 1),
+                  {"type": "bid", "card": card, "amount": 1},
+                  {"type": "loan", "card": card, "amount": 1},
+                  {"type": "batch", "transfers": [{"from": None, "to": card, "amount": 1}]}):
+        with pytest.raises(LedgerError, match="Unknown card"):
+            ledger.apply_entry(entry)
+    assert ledger.snapshot() == before
+
+
+def test_apply_entry_checks_repayments_against_the_ledger():
+    ledger = make_ledger()
+    ledger.apply_entry({"type": "loan", "card": 0, "amount": 1000, "timestamp": 1})
+    with pytest.raises(LedgerError, match="No loans to repay"):
+        ledger.apply_entry({"type": "repay", "card": 0, "amount": 1050, "timestamp": 2})
+    ledger.apply_entry({"type": "bid", "card": 0, "amount": 10, "timestamp": 2})
+    with pytest.raises(LedgerError, match="does not match"):
+        ledger.apply_entry({"type": "repay", "card": 0, "amount": 1000, "timestamp": 3})
+    ledger.apply_entry({"type": "repay", "card": 0, "amount": 1050, "timestamp": 3})
+    with pytest.raises(LedgerError, match="No loans to repay"):
+        ledger.apply_entry({"type": "repay", "card": 0, "amount": 1050, "timestamp": 4})
+    assert ledger.balances[0] == DEFAULT_BALANCE - 60
+
+
+def test_apply_entry_checks_the_debited_card_version():
+    ledger = make_ledger()
+    ledger.apply_entry(transfer(0, 1, 10, version=0))
+    with pytest.raises(ConflictError):
+        ledger.apply_entry(transfer(0, 1, 10, version=0))
+    ledger.apply_entry(transfer(0, 1, 10, version=1))
+    # Credits commute, so the receiver's version is never checked
+    ledger.apply_entry(transfer(1, 0, 10, version=2))
+    assert ledger.balances == [DEFAULT_BALANCE - 10, DEFAULT_BALANCE + 10]
+
+
+def test_versions_count_the_operations_on_a_card():
+    ledger = make_ledger()
+    ledger.transfer(0, 1, 10)
+    ledger.bid(1, 5)
+    ledger.loan(1, 100)
+    assert ledger.versions == [1, 3]
+
+
+def test_conflicts_are_ledger_errors():
+    assert issubclass(ConflictError, LedgerError)
+
+
+@pytest.mark.parametrize("amount, text", [
+    (0, "$0"),
+    (999, "$999"),
+    (1000, "$1K"),
+    (1500, "$1.50K"),
+    (1005, "$1.01K"),
+    (1004, "$1K"),
+    (999999, "$1000K"),
+    (1500000, "$1.50M"),
+    (1234567, "$1.23M"),
+    (MAX_MONEY, "$9007199254.74M"),
+])
+def test_format_amount(amount, text):
+    assert format_amount(amount) == text
+
+
+def test_percentages_are_exact_and_round_half_up():
+    assert percent_of(1000, 5) == 50
+    assert percent_of(10, 5) == 1  # 0.5 rounds up
+    assert percent_of(9, 5) == 0
+    assert percent_of(MAX_MONEY, 100) == MAX_MONEY
+    assert interest_percent(0) == interest_percent(1) == 5
+    assert interest_percent(4, rate=10) == 13
+
+
+def test_balances_stay_below_max_money():
+    ledger = make_ledger()
+    ledger.loan(0, MAX_MONEY - DEFAULT_BALANCE)
+    with pytest.raises(LedgerError, match="Balance too large"):
+        ledger.loan(0, 1)
+    with pytest.raises(LedgerError, match="Balance too large"):
+        ledger.transfer(1, 0, 1)
+    assert ledger.balances == [MAX_MONEY, DEFAULT_BALANCE]
+
+
+def test_batch_applies_every_transfer():
+    ledger = make_ledger(3)
+    ledger.apply_entry({"type": "batch", "timestamp": 1, "transfers": [
+        {"from": None, "to": 0, "amount": 200},
+        {"from": 1, "to": None, "amount": 50},
+        {"from": 2, "to": 0, "amount": 1},
+    ]})
+    assert ledger.balances == [DEFAULT_BALANCE + 201, DEFAULT_BALANCE - 50, DEFAULT_BALANCE - 1]
+    assert ledger.history.type == ["payout", "charge", "transfer"]
+
+
+def test_batch_checks_each_transfer_against_the_ones_before_it():
+    ledger = make_ledger(2)
+    ledger.batch([(None, 0, 100), (0, 1, DEFAULT_BALANCE + 100)])
+    assert ledger.balances == [0, 2 * DEFAULT_BALANCE + 100]
+    with pytest.raises(LedgerError, match="Insufficient funds"):
+        ledger.batch([(1, 0, DEFAULT_BALANCE), (1, None, DEFAULT_BALANCE + 101)])
+    with pytest.raises(LedgerError, match="Empty batch"):
+        ledger.batch([])
+
+
+def test_installments_pay_interest_on_the_outstanding_principal():
+    ledger = make_ledger()
+    row = ledger.loan(0, 1000, 1, rate=10, installments=2)
+    assert [(due["principal"], due["interest"]) for due in ledger.loan_schedule(row)] == [(500, 100), (500, 50)]
+    assert ledger.pay_installment(row, 2) == (500, 100)
+    assert ledger.outstanding_principal(row) == 500
+    assert ledger.pay_installment(row, 3) == (500, 50)
+    assert ledger.loan_paid[row]
+    assert ledger.open_loans[0] == []
+    assert ledger.unpaid_principal[0] == 0
+    assert ledger.balances[0] == DEFAULT_BALANCE - 150
+    with pytest.raises(LedgerError, match="No unpaid loans found"):
+        ledger.pay_installment(row, 4)
+
+
+def test_the_last_installment_takes_what_division_leaves():
+    ledger = make_ledger()
+    row = ledger.loan(0, 1001, 1, rate=0, installments=3)
+    assert [due["principal"] for due in ledger.loan_schedule(row)] == [333, 333, 335]
+
+
+def test_installment_interest_follows_the_transaction_counter():
+    ledger = make_ledger()
+    row = ledger.loan(0, 1000, 1, rate=10, installments=2)
+    ledger.bid(0, 1, 2)
+    ledger.bid(0, 1, 3)
+    # 10% plus 1% per transaction after the first
+    assert ledger.next_installment(row) == (500, 110)
+
+
+def test_loan_terms_are_checked():
+    ledger = make_ledger()
+    for rate, installments in ((-1, 1), (101, 1), (5, 0), (5, 53), (5, True), ("5", 1)):
+        with pytest.raises(LedgerError, match="Invalid"):
+            ledger.loan(0, 1000, 1, rate=rate, installments=installments)
+    with pytest.raises(LedgerError, match="installments"):
+        ledger.loan(0, 3, 1, installments=4)
+    assert ledger.loan_card == []
+
+
+def test_repay_clears_loans_paid_in_part():
+    ledger = make_ledger()
+    row = ledger.loan(0, 1000, 1, rate=10, installments=4)
+    ledger.loan(0, 100, 1)
+    ledger.pay_installment(row, 2)
+    ledger.bid(0, 1, 3)
+    # 750 outstanding at 10% and 100 at 5%
+    assert ledger.repayment_due(0) == (850 + 75 + 5, 80)
+    ledger.repay(0, 4)
+    assert ledger.loan_paid == [True, True]
+    assert ledger.loan_book(0) == []
+
+
+def test_apply_entry_checks_installment_amounts():
+    ledger = make_ledger()
+    row = ledger.loan(0, 1000, 1, rate=10, installments=2)
+    entry = {"type": "installment", "card": 0, "loan": row, "timestamp": 2,
+             "principal": 500, "interest": 50, "amount": 550}
+    with pytest.raises(LedgerError, match="does not match"):
+        ledger.apply_entry(entry)
+    with pytest.raises(LedgerError, match="No unpaid loans found"):
+        ledger.apply_entry(dict(entry, card=1))
+    entry.update(interest=100, amount=600)
+    ledger.apply_entry(entry)
+    assert ledger.loan_paid_installments[row] == 1
+    assert ledger.history.type[-2:] == ["installment", "interest"]
+
+
+def test_loan_book_summaries():
+    ledger = make_ledger()
+    first = ledger.loan(0, 1000, 1, rate=10, installments=2)
+    second = ledger.loan(1, 200, 2)
+    ledger.pay_installment(first, 3)
+    summary = ledger.loan_summary(first)
+    assert summary["outstanding"] == 500
+    assert summary["paidInstallments"] == 1
+    assert summary["interest"] == 50
+    assert summary["next"] == {"principal": 500, "interest": 50, "amount": 550}
+    assert [loan["loan"] for loan in ledger.loan_book()] == [first, second]
+    assert [loan["loan"] for loan in ledger.loan_book(1)] == [second]
@@ -0,0 +1,299 @@
+import asyncio
+import json
+
+import archive
+from ledger import DEFAULT_BALANCE, Ledger
+from server import MAX_BATCH, LedgerServer, ShardRouter, Table, read_response, request_bytes
+
+
+class FakeSocket:
+    def __init__(self, address=None):
+        self.address = address
+        self.sent = []
+
+    def send_json(self, message):
+        self.sent.append(message)
+
+
+def make_table(journal=None, clock=lambda: 0):
+    return Table("test", Ledger.with_cards(3, clock=clock), journal)
+
+
+def run(function):
+    """Call ``function`` inside a running loop, then let its flush run."""
+    async def main():
+        result = function()
+        await asyncio.sleep(0)
+        return result
+    return asyncio.run(main())
+
+
+def transfer(sender, receiver, amount, **fields):
+    return dict({"type": "transfer", "from": sender, "to": receiver, "amount": amount, "timestamp": 1}, **fields)
+
+
+def test_apply_acks_every_entry_and_reports_each_rejection():
+    table = make_table()
+    ack = run(lambda: table.apply([
+        transfer(0, 1, 10, version=0),
+        transfer(0, 1, 10, version=0),
+        transfer(0, 7, 10),
+        "not an entry",
+        transfer(1, 2, 5),
+    ]))
+    assert ack["type"] == "ack"
+    assert ack["seq"] == 2
+    assert ack["applied"] == 2
+    assert [r["index"] for r in ack["rejected"]] == [1, 2, 3]
+    assert [r["conflict"] for r in ack["rejected"]] == [True, False, False]
+    assert all(set(r) == {"index", "error", "conflict"} for r in ack["rejected"])
+    assert table.ledger.balances == [DEFAULT_BALANCE - 10, DEFAULT_BALANCE + 5, DEFAULT_BALANCE + 5]
+
+
+def test_apply_rejects_what_does_not_fit_in_a_batch():
+    table = make_table()
+    ops = [transfer(0, 1, 1) for _ in range(MAX_BATCH + 2)]
+    ack = run(lambda: table.apply(ops))
+    assert ack["applied"] == MAX_BATCH
+    assert ack["rejected"] == [
+        {"index": MAX_BATCH, "error": "Batch too large", "conflict": False},
+        {"index": MAX_BATCH + 1, "error": "Batch too large", "conflict": False},
+    ]
+    assert table.ledger.balances[0] == DEFAULT_BALANCE - MAX_BATCH
+
+
+def test_apply_stamps_entries_without_a_timestamp():
+    table = make_table(clock=lambda: 1234)
+    run(lambda: table.apply([{"type": "bid", "card": 0, "amount": 1}]))
+    assert table.ledger.history.timestamp == [1234]
+
+
+def test_apply_sends_entries_to_every_other_subscriber():
+    table = make_table()
+    sender, other = FakeSocket(), FakeSocket()
+    table.subscribe(sender)
+    table.subscribe(other)
+    run(lambda: table.apply([transfer(0, 1, 10)], origin=sender))
+    assert [m["type"] for m in sender.sent] == ["state"]
+    assert other.sent[-1] == {"type": "entries", "seq": 1, "entries": [transfer(0, 1, 10)]}
+
+
+def test_apply_journals_only_applied_entries(tmp_path):
+    path = tmp_path / "test.jsonl"
+    with open(path, "a") as journal:
+        table = make_table(journal)
+        run(lambda: table.apply([transfer(0, 1, 10), transfer(0, 1, DEFAULT_BALANCE + 1)]))
+    assert [json.loads(line) for line in path.read_text().splitlines()] == [transfer(0, 1, 10)]
+
+
+def test_a_malformed_entry_leaves_the_ledger_journal_and_seq_in_step(tmp_path):
+    path = tmp_path / "test.jsonl"
+    with open(path, "a") as journal:
+        table = make_table(journal)
+        ack = run(lambda: table.apply([
+            transfer(0, 1, 5),
+            transfer([1], 0, 5),
+            transfer(0, 1, 5, timestamp="x"),
+            {"type": "batch", "transfers": [{"from": None, "to": 0, "amount": 7}, {"from": {}, "to": 1, "amount": 1}]},
+            {"type": "register", "id": "tag", "label": ["x"]},
+            transfer(1, 2, 3),
+        ]))
+    assert ack["applied"] == 2
+    assert [r["index"] for r in ack["rejected"]] == [1, 2, 3, 4]
+    assert table.seq == 2
+    replayed = Ledger.with_cards(3)
+    for line in path.read_text().splitlines():
+        replayed.apply_entry(json.loads(line))
+    assert replayed.balances == table.ledger.balances == [DEFAULT_BALANCE - 5, DEFAULT_BALANCE + 2, DEFAULT_BALANCE + 3]
+    assert len(table.ledger.ids) == 3
+
+
+def test_tables_are_rebuilt_from_their_journals(tmp_path):
+    server = LedgerServer(data_dir=str(tmp_path), cards=3)
+    try:
+        run(lambda: server.table("game").apply([transfer(0, 1, 10), {"type": "bid", "card": 2, "amount": 4}]))
+    finally:
+        server.close()
+    server = LedgerServer(data_dir=str(tmp_path), cards=3)
+    try:
+        table = server.table("game")
+        assert table.seq == 2
+        assert table.ledger.balances == [DEFAULT_BALANCE - 10, DEFAULT_BALANCE + 10, DEFAULT_BALANCE - 4]
+    finally:
+        server.close()
+
+
+def test_load_table_skips_entries_it_cannot_apply(tmp_path, capsys):
+    lines = [json.dumps(transfer(0, 1, 10)), "{torn", json.dumps(transfer(0, 9, 1)), "[]",
+             json.dumps(transfer(1, 0, 4))]
+    (tmp_path / "test.jsonl").write_text("\n".join(lines))
+    server = LedgerServer(data_dir=str(tmp_path), cards=3)
+    try:
+        table = server.table("test")
+        assert table.seq == 2
+        assert table.ledger.balances == [DEFAULT_BALANCE - 6, DEFAULT_BALANCE + 6, DEFAULT_BALANCE]
+        errors = capsys.readouterr().err.splitlines()
+        prefix = str(tmp_path / "test.jsonl") + ":"
+        assert [e[len(prefix):].split(":")[0] for e in errors] == ["2", "3", "4"]
+        run(lambda: table.apply([transfer(2, 0, 1)]))
+    finally:
+        server.close()
+    # The unterminated last line was closed before appending
+    last = (tmp_path / "test.jsonl").read_text().splitlines()[-2:]
+    assert [json.loads(line) for line in last] == [transfer(1, 0, 4), transfer(2, 0, 1)]
+
+
+def test_routes():
+    server = LedgerServer(cards=2)
+    body = json.dumps({"ops": [transfer(0, 1, 3)]})
+    status, content_type, payload = run(lambda: server._route("POST", "/tables/game/ops", body))
+    assert (status, content_type) == (200, "application/json")
+    assert json.loads(payload)["applied"] == 1
+    status, _, payload = server._route("GET", "/tables/game", b"")
+    assert json.loads(payload)["balances"] == [DEFAULT_BALANCE - 3, DEFAULT_BALANCE + 3]
+    assert server._route("POST", "/tables/game/ops", b"[]")[0] == 400
+    assert server._route("GET", "/tables/bad name", b"")[0] == 404
+    assert server._route("DELETE", "/tables/game", b"")[0] == 405
+    assert server._route("GET", "/", b"")[1].startswith("text/html")
+
+
+def test_archive_route_keeps_the_table_seq():
+    server = LedgerServer(cards=2)
+    run(lambda: server.table("game").apply([transfer(0, 1, 3), transfer(1, 0, 1)]))
+    status, content_type, payload = server._route("GET", "/tables/game/archive", b"")
+    assert (status, content_type) == (200, "application/octet-stream")
+    snapshot = archive.loads(payload)
+    assert snapshot["seq"] == 2
+    assert snapshot == server.table("game").state()["snapshot"]
+
+
+def test_shard_router_keeps_each_table_on_one_worker():
+    async def request(port, method, target, body=b""):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        headers = {"Host": "test", "Content-Length": str(len(body)), "Connection": "close"}
+        writer.write(request_bytes(method, target, headers, body))
+        _, _, payload = await read_response(reader)
+        writer.close()
+        return json.loads(payload)
+
+    async def main():
+        workers = [LedgerServer(cards=2), LedgerServer(cards=2)]
+        servers = [await asyncio.start_server(w.handle, "127.0.0.1", 0) for w in workers]
+        router = ShardRouter([s.sockets[0].getsockname()[1] for s in servers])
+        front = await asyncio.start_server(router.handle, "127.0.0.1", 0)
+        port = front.sockets[0].getsockname()[1]
+        names = ["table%d" % n for n in range(8)]
+        try:
+            for amount, name in enumerate(names, 1):
+                body = json.dumps({"ops": [transfer(0, 1, amount)]}).encode()
+                assert (await request(port, "POST", "/tables/%s/ops" % name, body))["applied"] == 1
+            balances = [(await request(port, "GET", "/tables/%s" % name))["balances"] for name in names]
+        finally:
+            for s in servers + [front]:
+                s.close()
+        return workers, router, names, balances
+
+    workers, router, names, balances = asyncio.run(main())
+    assert balances == [[DEFAULT_BALANCE - n, DEFAULT_BALANCE + n] for n in range(1, 9)]
+    for name in names:
+        owner = router.ports.index(router.port_for(name))
+        assert name in workers[owner].tables
+        assert name not in workers[1 - owner].tables
+    assert all(worker.tables for worker in workers)
+
+
+def test_auction_is_settled_by_its_leader():
+    table = make_table()
+    watcher = FakeSocket()
+    table.subscribe(watcher)
+
+    async def main():
+        opened = table.auction({"action": "open", "base": 100, "card": 0})
+        raised = table.auction({"action": "raise", "lot": opened["lot"]["lot"], "card": 1, "increment": 50})
+        refused = table.auction({"action": "settle", "lot": opened["lot"]["lot"], "card": 0})
+        settled = table.auction({"action": "settle", "lot": opened["lot"]["lot"], "card": 1})
+        return opened, raised, refused, settled
+    opened, raised, refused, settled = asyncio.run(main())
+
+    assert opened["ok"] and opened["lot"]["leader"] == 0
+    assert raised["ok"] and raised["lot"]["price"] == 150
+    assert refused == {"ok": False, "reason": "not_winner", "lot": raised["lot"]}
+    assert settled["ok"] and settled["lot"]["status"] == "sold"
+    assert table.ledger.balances[1] == DEFAULT_BALANCE - 150
+    assert table.auctions == {}
+    assert {"type": "entries", "seq": 1, "entries": [
+        {"type": "bid", "card": 1, "amount": 150, "timestamp": 0}]} in watcher.sent
+    assert watcher.sent[-1] == {"type": "lots", "lots": [settled["lot"]]}
+
+
+def test_auction_rejects_bad_requests():
+    table = make_table()
+
+    async def main():
+        return (table.auction({"action": "open", "base": 0}),
+                table.auction({"action": "open", "base": 100, "card": 9}),
+                table.auction({"action": "raise", "lot": 1, "card": 0, "increment": 5}))
+    bad_base, bad_card, no_lot = asyncio.run(main())
+    assert bad_base == {"ok": False, "reason": "error"}
+    assert bad_card["reason"] == "unknown_card"
+    assert no_lot == {"ok": False, "reason": "no_lot"}
+    assert table.auctions == {}
+
+
+def test_finished_lots_are_dropped():
+    now = [0]
+    table = make_table(clock=lambda: now[0])
+    watcher = FakeSocket()
+    table.subscribe(watcher)
+
+    async def main():
+        unsold = table.auction({"action": "open", "base": 100, "timeout": 10})["lot"]["lot"]
+        unpaid = table.auction({"action": "open", "base": 100, "timeout": 10, "card": 0})["lot"]["lot"]
+        now[0] = 10
+        await asyncio.sleep(0.02)
+        closed = set(table.auctions)
+        now[0] = 20
+        await asyncio.sleep(0.02)
+        return unsold, unpaid, closed
+    unsold, unpaid, closed = asyncio.run(main())
+
+    # Unsold at once; a closed lot its winner never settles is cancelled
+    assert closed == {unpaid}
+    assert table.auctions == {}
+    assert table._lot_timers == {}
+    statuses = [(lot["lot"], lot["status"]) for m in watcher.sent if m["type"] == "lots" for lot in m["lots"]]
+    assert (unsold, "unsold") in statuses
+    assert statuses[-1] == (unpaid, "cancelled")
+    late = FakeSocket()
+    table.subscribe(late)
+    assert [m["type"] for m in late.sent] == ["state"]
+
+
+def test_scrape_collects_the_terminals_that_answer():
+    table = make_table()
+    answering, silent = FakeSocket("10.0.0.1:5000"), FakeSocket("10.0.0.2:5000")
+    table.subscribe(answering)
+    table.subscribe(silent)
+
+    async def main():
+        scrape = asyncio.ensure_future(table.scrape(timeout=0.05))
+        await asyncio.sleep(0)
+        table.receive_metrics(answering, {"render": {"count": 3}})
+        return await scrape
+    terminals = asyncio.run(main())
+    assert terminals == [{"address": "10.0.0.1:5000", "metrics": {"render": {"count": 3}}}]
+    assert {"type": "metrics"} in silent.sent
+
+
+def test_scrape_leaves_out_terminals_that_disconnect():
+    table = make_table()
+    socket = FakeSocket("10.0.0.1:5000")
+    table.subscribe(socket)
+
+    async def main():
+        scrape = asyncio.ensure_future(table.scrape(timeout=5))
+        await asyncio.sleep(0)
+        table.subscribers.discard(socket)
+        table.receive_metrics(socket, None)
+        return await scrape
+    assert asyncio.run(main()) == []
@@ -0,0 +1,62 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import simulate
+from ledger import DEFAULT_BALANCE, interest_percent, percent_of
+
+
+def test_interest_due_matches_the_ledger():
+    principal = np.array([0, 1000, 10, 9, 123457, 50000])
+    transactions = np.array([0, 1, 1, 1, 4, 7])
+    expected = [percent_of(int(p), interest_percent(int(t))) for p, t in zip(principal, transactions)]
+    assert simulate.interest_due(principal, transactions).tolist() == expected
+
+
+def test_rates_are_taken_to_the_basis_point():
+    assert simulate.interest_due(np.array([10000]), np.array([3]), 0.0525, 0.0025).tolist() == [575]
+
+
+def test_games_are_reproducible_from_a_seed():
+    first = simulate.simulate(50, 3, 40, seed=7)
+    second = simulate.simulate(50, 3, 40, seed=7)
+    assert (first.balances == second.balances).all()
+    assert first.summary() == second.summary()
+
+
+def test_rent_and_loans_keep_net_worth():
+    # Without bids or repayments money only moves between cards or is
+    # borrowed, so every game keeps its opening net worth
+    result = simulate.simulate(200, 4, 30, p_bid=0, p_repay=0, seed=1)
+    assert (result.net_worth.sum(axis=1) == 4 * DEFAULT_BALANCE).all()
+    assert (result.interest_paid == 0).all()
+
+
+def test_cards_that_cannot_cover_their_loans_go_bankrupt():
+    result = simulate.simulate(100, 2, 20, p_rent=1, rent=(DEFAULT_BALANCE, DEFAULT_BALANCE),
+                               p_bid=0, p_loan=0, p_repay=0, seed=3)
+    assert not result.bankrupt.any()
+    result = simulate.simulate(100, 2, 20, p_rent=0, p_bid=1, bid=(DEFAULT_BALANCE, DEFAULT_BALANCE),
+                               p_loan=1, loan=(DEFAULT_BALANCE, DEFAULT_BALANCE), p_repay=0, seed=3)
+    assert result.bankrupt.all()
+    assert (result.bankrupt_round >= 0).all()
+    assert result.summary()["card_bankruptcy_rate"] == 1.0
+
+
+def test_a_game_needs_two_cards():
+    with pytest.raises(ValueError):
+        simulate.simulate(1, 1, 1)
+
+
+def test_gini():
+    assert simulate.gini(np.array([5, 5, 5])) == 0
+    assert simulate.gini(np.array([0, 0, 10])) == pytest.approx(2 / 3)
+    assert simulate.gini(np.array([])) == 0
+
+
+def test_main_sweeps_the_rates(capsys):
+    assert simulate.main(["--games", "20", "--rounds", "5", "--step-rate", "0", "0.02", "--seed", "1"]) == 0
+    out = capsys.readouterr().out
+    assert "base_rate=0.05 step_rate=0\n" in out
+    assert "base_rate=0.05 step_rate=0.02\n" in out
+    assert out.count("card_bankruptcy_rate") == 2
@@ -0,0 +1,169 @@
+import pytest
+
+import ledger
+from ledger import DEFAULT_BALANCE, Ledger, Terminal, parse_script, replay
+
+
+def make_terminal(cards=2):
+    return Terminal(Ledger.with_cards(cards, clock=lambda: 0))
+
+
+def run(terminal, script):
+    replay(terminal, parse_script(script.splitlines()))
+    return terminal
+
+
+def test_transfer_flow():
+    terminal = run(make_terminal(), """
+        transfer
+        tap card1
+        amount 500
+        tap card2
+    """)
+    assert terminal.ledger.balances == [DEFAULT_BALANCE - 500, DEFAULT_BALANCE + 500]
+    assert terminal.message == "Transferred $500 from Card 1 to Card 2"
+    assert terminal.notification == ("Transferred $500 successfully", "success")
+
+
+def test_a_transfer_the_sender_cannot_afford_stops_at_the_amount():
+    terminal = run(make_terminal(), """
+        transfer
+        tap card1
+        amount 1500001
+    """)
+    assert terminal.mode == "transfer_amount"
+    assert terminal.notification == ("Insufficient funds", "error")
+
+
+def test_loan_and_repay_flow():
+    terminal = run(make_terminal(), """
+        loan
+        tap card1
+        amount 1000
+        bidding
+        tap card1
+        amount 10
+        confirmbid
+        tap card1
+        repay
+        tap card1
+    """)
+    assert terminal.message == "Repaid $1.05K (incl. $50 interest)"
+    assert terminal.ledger.balances[0] == DEFAULT_BALANCE - 10 - 50
+    assert terminal.ledger.unpaid_principal == [0, 0]
+
+
+def test_tapping_a_card_shows_what_it_owes():
+    terminal = run(make_terminal(), """
+        bidding
+        tap card2
+        amount 10
+        confirmbid
+        tap card2
+        tap card2
+    """)
+    assert terminal.message == "Please repay 1"
+
+
+def test_unknown_cards_are_refused():
+    terminal = run(make_terminal(), "transfer\ntap card9")
+    assert terminal.mode == "transfer_sender"
+    assert terminal.notification == ("Unknown card", "error")
+
+
+def test_keypad():
+    terminal = make_terminal()
+    for key in ("0", "1", "2", "000", "3"):
+        terminal.press(key)
+    assert terminal.keypad == "120003"
+    terminal.backspace()
+    assert terminal.keypad == "12000"
+    terminal.clear()
+    assert terminal.keypad == "0"
+    for _ in range(20):
+        terminal.press("9")
+    assert terminal.keypad == "9" * ledger.MAX_AMOUNT_DIGITS
+
+
+def test_parse_script():
+    steps = parse_script([
+        "transfer   # start",
+        "",
+        "tap card1",
+        "amount 500",
+        "  inc 1000  ",
+        "confirmbid",
+    ])
+    assert steps == [("transfer", None), ("tap", "card1"), ("amount", 500), ("inc", 1000), ("confirmbid", None)]
+
+
+@pytest.mark.parametrize("line, message", [
+    ("fly away", "line 1: unknown action 'fly'"),
+    ("tap", "line 1: tap needs an argument"),
+    ("amount five", "invalid literal"),
+])
+def test_parse_script_rejects_bad_lines(line, message):
+    with pytest.raises(ValueError, match=message):
+        parse_script([line])
+
+
+def test_replay_counts_every_action():
+    terminal = make_terminal()
+    stats = replay(terminal, parse_script(["transfer", "tap card1", "amount 1", "tap card2"]), repeat=3)
+    assert {name: count for name, (count, _) in stats.items()} == {"transfer": 3, "tap": 6, "amount": 3}
+    assert terminal.ledger.balances == [DEFAULT_BALANCE - 3, DEFAULT_BALANCE + 3]
+
+
+def test_main_replays_a_script_file(tmp_path, capsys):
+    script = tmp_path / "taps.txt"
+    script.write_text("transfer\ntap card3\namount 5\ntap card1\n")
+    assert ledger.main([str(script), "--cards", "3", "--repeat", "4"]) == 0
+    out = capsys.readouterr().out
+    assert out.startswith("16 actions in ")
+    assert "tap" in out and "transfer" in out
+
+
+def test_an_auction_goes_to_the_highest_bid():
+    terminal = run(make_terminal(3), """
+        bidding
+        tap card1
+        amount 100
+        tap card2
+        inc 50
+        tap card3
+        inc 25
+        tap card2
+        inc 25
+        confirmbid
+        tap card3
+    """)
+    assert terminal.message == "Winning bid is Card 2's"
+    run(terminal, "tap card2")
+    assert terminal.ledger.balances == [DEFAULT_BALANCE, DEFAULT_BALANCE - 200, DEFAULT_BALANCE]
+    assert terminal.notification == ("Bid of $200 paid successfully", "success")
+
+
+def test_resetting_the_bids_reopens_the_lot_for_its_opener():
+    terminal = run(make_terminal(), """
+        bidding
+        tap card1
+        amount 100
+        tap card2
+        inc 500
+        resetbid
+        confirmbid
+        tap card1
+    """)
+    assert terminal.ledger.balances == [DEFAULT_BALANCE - 100, DEFAULT_BALANCE]
+
+
+def test_a_bidder_who_cannot_pay_is_refused():
+    terminal = run(make_terminal(), """
+        bidding
+        tap card1
+        amount 100
+        tap card2
+        inc 1500000
+    """)
+    assert terminal.message == "Card 2 cannot afford that bid"
+    assert terminal.current_bid == 100